@@ -3,6 +3,7 @@ import os
 import pathlib
 import time
 import traceback
+import typing
 import logging
 import aiohttp
 import combined_log
@@ -23,7 +24,7 @@ def cleanup():
 class GithubUpdater:
 
     def __init__(self, owner: str, repo: str, restart_callback=None,
-                 update_available_callback: asyncio.coroutine = None,
+                 update_available_callback: typing.Callable = None,
                  logging: combined_log.CombinedLogger = None):
         self.repo = repo
         self.owner = owner
@@ -35,6 +36,8 @@ class GithubUpdater:
         self.bucket_reset = 0  # Unix timestamp for when the ratelimit bucket will be reset
         self.bucket_used = 0  # How many requests have been used in the bucket
         self.bucket_max = 10  # The maximum number of requests in the bucket
+        self.checks = 0  # Release checks made, read by the metrics endpoint
+        self.check_failures = 0
         cleanup()
 
     async def _get_latest_release(self):
@@ -42,6 +45,7 @@ class GithubUpdater:
         if self.bucket_remaining == 0:
             raise Exception("Ratelimit reached")
 
+        self.checks += 1
         async with aiohttp.ClientSession() as session:
             async with session.get(f"https://api.github.com/repos/{self.owner}/{self.repo}/releases/latest") as resp:
                 # Get the ratelimit
@@ -82,6 +86,7 @@ class GithubUpdater:
                     continue
 
                 if "tag_name" not in latest_release:
+                    self.check_failures += 1
                     self.logging.error(f"No latest release tag found{latest_release}")
                     await asyncio.sleep(5)
                     continue
@@ -107,6 +112,7 @@ class GithubUpdater:
                 else:
                     self.new_version_available = False
             except Exception as e:
+                self.check_failures += 1
                 self.logging.error(f"Failed to check for updates: {e}\n{traceback.format_exc()}")
             finally:
                 await asyncio.sleep(120)
@@ -0,0 +1,219 @@
+"""Standalone process running the data side of the skin once for every skin instance that connects to it
+
+    python collector.py --port 47680 --rows 4
+
+The collector polls qBittorrent, talks to the inhibitor and checks for updates exactly like the in-process
+interface does, then streams every render to the connected skins over a local socket. Skins point their Info
+measure at it with Collector=127.0.0.1:47680 and become thin clients (collector_client.py).
+
+Frames are the inhibitor's JSON messages terminated by \\n\\r. The collector sends
+    {"msg_type": "snapshot", "bang": ..., "progress": [...]}    after every render
+    {"msg_type": "execute", "bang": ...}                         for everything else the interface executes
+    {"msg_type": "progress", "progress": [...]}                  when the estimates between polls move the rows
+and the clients send
+    {"msg_type": "hello", "rows": 4, "skin": ...}                once connected
+    {"msg_type": "bang", "args": ...}                            for every !CommandMeasure
+"""
+import argparse
+import asyncio
+import logging
+import os
+import pathlib
+import traceback
+
+import combined_log
+import slot_values
+from helpers import APIMessageTX, APIMessageRX
+
+frame_end = b"\n\r"
+frame_limit = 4 * 1024 * 1024  # A full render of a large page is well under this
+default_port = 47680
+
+
+class CollectorRainmeter:
+    """Takes the place of the rm object for an interface running in the collector, executes go to the clients"""
+
+    LOG_ERROR = 1
+    LOG_WARNING = 2
+    LOG_NOTICE = 3
+    LOG_DEBUG = 4
+
+    def __init__(self, collector, options=None, echo_logs=False):
+        self.collector = collector
+        self.options = options if options is not None else {}
+        self.echo_logs = echo_logs
+
+    def RmExecute(self, bang: str) -> None:
+        self.collector.broadcast(APIMessageTX(msg_type="execute", bang=bang))
+
+    def RmLog(self, level: int, message: str) -> None:
+        # The log file already has it, CombinedRotatingFileHandler calls this for every record
+        if self.echo_logs:
+            print(f"[{level}] {message}")
+
+    def RmReadString(self, option: str, default: str = "", replace_measures: bool = True) -> str:
+        return str(self.options.get(option, default))
+
+    def RmReadInt(self, option: str, default: int = 0) -> int:
+        return int(self.options.get(option, default))
+
+
+class Collector:
+    """Serves one RainMeterInterface to any number of skins
+
+    All clients share the interface, so paging, sorting and filtering from one skin is seen by every skin.
+    """
+
+    def __init__(self, event_loop, logging: combined_log.CombinedLogger, host: str = "127.0.0.1",
+                 port: int = default_port, rows: int = 4, config_dir=None, options=None, echo_logs=False,
+                 max_buffer: int = 8 * 1024 * 1024):
+        self.event_loop = event_loop
+        self.logging = logging
+        self.host = host
+        self.port = port
+        self.rows = rows
+        self.config_dir = config_dir
+        self.max_buffer = max_buffer  # A client that falls this far behind is dropped
+        self.rainmeter = CollectorRainmeter(self, options=options, echo_logs=echo_logs)
+        self.interface = None
+        self.server = None
+        self.clients = {}  # writer -> skin name
+        self.snapshot = None  # The last snapshot sent, new clients get it straight away
+        self.progress = None  # The row progress last sent, in a snapshot or on its own
+        self.sent = 0
+
+    async def start(self):
+        import rm_interface  # Only the collector process needs the whole data side
+        self.server = await asyncio.start_server(self._serve, self.host, self.port, limit=frame_limit)
+        self.logging.info(f"Collector listening on {self.host}:{self.port}")
+        self.interface = rm_interface.RainMeterInterface(self.rainmeter, self.event_loop, self.logging,
+                                                         config_dir=self.config_dir, rows=self.rows,
+                                                         on_render=self.on_render, queue_renders=False)
+        self.interface.metrics_sources.append(self.write_metrics)
+        if self.interface.interpolate:
+            self.interface.supervisor.supervise("estimate", self.estimate)
+
+    def write_metrics(self, out):
+        """The collector's own samples on the interface's metrics endpoint"""
+        out.gauge("collector_clients", "Skins connected to the collector", len(self.clients))
+        out.counter("collector_frames_total", "Frames broadcast to the connected skins", self.sent)
+
+    def on_render(self, interface):
+        """Called by the interface after every render"""
+        self.progress = [slot_values.get(i) for i in range(self.rows)]
+        snapshot = APIMessageTX(msg_type="snapshot", bang=interface.bang_string, progress=self.progress)
+        if self.snapshot is not None and snapshot.kwargs == self.snapshot.kwargs:
+            return
+        self.snapshot = snapshot
+        self.broadcast(snapshot)
+
+    async def estimate(self):
+        """Move the rows on between polls once a second, the skins' Update, like the in-process interface does
+
+        The changed options go out as an execute and the bars' progress in a message of its own.
+        """
+        while True:
+            await asyncio.sleep(1.0)
+            self.interface.estimate_rows()
+            progress = [slot_values.get(i) for i in range(self.rows)]
+            if progress != self.progress:
+                self.progress = progress
+                self.broadcast(APIMessageTX(msg_type="progress", progress=progress))
+
+    def broadcast(self, message: APIMessageTX):
+        frame = message.encode('utf-8')
+        for writer, skin in list(self.clients.items()):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.logging.warning(f"Dropping collector client {skin}, it stopped reading")
+                self._drop(writer)
+                continue
+            writer.write(frame)
+        self.sent += 1
+
+    def _drop(self, writer: asyncio.StreamWriter):
+        self.clients.pop(writer, None)
+        writer.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info('peername')
+        self.clients[writer] = str(peer)
+        self.logging.info(f"Collector client connected from {peer}")
+        if self.snapshot is not None:
+            writer.write(self.snapshot.encode('utf-8'))
+        try:
+            while True:
+                try:
+                    frame = await reader.readuntil(frame_end)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    message = APIMessageRX(frame[:-len(frame_end)])
+                except Exception:
+                    self.logging.warning(f"Invalid frame from collector client {peer}")
+                    continue
+                await self.handle(writer, message)
+        except (ConnectionError, asyncio.LimitOverrunError) as e:
+            self.logging.info(f"Collector client {peer} went away: {e!r}")
+        except Exception as e:
+            self.logging.error(f"Error serving collector client {peer}: {e}\n{traceback.format_exc()}")
+        finally:
+            self._drop(writer)
+            self.logging.info(f"Collector client {peer} disconnected, {len(self.clients)} left")
+
+    async def handle(self, writer: asyncio.StreamWriter, message: APIMessageRX):
+        msg_type = getattr(message, 'msg_type', None)
+        if msg_type == "hello":
+            self.clients[writer] = getattr(message, 'skin', self.clients[writer])
+            rows = getattr(message, 'rows', self.rows)
+            if rows != self.rows:
+                self.logging.warning(f"{self.clients[writer]} has {rows} rows, the collector renders {self.rows}")
+        elif msg_type == "bang":
+            if self.interface is not None:
+                await self.interface.execute_bang(message.args)
+        else:
+            self.logging.warning(f"Unknown collector message: {message}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for writer in list(self.clients):
+            self._drop(writer)
+        if self.interface is not None:
+            await self.interface.tear_down()
+            self.interface = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--rows", type=int, default=4, help="The Rows option of the skins' Info measure")
+    parser.add_argument("--config-dir", default=None, help="Where secrets.json and settings.json live")
+    parser.add_argument("--python-home", default="", help="Passed to the updater like the PythonHome option")
+    parser.add_argument("--verbose", action="store_true", help="Echo the log to the console")
+    args = parser.parse_args()
+
+    log = combined_log.CombinedLogger(
+        name="Collector", level=logging.DEBUG if args.verbose else logging.INFO,
+        formatter=r"%(asctime)s - %(levelname)s - Thread: %(threadName)s - %(name)s - %(funcName)s - %(message)s")
+    config_dir = args.config_dir or str(pathlib.Path(__file__).parent.resolve())
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    collector = Collector(event_loop, log, host=args.host, port=args.port, rows=args.rows,
+                          config_dir=os.path.abspath(config_dir), echo_logs=args.verbose,
+                          options={"PythonHome": args.python_home} if args.python_home else None)
+    try:
+        event_loop.run_until_complete(collector.start())
+        event_loop.run_forever()
+    except KeyboardInterrupt:
+        log.info("Collector interrupted")
+    finally:
+        event_loop.run_until_complete(collector.stop())
+        event_loop.close()
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import pathlib
+import traceback
+
+import combined_log
+import slot_values
+from collector import frame_end, frame_limit
+from command_queue import CommandQueue
+from helpers import APIMessageTX, APIMessageRX
+from supervisor import Supervisor
+
+
+class CollectorClient:
+    """Stands in for RainMeterInterface when the skin's data comes from a collector process
+
+    Nothing is polled or formatted here, the client queues the collector's renders and executes for Rainmeter,
+    publishes its progress values for the ProgressSlot measures and forwards bangs.
+    """
+
+    def __init__(self, rainmeter, event_loop, logging: combined_log.CombinedLogger, host: str, port: int,
+                 rows: int = 4, skin: str = "QBT_rainmeter_skin", config_dir=None, autostart=True,
+                 max_delay: float = 10.0, slot_source: str = ""):
+        self.logging = logging
+        self.config_dir = pathlib.Path(__file__).parent.resolve() if config_dir is None else config_dir
+        # Log.log belongs to the collector when it runs from the same folder
+        self.logging.change_log_file(os.path.join(self.config_dir, "Logs/Client.log"))
+        self.rainmeter = rainmeter
+        self.event_loop = event_loop
+        self.commands = CommandQueue(rainmeter, event_loop, self.logging)
+        self.host = host
+        self.port = port
+        self.rows = rows
+        self.skin = skin
+        self.max_delay = max_delay  # Longest wait between reconnects
+        self.slot_source = slot_source  # The Source option the skin's ProgressSlot measures read the rows from
+        self.running = True
+        self.connected = False
+        self.bang_string = self._waiting_bang()
+        self.commands.put(self.bang_string)
+        self.reader = None
+        self.writer = None
+        self.write_lock = asyncio.Lock()
+        self.snapshots = 0
+        self.supervisor = Supervisor(self.event_loop, self.logging)
+        if autostart:
+            self.supervisor.supervise("collector", self.run)
+
+    def _waiting_bang(self) -> str:
+        return f"[!SetOption ConnectionMeter Text \"Waiting for the collector at {self.host}:{self.port}\"]"
+
+    def get_bang(self) -> str:
+        """Called by the rainmeter plugin to get the current display string"""
+        return self.bang_string
+
+    def get_string(self) -> str:
+        return ""
+
+    def update(self):
+        """Called by the rainmeter plugin on every Update, sends whatever is still waiting for its frame"""
+        self.commands.flush()
+
+    async def run(self):
+        """Stay connected to the collector, reconnecting with a growing delay while it is unreachable"""
+        delay = 0.5
+        while self.running:
+            try:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=frame_limit)
+            except OSError as e:
+                self.logging.debug(f"Collector at {self.host}:{self.port} unreachable: {e}")
+                await asyncio.sleep(delay)
+                delay = min(self.max_delay, delay * 2)
+                continue
+            delay = 0.5
+            self.connected = True
+            self.logging.info(f"Connected to the collector at {self.host}:{self.port}")
+            try:
+                await self._send(APIMessageTX(msg_type="hello", rows=self.rows, skin=self.skin))
+                await self._listen(self.reader)
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+                self.logging.warning(f"Lost the collector: {e!r}")
+            finally:
+                self.connected = False
+                self._close_writer()
+                self.bang_string = self._waiting_bang()
+                self.commands.put(self.bang_string)
+                slot_values.publish((), self.slot_source)
+
+    async def _listen(self, reader: asyncio.StreamReader):
+        while self.running:
+            frame = await reader.readuntil(frame_end)
+            try:
+                message = APIMessageRX(frame[:-len(frame_end)])
+            except Exception:
+                self.logging.warning("Invalid frame from the collector")
+                continue
+            msg_type = getattr(message, 'msg_type', None)
+            if msg_type == "snapshot":
+                slot_values.publish(message.progress, self.slot_source)
+                self.bang_string = message.bang
+                self.commands.put(message.bang)
+                self.snapshots += 1
+            elif msg_type == "execute":
+                self.commands.put(message.bang)
+            elif msg_type == "progress":
+                slot_values.publish(message.progress, self.slot_source)
+            else:
+                self.logging.warning(f"Unknown collector message: {message}")
+
+    async def _send(self, message: APIMessageTX):
+        async with self.write_lock:
+            self.writer.write(message.encode('utf-8'))
+            await self.writer.drain()
+
+    async def execute_bang(self, bang):
+        """Called by the rainmeter plugin, the collector runs the bang and sends back what changed"""
+        try:
+            if not self.connected:
+                self.logging.warning(f"Not connected to the collector, dropping bang {bang}")
+                return
+            await self._send(APIMessageTX(msg_type="bang", args=bang))
+        except Exception as e:
+            self.logging.error(f"Failed to forward bang: {e}\n{traceback.format_exc()}")
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.reader = None
+
+    async def tear_down(self):
+        """Call this when the plugin is being unloaded"""
+        self.running = False
+        self.supervisor.cancel_all()
+        slot_values.discard(self.slot_source)
+        writer = self.writer
+        self._close_writer()
+        self.commands.close()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except Exception as e:
+                self.logging.debug(f"Error closing the collector connection: {e}")
@@ -1,4 +1,5 @@
 import logging
+import os
 from logging import LogRecord
 from logging.handlers import RotatingFileHandler
 
@@ -59,12 +60,21 @@ class CombinedLogger(logging.Logger):
                 handler.setRMObject(rainmeter)
                 break
 
+    def close(self):
+        """Close and remove every handler, the log file is released"""
+        for handler in list(self.handlers):
+            self.removeHandler(handler)
+            handler.close()
+
     def change_log_file(self, filename: str):
         for handler in self.handlers:
             if isinstance(handler, CombinedRotatingFileHandler):
+                # Closed as well as removed, otherwise every reload would leave the old log file open
                 self.removeHandler(handler)
+                handler.close()
                 break
         self.filename = filename
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
         self.addHandler(CombinedRotatingFileHandler(filename=filename, mode=self.mode, encoding=self.encoding,
                                                     delay=self.delay,
                                                     formatter=self.formatter))
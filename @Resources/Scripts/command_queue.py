@@ -0,0 +1,151 @@
+"""The one way out to Rainmeter, every bang the script sends is queued here and sent as one RmExecute per frame
+
+Within a frame a later !SetOption for the same meter and option replaces the earlier one, as does a later
+!ShowMeter or !HideMeter for the same meter, and all the !Redraws asked for become a single one at the end.
+Nothing is compared with earlier frames, the skin's own actions change some of the same meters.
+"""
+import re
+import threading
+import traceback
+
+import combined_log
+
+# The bracketed commands of a bang string, quoted (or triple quoted) arguments may hold brackets
+_commands = re.compile(r'\[((?:"""[\s\S]*?"""|"[^"]*"|[^\]"])*)\]')
+_arguments = re.compile(r'"""([\s\S]*?)"""|"([^"]*)"|(\S+)')
+# Commands that only ever bring a meter to the same end state, a repeat replaces the earlier one
+_visibility = frozenset(('!showmeter', '!hidemeter'))
+_group_visibility = frozenset(('!showmetergroup', '!hidemetergroup'))
+_idempotent = frozenset(('!updatemeter', '!updatemetergroup', '!updatemeasure', '!updatemeasuregroup'))
+
+
+def split_bang(bang: str) -> list:
+    """The commands of a bang string without their brackets, a string without brackets is a single command"""
+    commands = _commands.findall(bang)
+    if not commands and bang.strip():
+        return [bang.strip()]
+    return commands
+
+
+def _arguments_of(command: str) -> list:
+    return [next(group for group in match if group) if any(match) else ""
+            for match in _arguments.findall(command)]
+
+
+def _key(command: str):
+    """What a command overrides, or None for one that always goes out as it is"""
+    arguments = _arguments_of(command)
+    if not arguments:
+        return None
+    name = arguments[0].lower()
+    if name == '!redraw':
+        return name
+    if name == '!setoption' and len(arguments) >= 4:
+        return (name, arguments[1].lower(), arguments[2].lower(), arguments[4].lower() if len(arguments) > 4 else "")
+    if name in _visibility and len(arguments) >= 2:
+        return ('visibility', arguments[1].lower(), arguments[2].lower() if len(arguments) > 2 else "")
+    if name in _group_visibility and len(arguments) >= 2:
+        return ('group visibility', arguments[1].lower(), arguments[2].lower() if len(arguments) > 2 else "")
+    if name in _idempotent:
+        return command.lower()
+    return None
+
+
+class CommandQueue:
+    """Bangs from any thread, merged and sent once a frame from the event loop or by Rain.Update, whichever
+    comes first
+
+    frame is how long the first bang of a frame waits for others to join it, the skin redraws every 100 ms.
+    """
+
+    def __init__(self, rainmeter, event_loop=None, logging: combined_log.CombinedLogger = None,
+                 frame: float = 0.05):
+        self.rainmeter = rainmeter
+        self.event_loop = event_loop
+        self.logging = logging
+        self.frame = frame
+        self.lock = threading.Lock()
+        self.pending = {}  # key -> command, in the order they go out
+        self.redraw = False
+        self.scheduled = False
+        self.unique = 0  # Keys for the commands that are never merged
+        self.queued = 0  # Commands put in the queue
+        self.merged = 0  # Commands that replaced an earlier one in the same frame
+        self.frames = 0  # RmExecute calls made
+
+    def put(self, bang: str):
+        """Queue every command of a bang string"""
+        if not bang:
+            return
+        with self.lock:
+            for command in split_bang(bang):
+                self._add(_key(command), command)
+        self._schedule()
+
+    def set_options(self, values: dict):
+        """Queue a !SetOption for every {meter: {option: value}}, the way a render is laid out"""
+        with self.lock:
+            for meter, options in values.items():
+                for option, value in options.items():
+                    self._add(('!setoption', meter.lower(), option.lower(), ""),
+                              f"!SetOption {meter} {option} \"{value}\"")
+        self._schedule()
+
+    def show_meters(self, meters: dict):
+        """Queue a !ShowMeter or !HideMeter for every {meter: visible}"""
+        with self.lock:
+            for meter, visible in meters.items():
+                self._add(('visibility', meter.lower(), ""), f"!{'Show' if visible else 'Hide'}Meter {meter}")
+        self._schedule()
+
+    def _add(self, key, command: str):
+        self.queued += 1
+        if key == '!redraw':
+            self.merged += self.redraw
+            self.redraw = True
+            return
+        if key is None:
+            self.unique += 1
+            key = self.unique
+        elif key in self.pending:
+            # Goes out where the latest one was asked for, after whatever was queued in between
+            del self.pending[key]
+            self.merged += 1
+        self.pending[key] = command
+
+    def _schedule(self):
+        if self.event_loop is None or self.scheduled:
+            return
+        self.scheduled = True
+        try:
+            self.event_loop.call_soon_threadsafe(self.event_loop.call_later, self.frame, self.flush)
+        except RuntimeError:
+            self.scheduled = False  # The loop is closed, Rain.Update or close() still flush
+
+    def take(self) -> str:
+        """Everything queued as one bang string, emptying the queue"""
+        with self.lock:
+            commands = list(self.pending.values())
+            if self.redraw:
+                commands.append("!Redraw")
+            self.pending = {}
+            self.redraw = False
+            self.scheduled = False
+        return "".join(f"[{command}]" for command in commands)
+
+    def flush(self):
+        """Send the frame, safe to call from any thread and when there is nothing queued"""
+        bang = self.take()
+        if not bang:
+            return
+        self.frames += 1
+        try:
+            self.rainmeter.RmExecute(bang)
+        except Exception as e:
+            if self.logging is not None:
+                self.logging.error(f"RmExecute failed: {e}\n{traceback.format_exc()}")
+
+    def close(self):
+        """Send what is left and stop scheduling frames on the event loop"""
+        self.event_loop = None
+        self.flush()
@@ -0,0 +1,131 @@
+"""Memory leak diagnostics, started and stopped with the diagnostics_start and diagnostics_stop bangs
+
+While running, a tracemalloc snapshot is taken every interval seconds and a report is appended to
+Logs/diagnostics.log: the lines whose allocations grew the most since diagnostics started, and live counts
+of the event loop's tasks, open sockets and logging handlers. diagnostics_snapshot writes a report straight
+away. Tracing costs memory and time on every allocation, it is only on between the two bangs.
+"""
+import asyncio
+import collections
+import gc
+import logging
+import os
+import socket
+import time
+import tracemalloc
+import traceback
+
+import combined_log
+
+default_path = "Logs/diagnostics.log"
+# Allocations made by the tracing itself and by imports say nothing about the plugin
+_ignored = (tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"))
+
+
+def task_counts(event_loop) -> collections.Counter:
+    """Unfinished tasks on the loop by coroutine name, call it on the loop's thread"""
+    return collections.Counter(task.get_coro().__qualname__ for task in asyncio.all_tasks(event_loop)
+                               if not task.done())
+
+
+def object_counts(logger: logging.Logger) -> dict:
+    """Open sockets and logging handlers still alive, whether or not anything still uses them"""
+    sockets = handlers = open_handlers = 0
+    for obj in gc.get_objects():
+        if isinstance(obj, socket.socket):
+            sockets += obj.fileno() != -1
+        elif isinstance(obj, logging.Handler):
+            handlers += 1
+            open_handlers += getattr(obj, 'stream', None) is not None
+    return {'sockets': sockets, 'handlers': handlers, 'open handlers': open_handlers,
+            'handlers on the plugin log': len(logger.handlers)}
+
+
+class Diagnostics:
+
+    def __init__(self, event_loop, logging: combined_log.CombinedLogger, path: str, interval: float = 60.0,
+                 top: int = 25, frames: int = 1):
+        self.event_loop = event_loop
+        self.logging = logging
+        self.path = path
+        self.interval = interval
+        self.top = top
+        self.frames = frames  # Stack frames kept per allocation, more tell callers apart but cost more
+        self.started_tracing = False  # Whether tracemalloc was started here and so is stopped here too
+        self.baseline = None
+        self.started_at = None
+        self.reports = 0
+
+    @property
+    def running(self) -> bool:
+        return self.baseline is not None
+
+    def start(self):
+        """Start tracing and take the snapshot every report is compared with"""
+        if self.running:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started_tracing = True
+        self.baseline = tracemalloc.take_snapshot().filter_traces(_ignored)
+        self.started_at = time.time()
+        self.reports = 0
+        self.logging.info(f"Diagnostics started, reporting to {self.path} every {self.interval:.0f}s")
+
+    async def run(self):
+        """Write a report every interval seconds, main.py runs it under a Supervisor that logs and restarts it"""
+        while self.running:
+            await asyncio.sleep(self.interval)
+            await self.report()
+
+    async def report(self):
+        """Snapshot now and append the report, the snapshot and comparison run on a worker thread"""
+        if not self.running:
+            return
+        tasks = task_counts(self.event_loop)
+        try:
+            await self.event_loop.run_in_executor(None, self._write_report, tasks)
+        except Exception as e:
+            self.logging.error(f"Unable to write diagnostics: {e}\n{traceback.format_exc()}")
+
+    def stop(self):
+        """Write a last report and stop tracing if it was started here"""
+        if not self.running:
+            return
+        try:
+            self._write_report(task_counts(self.event_loop))
+        except Exception as e:
+            self.logging.error(f"Unable to write diagnostics: {e}\n{traceback.format_exc()}")
+        self.baseline = None
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        self.logging.info("Diagnostics stopped")
+
+    def _write_report(self, tasks: collections.Counter):
+        baseline = self.baseline
+        if baseline is None:
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces(_ignored)
+        growth = sorted((stat for stat in snapshot.compare_to(baseline, 'lineno') if stat.size_diff > 0),
+                        key=lambda stat: stat.size_diff, reverse=True)
+        current, peak = tracemalloc.get_traced_memory()
+        counts = object_counts(self.logging)
+        self.reports += 1
+        lines = [f"=== Report {self.reports} at {time.strftime('%Y-%m-%d %H:%M:%S')}, "
+                 f"{(time.time() - self.started_at) / 60:.1f} minutes after diagnostics started",
+                 f"Traced memory {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB",
+                 f"Tasks {sum(tasks.values())}: " +
+                 ", ".join(f"{name} x{count}" for name, count in tasks.most_common()),
+                 "Live " + ", ".join(f"{name} {count}" for name, count in counts.items()),
+                 f"Top {self.top} allocation growth by line since diagnostics started:"]
+        for stat in growth[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(f"  {stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  "
+                         f"{frame.filename}:{frame.lineno}")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n\n")
@@ -1,6 +1,20 @@
 import json
+import struct
 import typing
 
+frame_end = b"\n\r"
+
+# The compact inhibitor codec, a client asks for it with codecs=["compact"] in its handshake and a server that
+# speaks it answers new_conn with codec="compact". Everything after that goes out as a 5 byte header (message
+# type id, payload length) and a payload packed with the message's schema. Messages without a schema, or with
+# fields it doesn't know, are sent as JSON inside the frame (type id 0). A JSON frame always starts with "{"
+# and a compact one never does, so once compact is agreed a reader still takes either. Until then every frame is
+# read up to its terminator, a stray byte costs one frame instead of being taken for a header.
+compact = "compact"
+max_frame = 65536  # Longest compact payload taken, a longer length means the stream is corrupt
+_header = struct.Struct(">BI")
+_length = struct.Struct(">H")
+
 
 class APIMessageTX:
 
@@ -11,9 +25,11 @@ class APIMessageTX:
         """Dump the api content to json"""
         return json.dumps(self.kwargs)
 
-    def encode(self, encoding):
+    def encode(self, encoding, codec: str = "json"):
         """Encode the api content to bytes"""
-        return self.__str__().encode(encoding) + b"\n\r"
+        if codec == compact:
+            return encode_compact(self.kwargs)
+        return self.__str__().encode(encoding) + frame_end
 
 
 class APIMessageRX:
@@ -34,4 +50,193 @@ class APIMessageRX:
 
     def encode(self, encoding):
         """Encode the api content to bytes"""
-        return self.__str__().encode(encoding) + b"\n\r"
+        return self.__str__().encode(encoding) + frame_end
+
+
+class Message:
+    """A message of a known type, its fields are fixed and those the sender left out hold None"""
+    __slots__ = ()
+    msg_type = None
+    type_id = 0
+    kinds = ()  # One of "bool", "str" or "strs" per field, at most 8 fields fit the presence byte
+    fields = ()  # The slots of the class and of every class it derives from, base classes' first
+    layout = ()  # (bit, name, kind) per field, worked out once per class
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.fields = tuple(name for klass in reversed(cls.__mro__) for name in klass.__dict__.get('__slots__', ()))
+        assert len(cls.fields) == len(cls.kinds) <= 8, cls.__name__
+        cls.layout = tuple((1 << bit, name, kind) for bit, (name, kind) in enumerate(zip(cls.fields, cls.kinds)))
+        cls.names = frozenset(cls.fields) | {"msg_type"}
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "Message":
+        message = cls.__new__(cls)
+        for name in cls.fields:
+            setattr(message, name, values.get(name))
+        return message
+
+    def to_dict(self) -> dict:
+        values = {"msg_type": self.msg_type}
+        for name in self.fields:
+            value = getattr(self, name)
+            if value is not None:
+                values[name] = value
+        return values
+
+    def __str__(self):
+        return json.dumps(self.to_dict())
+
+    __repr__ = __str__
+
+
+class StateUpdate(Message):
+    __slots__ = ('inhibiting', 'inhibited_by', 'qbt_connection', 'plex_connection', 'net_connection', 'message',
+                 'version')
+    msg_type = "state_update"
+    type_id = 1
+    kinds = ("bool", "strs", "bool", "bool", "bool", "str", "str")
+
+
+class Refresh(Message):
+    __slots__ = ('token',)
+    msg_type = "refresh"
+    type_id = 2
+    kinds = ("str",)
+
+
+class Ack(Message):
+    __slots__ = ()
+    msg_type = "ack"
+    type_id = 3
+
+
+class NewVersion(Message):
+    __slots__ = ('new_version', 'old_version')
+    msg_type = "new_version"
+    type_id = 4
+    kinds = ("str", "str")
+
+
+class NewConn(Message):
+    __slots__ = ('token', 'codec')
+    msg_type = "new_conn"
+    type_id = 5
+    kinds = ("str", "str")
+
+
+class RenewConn(NewConn):
+    __slots__ = ()
+    msg_type = "renew_conn"
+    type_id = 6
+
+
+schemas = {cls.msg_type: cls for cls in (StateUpdate, Refresh, Ack, NewVersion, NewConn, RenewConn)}
+_by_id = {cls.type_id: cls for cls in schemas.values()}
+
+
+def encode_compact(values: dict) -> bytes:
+    """A compact frame for a message, JSON inside the frame when its schema can't hold it"""
+    cls = schemas.get(values.get("msg_type"))
+    if cls is not None and values.keys() <= cls.names:
+        present = flags = 0
+        parts = []
+        for bit, name, kind in cls.layout:
+            value = values.get(name)
+            if value is None:
+                continue
+            present |= bit
+            if kind == "bool":
+                if value.__class__ is not bool:
+                    break
+                if value:
+                    flags |= bit
+            elif kind == "str":
+                if value.__class__ is not str or len(value) > 16383:  # 16383 characters fill the 2 byte length
+                    break
+                data = value.encode('utf-8')
+                parts.append(_length.pack(len(data)) + data)
+            else:
+                if not isinstance(value, (list, tuple)) or len(value) > 255:
+                    break
+                parts.append(bytes((len(value),)))
+                for item in value:
+                    if item.__class__ is not str or len(item) > 16383:
+                        break
+                    data = item.encode('utf-8')
+                    parts.append(_length.pack(len(data)) + data)
+                else:
+                    continue
+                break
+        else:
+            payload = bytes((present, flags)) + b"".join(parts)
+            return _header.pack(cls.type_id, len(payload)) + payload
+    payload = json.dumps(values).encode('utf-8')
+    return _header.pack(0, len(payload)) + payload
+
+
+def decode_json(frame: typing.Union[str, bytes]):
+    """A JSON frame as its Message, or as an APIMessageRX when the type has no schema"""
+    if isinstance(frame, bytes):
+        frame = frame.decode('utf-8')  # json.loads is quicker on str than working the encoding out itself
+    try:
+        values = json.loads(frame)
+    except json.decoder.JSONDecodeError:
+        raise Exception("Invalid JSON")
+    if not isinstance(values, dict):
+        raise Exception("Invalid JSON")
+    cls = schemas.get(values.get("msg_type"))
+    if cls is None:
+        message = APIMessageRX.__new__(APIMessageRX)
+        message.__dict__.update(values)
+        return message
+    return cls.from_dict(values)
+
+
+def decode(frame: bytes, codec: str = "json"):
+    """A frame read by read_frame with the same codec"""
+    if codec != compact or frame[:1] == b"{":
+        return decode_json(frame)
+    type_id, length = _header.unpack_from(frame)
+    cls = _by_id.get(type_id)
+    if cls is None:
+        return decode_json(frame[_header.size:_header.size + length])
+    present, flags = frame[5], frame[6]  # The payload starts after the 5 byte header
+    position = 7
+    message = cls.__new__(cls)
+    for bit, name, kind in cls.layout:
+        if not present & bit:
+            value = None
+        elif kind == "bool":
+            value = flags & bit != 0
+        elif kind == "str":
+            size = frame[position] << 8 | frame[position + 1]
+            value = frame[position + 2:position + 2 + size].decode('utf-8')
+            position += 2 + size
+        else:
+            value = []
+            position += 1
+            for _ in range(frame[position - 1]):
+                size = frame[position] << 8 | frame[position + 1]
+                value.append(frame[position + 2:position + 2 + size].decode('utf-8'))
+                position += 2 + size
+        setattr(message, name, value)
+    return message
+
+
+async def read_frame(reader, codec: str = "json") -> bytes:
+    """The next frame from a StreamReader, JSON up to its terminator or, once compact was agreed, a compact header
+    and its payload
+
+    Raises ValueError for a compact length over max_frame, the connection can't be trusted to be in step anymore.
+    """
+    if codec != compact:
+        return await reader.readuntil(frame_end)
+    first = await reader.readexactly(1)
+    if first == b"{":
+        return first + await reader.readuntil(frame_end)
+    header = first + await reader.readexactly(_header.size - 1)
+    _, length = _header.unpack(header)
+    if length > max_frame:
+        raise ValueError(f"Compact frame of {length} bytes is over the {max_frame} byte limit")
+    return header + await reader.readexactly(length)
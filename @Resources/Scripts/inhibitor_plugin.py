@@ -1,9 +1,12 @@
 import asyncio
 import datetime
 import logging
+import time
 import traceback
 
-from helpers import APIMessageTX, APIMessageRX
+import helpers
+from helpers import APIMessageTX, APIMessageRX, StateUpdate
+from metrics import Histogram
 
 # logging.basicConfig(level=logging.INFO,
 #                     format=r"[%(asctime)s - %(levelname)s - %(threadName)s - %(name)s - %(funcName)s - %(message)s]")
@@ -109,18 +112,18 @@ class InhibitorState:
         self.inhibit_sources = msg.inhibited_by
         self.connected_to_qbt = msg.qbt_connection
         self.connected_to_plex = msg.plex_connection
-        if hasattr(msg, "net_connection"):
+        if getattr(msg, "net_connection", None) is not None:
             self.connected_to_net = msg.net_connection
         self.last_update = datetime.datetime.now()
         self.message = msg.message
-        if hasattr(msg, "version"):
+        if getattr(msg, "version", None) is not None:
             self.version = msg.version
         self.build_ticker_text()
 
     def __eq__(self, other):
         if isinstance(other, InhibitorState):
             return self.get_string() == other.get_string() and self.inhibiting == other.inhibiting
-        elif isinstance(other, APIMessageRX):
+        elif isinstance(other, (APIMessageRX, StateUpdate)):
             temp_state = InhibitorState()
             temp_state.connected_to_inhibitor = self.connected_to_inhibitor
             temp_state.msg_loader(other)
@@ -138,15 +141,27 @@ class InhibitorPlugin:
         self.alt_port = kwargs.get("alt_port")
         self.logging = kwargs.get("logging")
         self.on_update_available = kwargs.get("on_update_available")
+        self.codecs = tuple(kwargs.get("codecs", (helpers.compact,)))  # Offered in the handshake, () for JSON only
+        self.codec = "json"  # What the server agreed to in its new_conn, JSON until then
         self.reader = None
         self.write_lock = asyncio.Lock()
         self.was_cycling = False
         self.writer = None
+        self.listener_task = None
         self.terminate = False
         self.token = None
         self.state_change = asyncio.Event()
         self.state = InhibitorState()
         self.ticker_position = 0
+        # Read by the metrics endpoint
+        self.connects = 0
+        self.messages_sent = {}  # msg_type -> count
+        self.messages_received = {}  # msg_type -> count
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.rtt = Histogram()  # Handshake round trips and refresh requests until the state update answering them
+        self.refresh_sent_at = None
+        self.recorder = None  # TrafficRecorder capturing every frame received
 
     def get_state_change(self) -> asyncio.Event:
         """Get the state change event"""
@@ -154,10 +169,16 @@ class InhibitorPlugin:
 
     async def execute(self, **kwargs) -> None:
         """Send a command to the api server"""
-        msg = APIMessageTX(msg_type="command", **kwargs)
+        await self._send(APIMessageTX(msg_type="command", **kwargs))
+
+    async def _send(self, msg: APIMessageTX):
         async with self.write_lock:
-            self.writer.write(msg.encode('utf-8'))
+            data = msg.encode('utf-8', self.codec)
+            self.writer.write(data)
             await self.writer.drain()
+        self.bytes_sent += len(data)
+        msg_type = msg.kwargs.get("msg_type")
+        self.messages_sent[msg_type] = self.messages_sent.get(msg_type, 0) + 1
 
     def should_cycle_status(self) -> bool:
         """Check if the status should be cycled"""
@@ -198,10 +219,9 @@ class InhibitorPlugin:
             else:
                 if self.state.last_update < datetime.datetime.now() - datetime.timedelta(seconds=10):
                     logging.debug("Sending refresh message")
-                    msg = APIMessageTX(msg_type="refresh", token=self.token)
-                    async with self.write_lock:
-                        self.writer.write(msg.encode('utf-8'))
-                        await self.writer.drain()
+                    if self.refresh_sent_at is None:
+                        self.refresh_sent_at = time.perf_counter()
+                    await self._send(APIMessageTX(msg_type="refresh", token=self.token))
             await asyncio.sleep(1)
 
     async def _connect(self):
@@ -235,54 +255,101 @@ class InhibitorPlugin:
         #     msg = APIMessageTX(msg_type="renew", token=self.token)
         #     self.writer.write(msg.encode('utf-8'))
         #     await self.writer.drain()
-        else:
-            msg = APIMessageTX(msg_type="handshake")
-            self.writer.write(msg.encode('utf-8'))
-            await self.writer.drain()
         try:
-            response = await self.reader.readuntil(b'\n\r')
-            msg = APIMessageRX(response)
+            start = time.perf_counter()
+            # An older server ignores the codecs it is offered and leaves codec out of its answer
+            self.codec = "json"
+            handshake = APIMessageTX(msg_type="handshake", codecs=list(self.codecs)) if self.codecs else \
+                APIMessageTX(msg_type="handshake")
+            await self._send(handshake)
+            response = await helpers.read_frame(self.reader)  # Always JSON, nothing is agreed before it
+            self.rtt.observe(time.perf_counter() - start)
+            msg = helpers.decode(response)
+            self._received(msg, response)
             if msg.msg_type == "renew_conn" or msg.msg_type == "new_conn":
                 self.token = msg.token
+                if getattr(msg, "codec", None) in self.codecs:
+                    self.codec = msg.codec
             self.state.connected_to_inhibitor = True
+            self.connects += 1
+            self.refresh_sent_at = None
         except Exception as e:
             self.logging.error(e)
             self.state.connected_to_inhibitor = False
             return
-        self.logging.info(f"Received token {self.token}")
+        self.logging.info(f"Received token {self.token}, {self.codec} encoding")
 
-        # Start listening for messages
-        self.event_loop.create_task(self._listener()).add_done_callback(self._listener_done)
+        # Start listening for messages, a listener left from an earlier connection is stopped first
+        if self.listener_task is not None and not self.listener_task.done():
+            self.listener_task.cancel()
+        self.listener_task = self.event_loop.create_task(self._listener(self.reader))
+        self.listener_task.add_done_callback(self._listener_done)
 
     def _listener_done(self, future):
         """Called when the listener is done"""
-        if future.exception() is not None:
+        if future.cancelled():
+            self.logging.debug("Listener cancelled")
+        elif future.exception() is not None:
             self.logging.error(f"Listener error: {future.exception()}")
         else:
             self.logging.debug("Listener done")
+            if future.result() is not self.reader:
+                return  # A newer connection has already taken over
+        self.state.connected_to_inhibitor = False
+
+    async def close(self):
+        """Stop listening and close the connection to the inhibitor server"""
+        self.terminate = True
+        if self.listener_task is not None:
+            self.listener_task.cancel()
+            self.listener_task = None
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception as e:
+                self.logging.debug(f"Error closing inhibitor connection: {e}")
+            self.writer = None
+        self.reader = None
         self.state.connected_to_inhibitor = False
 
     async def send_sys_command(self, **kwargs):
         """Send a system command to the api server"""
-        msg = APIMessageTX(msg_type="sys_command", **kwargs)
-        async with self.write_lock:
-            self.writer.write(msg.encode('utf-8'))
-            await self.writer.drain()
-
-    async def _listener(self):
-        """Listen to the assigned client"""
-        while not self.terminate and self.state.connected_to_inhibitor:
+        await self._send(APIMessageTX(msg_type="sys_command", **kwargs))
+
+    def _received(self, msg, frame: bytes):
+        if self.recorder is not None:
+            # Compact frames are recorded as the JSON they stand for, a capture replays the same either way
+            self.recorder.record("inhibitor", frame=frame.decode('utf-8', 'replace') if frame[:1] == b"{" else
+                                 str(msg) + helpers.frame_end.decode('ascii'))
+        self.bytes_received += len(frame)
+        msg_type = getattr(msg, 'msg_type', None)
+        self.messages_received[msg_type] = self.messages_received.get(msg_type, 0) + 1
+        if msg_type == "state_update" and self.refresh_sent_at is not None:
+            self.rtt.observe(time.perf_counter() - self.refresh_sent_at)
+            self.refresh_sent_at = None
+
+    async def _listener(self, reader: asyncio.StreamReader):
+        """Listen to the assigned client, exits as soon as this connection is replaced by a reconnect"""
+        while not self.terminate and self.state.connected_to_inhibitor and reader is self.reader:
             try:
-                new_message = await self.reader.readuntil(b'\n\r')
+                new_message = await helpers.read_frame(reader, self.codec)
             except OSError as e:
                 self.logging.error(f"Lost connection to inhibitor server {e}")
                 self.state.connected_to_inhibitor = False
+                break
             except asyncio.exceptions.IncompleteReadError:
                 self.logging.error("Incomplete read from inhibitor server")
                 self.state.connected_to_inhibitor = False
+                break
+            except (ValueError, asyncio.LimitOverrunError) as e:
+                self.logging.error(f"Unreadable frame from inhibitor server, reconnecting: {e}")
+                self.state.connected_to_inhibitor = False
+                break
             else:
                 try:
-                    msg = APIMessageRX(new_message)
+                    msg = helpers.decode(new_message, self.codec)
+                    self._received(msg, new_message)
                     if msg.msg_type == "state_update":
                         self.logging.debug(f"Received update message {msg}")
 
@@ -311,6 +378,7 @@ class InhibitorPlugin:
                     self.state.connected_to_inhibitor = False
                     await asyncio.sleep(1)
             await asyncio.sleep(0.5)
+        return reader
 
 # inhibitor_plugin = InhibitorPlugin(url="localhost", main_port=47675, alt_port=47676)
 # asyncio.get_event_loop().run_until_complete(inhibitor_plugin.run())
@@ -0,0 +1,345 @@
+"""Regenerates the per-row sections of qbt_ini.ini for any number of torrent rows
+
+    python ini_helper.py --rows 6
+
+The progress measures and the meters of every row are rewritten from the templates below, the footer, page
+buttons and dropdowns below the rows are moved to fit, the detail panel is resized to cover the rows and the
+Info measure's Rows option is set to match.
+"""
+import argparse
+import os
+import pathlib
+import re
+
+row_height = 85
+first_row_y = 45
+first_divider_y = 125
+
+measure_template = """[TorrentPercentageMeasure{i}]
+Measure=Plugin
+Plugin=Python.dll
+PythonHome={python_home}
+ScriptPath="#@#Scripts\\progress_slot.py"
+ClassName=ProgressSlot
+Slot={i}
+Source=#CURRENTCONFIG#
+MinValue=0.0
+MaxValue=100.0
+UpdateDivider=10
+
+"""
+
+row_template = """; ----------Torrent {number}----------
+[TorrentName{i}]
+Meter=String
+MeterStyle=styleTorrentName
+X=5
+Y={name_y}
+W=580
+Text="N/A"
+ToolTipText="N/A"
+LeftMouseDoubleClickAction=["explorer.exe"]
+MiddleMouseUpAction=[!CommandMeasure "Info" "action_toggle_{i}"]
+
+[RSSIcon{i}]
+Meter=BitMap
+X=578
+Y=-5r
+BitmapImage=#@#Images\\rss.png
+Hidden=1
+
+[TorrentStatus{i}]
+Meter=String
+MeterStyle=styleLeftText
+X=5
+Y=25r
+W=100
+Text=""
+ToolTipText="Click for files, peers and trackers"
+LeftMouseUpAction=[!CommandMeasure "Info" "details_{i}"]
+
+[TorrentGraph{i}]
+Meter=Shape
+X=135
+Y=0r
+Shape=Path DownPath | StrokeWidth 1 | Stroke Color 00ff0060 | Fill Color 00000000
+Shape2=Path UpPath | StrokeWidth 1 | Stroke Color 007bff60 | Fill Color 00000000
+DownPath=0,14 | LineTo 200,14
+UpPath=0,14 | LineTo 200,14
+
+[TorrentDSpeed{i}]
+Meter=String
+MeterStyle=styleLeftText
+X=140
+Y=0r
+Text=""
+
+[TorrentSeeds{i}]
+Meter=String
+MeterStyle=styleLeftText
+X=350
+Y=0r
+Text=""
+
+[TorrentETA{i}]
+Meter=String
+MeterStyle=styleRightText
+X=595
+Y=0r
+W=100
+Text=""
+
+[TorrentPercentage{i}]
+Meter=String
+MeterStyle=styleLeftText
+X=5
+Y=15r
+Text=""
+
+[TorrentProgress{i}]
+Meter=String
+MeterStyle=styleRightText
+X=595
+Y=0r
+Text=""
+
+[TorrentProgressBar{i}]
+Meter=Bar
+MeasureName=TorrentPercentageMeasure{i}
+BarColor=b0b0b0ff
+SolidColor=808080ff
+X=5
+Y=20r
+W=590
+H=2
+BarOrientation=Horizontal
+
+[TorrentUSpeed{i}]
+Meter=String
+MeterStyle=styleLeftText
+X=5
+Y=5r
+Text=""
+
+[TorrentAddedOn{i}]
+Meter=String
+MeterStyle=styleCenterText
+X=300
+Y=0r
+Text=""
+
+[TorrentRatio{i}]
+Meter=String
+MeterStyle=styleRightText
+X=595
+Y=0r
+Text=""
+
+"""
+
+divider_template = """[Divider{i}]
+Meter=Shape
+Shape=Rectangle 0,{y},600,2 | Fill Color b0b0b0ff | StrokeWidth 0
+
+"""
+
+
+detail_template = """; ---------Detail panel--------
+[DetailBackground]
+Meter=Shape
+Shape=Rectangle 0,{y},600,{height} | Fill Color 0,0,0,235 | StrokeWidth 1 | Stroke Color b0b0b0ff
+Group=Details
+Hidden=1
+
+[DetailTitle]
+Meter=String
+MeterStyle=styleTorrentName
+X=5
+Y={title_y}
+W=560
+Text=""
+Group=Details
+Hidden=1
+LeftMouseUpAction=[!CommandMeasure "Info" "details_tab"]
+
+[DetailClose]
+Meter=String
+MeterStyle=styleHeader
+StringAlign=RightTop
+X=595
+Y={title_y}
+Text="X"
+Group=Details
+Hidden=1
+LeftMouseUpAction=[!CommandMeasure "Info" "details_close"]
+
+[DetailText]
+Meter=String
+MeterStyle=styleLeftText
+FontSize=9
+X=5
+Y={text_y}
+W=590
+H={text_height}
+ClipString=1
+Text=""
+Group=Details
+Hidden=1
+
+[DetailPause]
+Meter=String
+MeterStyle=styleHeader
+X=5
+Y={buttons_y}
+Text="[Pause]"
+Group=Details
+Hidden=1
+LeftMouseUpAction=[!CommandMeasure "Info" "action_pause_selected"]
+
+[DetailResume]
+Meter=String
+MeterStyle=styleHeader
+X=15R
+Y={buttons_y}
+Text="[Resume]"
+Group=Details
+Hidden=1
+LeftMouseUpAction=[!CommandMeasure "Info" "action_resume_selected"]
+
+[DetailRecheck]
+Meter=String
+MeterStyle=styleHeader
+X=15R
+Y={buttons_y}
+Text="[Recheck]"
+Group=Details
+Hidden=1
+LeftMouseUpAction=[!CommandMeasure "Info" "action_recheck_selected"]
+
+[DetailReannounce]
+Meter=String
+MeterStyle=styleHeader
+X=15R
+Y={buttons_y}
+Text="[Reannounce]"
+Group=Details
+Hidden=1
+LeftMouseUpAction=[!CommandMeasure "Info" "action_reannounce_selected"]
+
+"""
+
+
+summary_template = """; ---------Summary panel-------
+[SummaryBackground]
+Meter=Shape
+Shape=Rectangle 0,{y},600,{height} | Fill Color 0,0,0,235 | StrokeWidth 1 | Stroke Color b0b0b0ff
+Group=Summary
+Hidden=1
+
+[SummaryTitle]
+Meter=String
+MeterStyle=styleTorrentName
+X=5
+Y={title_y}
+W=560
+Text=""
+Group=Summary
+Hidden=1
+LeftMouseUpAction=[!CommandMeasure "Info" "summary_next"]
+
+[SummaryClose]
+Meter=String
+MeterStyle=styleHeader
+StringAlign=RightTop
+X=595
+Y={title_y}
+Text="X"
+Group=Summary
+Hidden=1
+LeftMouseUpAction=[!CommandMeasure "Info" "summary_close"]
+
+[SummaryText]
+Meter=String
+MeterStyle=styleLeftText
+FontSize=9
+X=5
+Y={text_y}
+W=590
+H={text_height}
+ClipString=1
+Text=""
+Group=Summary
+Hidden=1
+
+"""
+
+
+def detail_panel(rows: int) -> str:
+    """The detail panel drawn over the rows, as tall as all of them"""
+    height = rows * row_height - 5
+    return detail_template.format(y=first_row_y, height=height, title_y=first_row_y + 5,
+                                  text_y=first_row_y + 30, text_height=height - 60,
+                                  buttons_y=first_row_y + height - 25)
+
+
+def summary_panel(rows: int) -> str:
+    """The category, tag and tracker summary drawn over the rows like the detail panel"""
+    height = rows * row_height - 5
+    return summary_template.format(y=first_row_y, height=height, title_y=first_row_y + 5, text_y=first_row_y + 30,
+                                   text_height=height - 35)
+
+
+def generate(ini: str, rows: int) -> str:
+    """The skin with its torrent rows regenerated for the given number of rows"""
+    if rows < 1:
+        raise ValueError("The skin needs at least one row")
+    current = re.search(r"^Rows=(\d+)$", ini, re.MULTILINE)
+    if current is None:
+        ini = ini.replace("ClassName=Rain\n", "ClassName=Rain\nRows=4\n", 1)
+        current_rows = 4
+    else:
+        current_rows = int(current.group(1))
+    ini = re.sub(r"^Rows=\d+$", f"Rows={rows}", ini, count=1, flags=re.MULTILINE)
+    if re.search(r"^Source=", ini[:ini.index("[TorrentPercentageMeasure0]")], re.MULTILINE) is None:
+        # The Info measure publishes the rows' progress under its config, the slot measures read them from there
+        ini = ini.replace(f"Rows={rows}\n", f"Rows={rows}\nSource=#CURRENTCONFIG#\n", 1)
+    python_home = re.search(r"^PythonHome=(.*)$", ini, re.MULTILINE).group(1)
+
+    measures_start = ini.index("[TorrentPercentageMeasure0]")
+    measures_end = ini.index("; ------------Styles")
+    measures = "".join(measure_template.format(i=i, python_home=python_home) for i in range(rows))
+
+    rows_start = ini.index("; ----------Torrent 1----------")
+    rows_end = ini.index("[Footer]")
+    row_sections = []
+    for i in range(rows):
+        row_sections.append(row_template.format(i=i, number=i + 1, name_y=first_row_y if i == 0 else "3R"))
+        if i < rows - 1:
+            row_sections.append(divider_template.format(i=i, y=first_divider_y + i * row_height))
+
+    # Everything under the rows is positioned absolutely, move it by the height of the added or removed rows
+    shift = (rows - current_rows) * row_height
+    footer = ini[rows_end:]
+    footer = re.sub(r"^Y=(\d+)$", lambda m: f"Y={int(m.group(1)) + shift}", footer, flags=re.MULTILINE)
+    footer = re.sub(r"^Shape=Rectangle 0,(\d+),600,2 ", lambda m: f"Shape=Rectangle 0,{int(m.group(1)) + shift},600,2 ",
+                    footer, count=1, flags=re.MULTILINE)
+    # The detail and summary panels sit over the rows and are sized to them rather than moved
+    panel_start = footer.find("; ---------Detail panel--------")
+    if panel_start >= 0:
+        footer = footer[:panel_start] + detail_panel(rows) + summary_panel(rows) + footer[footer.index("[Rainmeter]"):]
+    header = ini[measures_end:rows_start]
+    header = re.sub(r"^Shape=Rectangle 0,0,600,(\d+) ", lambda m: f"Shape=Rectangle 0,0,600,{int(m.group(1)) + shift} ",
+                    header, count=1, flags=re.MULTILINE)
+    return ini[:measures_start] + measures + header + "".join(row_sections) + footer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regenerate the torrent rows of the skin")
+    parser.add_argument("--rows", type=int, default=4)
+    parser.add_argument("--ini", default=os.path.join(pathlib.Path(__file__).parent.resolve(), "..", "..",
+                                                      "qbt_ini.ini"))
+    args = parser.parse_args()
+    with open(args.ini, "r", newline="") as f:
+        skin = f.read()
+    with open(args.ini, "w", newline="") as f:
+        f.write(generate(skin, args.rows))
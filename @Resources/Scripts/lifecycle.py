@@ -0,0 +1,88 @@
+import asyncio
+import concurrent.futures
+import itertools
+import threading
+import time
+
+import combined_log
+
+_generation = itertools.count()
+
+
+class LoopThread:
+    """The asyncio event loop the plugin runs on, the thread running it and the worker threads behind it
+
+    Rainmeter calls Reload, ExecuteBang and Finalize from its own thread, so everything handed to the loop
+    goes through submit(). shutdown() cancels whatever is still running, stops the loop and joins the loop
+    thread and the workers within a deadline, so nothing outlives a Finalize.
+    """
+
+    def __init__(self, logging: combined_log.CombinedLogger, name: str = "Dear god I am sorry", workers: int = 4):
+        self.logging = logging
+        self.name = name
+        self.workers = workers
+        self.loop = None
+        self.thread = None
+        self.executor = None
+        self._worker_prefix = f"Loop worker {next(_generation)}"
+        self._started = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive() and self.loop.is_running()
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        # An executor of our own so its threads can be found and joined on shutdown
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                              thread_name_prefix=self._worker_prefix)
+        self.loop.set_default_executor(self.executor)
+        self._started.clear()
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+        self._started.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        try:
+            self.loop.run_forever()
+        except Exception as e:
+            self.logging.error(f"Event loop stopped with an error: {e}")
+
+    def submit(self, coroutine) -> concurrent.futures.Future:
+        """Schedule a coroutine on the loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _cancel_tasks(self):
+        current = asyncio.current_task(self.loop)
+        tasks = [task for task in asyncio.all_tasks(self.loop) if task is not current and not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.loop.shutdown_asyncgens()
+
+    def shutdown(self, deadline: float = 5.0) -> bool:
+        """Cancel every task, stop the loop and join all of its threads, True if it all finished in time"""
+        end = time.monotonic() + deadline
+        if self.running:
+            try:
+                self.submit(self._cancel_tasks()).result(timeout=max(0.0, end - time.monotonic()))
+            except Exception as e:
+                self.logging.warning(f"Tasks still running at shutdown: {e!r}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join(max(0.0, end - time.monotonic()))
+        self.executor.shutdown(wait=False)
+        # A worker can be stuck in a request until its timeout runs out, wait for them up to the deadline
+        for worker in [t for t in threading.enumerate() if t.name.startswith(self._worker_prefix)]:
+            worker.join(max(0.0, end - time.monotonic()))
+        leftover = [t.name for t in threading.enumerate()
+                    if t is self.thread or t.name.startswith(self._worker_prefix)]
+        if self.thread is not None and not self.thread.is_alive():
+            self.loop.close()
+        if leftover:
+            self.logging.error(f"Threads still alive {deadline}s after shutdown: {', '.join(leftover)}")
+            return False
+        return True
@@ -1,10 +1,14 @@
 import logging
+import os
 import traceback
-from threading import Thread
-import asyncio
 
+import diagnostics
 import rm_interface
+from collector_client import CollectorClient
 from combined_log import CombinedLogger
+from lifecycle import LoopThread
+from metrics import CountingRainmeter
+from supervisor import Supervisor
 
 
 # logging.basicConfig(level=logging.DEBUG,
@@ -22,8 +26,18 @@ class Rain:
         self.updater = None
         self.event_loop = None
         self.task = None
-        self.background_thread = None
+        self.loop_thread = None
         self.logging = None
+        self.rows = 4
+        self.slot_source = ""
+        self.config_dir = None
+        self.collector = None  # (host, port) of a collector process to take the data from instead of polling here
+        self.shutdown_deadline = 5.0  # Seconds Finalize may take to stop every task and thread
+        self.bangs = set()  # Futures of the bangs still running
+        # Outlives reloads, leaks build up over the process's life rather than one interface's
+        self.diagnostics = None
+        self.supervisor = None  # Restarts the diagnostics task, it lives on the loop rather than in an interface
+        self.diagnostics_interval = 60
 
     async def on_new_version(self):
         pass
@@ -38,58 +52,79 @@ class Rain:
     def Reload(self, rm, maxValue) -> None:
         try:
             # logfile = rm.RmReadString("Logfile")
-            try:
-                logging.info("Initializing CombinedLogger")
-                self.logging = CombinedLogger(
-                    name="Rainmeter", level=logging.INFO,
-                    formatter=
-                    r"%(asctime)s - %(levelname)s - Thread: %(threadName)s - %(name)s - %(funcName)s - %(message)s")
-                self.logging.setRMObject(rm)
-                logging.debug("Initialized CombinedLogger, creating rainmeter interface")
-                # logging.setLoggerClass(CombinedLogger)
-            except Exception as e:
-                logging.error(f"Error in CombinedLogger Init: {e}\n{traceback.format_exc()}")
-                return
-
-            self.logging.info("Reload called, creating asyncio event loop")
-
-            self.rainmeter = rm
-            self.event_loop = asyncio.new_event_loop()
-            self.task = self.event_loop.create_task(self.true_init())
-
-            self.logging.debug("Created asyncio event loop, starting background asyncio thread...")
-
-            self.background_thread = Thread(target=self._start_asyncio, name="Dear god I am sorry")
-            self.background_thread.start()
-
-            self.logging.debug("Started background asyncio thread")
-
-            # Log info about the task
-            self.logging.debug(f"Task: {self.task}")
-            self.logging.debug(f"Task.done: {self.task.get_stack()}")
+            if self.logging is None:
+                try:
+                    logging.info("Initializing CombinedLogger")
+                    self.logging = CombinedLogger(
+                        name="Rainmeter", level=logging.INFO,
+                        formatter=
+                        r"%(asctime)s - %(levelname)s - Thread: %(threadName)s - %(name)s - %(funcName)s - %(message)s")
+                    logging.debug("Initialized CombinedLogger, creating rainmeter interface")
+                    # logging.setLoggerClass(CombinedLogger)
+                except Exception as e:
+                    logging.error(f"Error in CombinedLogger Init: {e}\n{traceback.format_exc()}")
+                    return
+            self.logging.setRMObject(rm)
+
+            self.rainmeter = CountingRainmeter(rm)  # Counts the Update bangs too, for the metrics endpoint
+            self.rows = rm.RmReadInt("Rows", 4)
+            self.slot_source = rm.RmReadString("Source", "")  # #CURRENTCONFIG#, shared with the ProgressSlot measures
+            self.config_dir = rm.RmReadString("ConfigDir", "", False) or None
+            self.diagnostics_interval = rm.RmReadInt("DiagnosticsInterval", 60)
+            collector = rm.RmReadString("Collector", "", False)
+            if collector:
+                host, _, port = collector.rpartition(":")
+                self.collector = (host or "127.0.0.1", int(port))
+            else:
+                self.collector = None
 
-            self.logging.debug(f"Thread: {self.background_thread}")
-            self.logging.debug(f"Thread alive: {self.background_thread.is_alive()}")
+            if self.loop_thread is not None and self.loop_thread.running:
+                # Reloading a live measure, the old interface goes but the loop and its thread are reused
+                self.logging.info("Reload called, reusing the asyncio event loop")
+                self._tear_down_interface()
+            else:
+                self.logging.info("Reload called, starting the asyncio event loop")
+                self.loop_thread = LoopThread(self.logging)
+                self.loop_thread.start()
+            self.event_loop = self.loop_thread.loop
+            self.task = self.loop_thread.submit(self.true_init())
+            self.logging.debug(f"Thread: {self.loop_thread.thread}")
 
         except Exception as e:
             logging.error(f"Error in Reload: {e}\n{traceback.format_exc()}")
 
-    def _start_asyncio(self):
-        """Start the asyncio event loop"""
-        try:
-            self.logging.info("Starting asyncio event loop")
-            self.event_loop.run_forever()
-            self.logging.error("Well shit")
-        except Exception as e:
-            self.logging.error(f"Error in _start_asyncio: {e}")
+    def _tear_down_interface(self):
+        """Stop the current interface's tasks and close its connections, waits up to shutdown_deadline"""
+        if self.task is not None:
+            # Let a pending true_init finish so the interface it builds is torn down too instead of leaking
+            try:
+                self.task.result(timeout=self.shutdown_deadline)
+            except Exception as e:
+                self.logging.error(f"Interface never finished initializing: {e!r}")
+            self.task = None
+        if self.rainmeter_interface is not None:
+            try:
+                self.loop_thread.submit(self.rainmeter_interface.tear_down()).result(timeout=self.shutdown_deadline)
+            except Exception as e:
+                self.logging.error(f"Error tearing down the interface: {e}\n{traceback.format_exc()}")
+            self.rainmeter_interface = None
 
     async def true_init(self):
         """This is the actual initialization of the plugin"""
         logging.info("Initializing rainmeter interface")
         try:
             self.rainmeter.RmLog(self.rainmeter.LOG_NOTICE, "Creating Rainmeter Interface")
+            if self.collector is not None:
+                host, port = self.collector
+                self.logging.info(f"Taking the data from the collector at {host}:{port}")
+                self.rainmeter_interface = CollectorClient(self.rainmeter, self.event_loop, self.logging,
+                                                           host, port, rows=self.rows, config_dir=self.config_dir,
+                                                           slot_source=self.slot_source)
+                return
             self.logging.debug("Creating rainmeter interface")
-            self.rainmeter_interface = rm_interface.RainMeterInterface(self.rainmeter, self.event_loop, self.logging)
+            self.rainmeter_interface = rm_interface.RainMeterInterface(self.rainmeter, self.event_loop, self.logging,
+                                                                     rows=self.rows, config_dir=self.config_dir,
+                                                                     slot_source=self.slot_source)
             self.logging.debug("Initialized rainmeter interface")
             self.rainmeter.RmLog(self.rainmeter.LOG_NOTICE, "Created Rainmeter Interface, creating updater")
         except Exception as e:
@@ -102,8 +137,7 @@ class Rain:
                 self.logging.warning("rainmeter_interface initializing")
                 self.rainmeter.RmExecute(f"[!SetOption ConnectionMeter Text \"Script initializing...\"]")
             else:
-                if not self.rainmeter_interface.getting_banged:
-                    self.rainmeter.RmExecute(self.rainmeter_interface.get_bang())
+                self.rainmeter_interface.update()
         except Exception as e:
             self.logging.error(f"Error in Update: {e}\n{traceback.format_exc()}")
 
@@ -113,15 +147,57 @@ class Rain:
     def ExecuteBang(self, args) -> None:
         """Called by the rainmeter plugin"""
         try:
-            task = self.event_loop.create_task(self.rainmeter_interface.execute_bang(args))
+            if args.startswith('diagnostics_'):
+                future = self.loop_thread.submit(self.diagnostics_bang(args))
+            else:
+                future = self.loop_thread.submit(self.rainmeter_interface.execute_bang(args))
+            # Held until the bang has run so it can't be collected half way, and so a failure gets logged
+            self.bangs.add(future)
+            future.add_done_callback(self._bang_done)
         except Exception as e:
             self.logging.error(f"Error in ExecuteBang: {e}\n{traceback.format_exc()}")
 
+    def _bang_done(self, future):
+        self.bangs.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            self.logging.error(f"Bang failed: {future.exception()!r}")
+
+    async def diagnostics_bang(self, bang):
+        """diagnostics_start and diagnostics_stop turn the periodic tracemalloc reports on and off,
+        diagnostics_snapshot writes one straight away"""
+        if self.diagnostics is None:
+            config_dir = self.config_dir or os.path.dirname(os.path.abspath(__file__))
+            self.diagnostics = diagnostics.Diagnostics(self.event_loop, self.logging,
+                                                       os.path.join(config_dir, diagnostics.default_path),
+                                                       interval=self.diagnostics_interval)
+            self.supervisor = Supervisor(self.event_loop, self.logging)
+        if bang == 'diagnostics_start' and not self.diagnostics.running:
+            self.diagnostics.start()
+            self.supervisor.supervise("diagnostics", self.diagnostics.run)
+        elif bang == 'diagnostics_stop':
+            self._stop_diagnostics()
+        elif bang == 'diagnostics_snapshot':
+            await self.diagnostics.report()
+
+    def _stop_diagnostics(self):
+        if self.supervisor is not None:
+            self.supervisor.stop("diagnostics")
+        if self.diagnostics is not None:
+            self.diagnostics.stop()
+
     def Finalize(self) -> None:
-        """Called by the rainmeter plugin"""
+        """Called by the rainmeter plugin, nothing started by Reload may outlive this"""
         try:
-            task = self.event_loop.create_task(self.rainmeter_interface.tear_down())
-            # Wait for the task to finish
-            task.add_done_callback(lambda _: task.result())
+            if self.loop_thread is not None:
+                if self.diagnostics is not None and self.diagnostics.running:
+                    self.loop_thread.loop.call_soon_threadsafe(self._stop_diagnostics)
+                self._tear_down_interface()
+                self.loop_thread.shutdown(self.shutdown_deadline)
+                self.loop_thread = None
+            self.diagnostics = None  # Tied to the loop that was just shut down
+            self.supervisor = None
+            self.event_loop = None
+            self.logging.info("Finalized")
+            self.logging.close()
         except Exception as e:
             self.logging.error(f"Error in Finalize: {e}\n{traceback.format_exc()}")
@@ -0,0 +1,208 @@
+"""The skin's own counters in the Prometheus text format, served on localhost for the existing monitoring to scrape
+
+Every counter lives on the object it counts (RainMeterInterface, QBTServer, InhibitorPlugin, GithubUpdater,
+Supervisor), this module only reads them when a scrape comes in. Enable it with "metrics_port" in settings.json.
+"""
+import asyncio
+import bisect
+import ipaddress
+import traceback
+
+import combined_log
+import helpers
+
+prefix = "qbt_skin_"
+seconds_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+bytes_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+    """Counts of observations per bucket, the way Prometheus histograms are exposed"""
+
+    def __init__(self, buckets=seconds_buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class CountingRainmeter:
+    """Wraps the rm object to count RmExecute calls and the bytes of bangs they carry"""
+
+    def __init__(self, rainmeter):
+        self.rainmeter = rainmeter
+        self.executes = 0
+        self.execute_bytes = 0
+
+    def RmExecute(self, bang: str) -> None:
+        self.executes += 1
+        self.execute_bytes += len(bang)
+        self.rainmeter.RmExecute(bang)
+
+    def __getattr__(self, name):
+        return getattr(self.rainmeter, name)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Exposition:
+    """Collects samples and writes them grouped by metric, each one with its HELP and TYPE lines"""
+
+    def __init__(self):
+        self.families = {}  # name -> (type, help, sample lines)
+
+    def _family(self, name: str, kind: str, help_text: str) -> list:
+        name = prefix + name
+        if name not in self.families:
+            self.families[name] = (kind, help_text, [])
+        return self.families[name][2]
+
+    def counter(self, name: str, help_text: str, value, **labels):
+        self._family(name, "counter", help_text).append(f"{prefix}{name}{_labels(labels)} {value}")
+
+    def gauge(self, name: str, help_text: str, value, **labels):
+        self._family(name, "gauge", help_text).append(f"{prefix}{name}{_labels(labels)} {value}")
+
+    def histogram(self, name: str, help_text: str, histogram: Histogram, **labels):
+        samples = self._family(name, "histogram", help_text)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+            cumulative += count
+            samples.append(f"{prefix}{name}_bucket{_labels(dict(labels, le=bound))} {cumulative}")
+        samples.append(f"{prefix}{name}_sum{_labels(labels)} {histogram.sum}")
+        samples.append(f"{prefix}{name}_count{_labels(labels)} {histogram.count}")
+
+    def text(self) -> str:
+        lines = []
+        for name, (kind, help_text, samples) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def collect(interface) -> str:
+    """Every counter of a RainMeterInterface and the objects it owns"""
+    out = Exposition()
+    out.histogram("refresh_seconds", "Duration of a refresh cycle, polling every server and rendering",
+                  interface.refresh_seconds)
+    out.histogram("bang_bytes", "Size of the bang string built for each rendered frame", interface.bang_bytes)
+    if isinstance(interface.rainmeter, CountingRainmeter):
+        out.counter("rm_execute_total", "RmExecute calls", interface.rainmeter.executes)
+        out.counter("rm_execute_bytes_total", "Bytes of bangs passed to RmExecute", interface.rainmeter.execute_bytes)
+    out.counter("commands_queued_total", "Bangs queued for Rainmeter", interface.commands.queued)
+    out.counter("commands_merged_total", "Queued bangs replaced by a later one in the same frame",
+                interface.commands.merged)
+
+    supervisor = interface.supervisor
+    out.gauge("event_loop_lag_seconds", "How late the last lag probe was woken", supervisor.lag)
+    out.gauge("event_loop_max_lag_seconds", "Worst lag probe lateness since the last health report",
+              supervisor.max_lag)
+    out.counter("event_loop_stalls_total", "Times the event loop was blocked for over stall_after seconds",
+                supervisor.stalls)
+    for name, supervised in supervisor.tasks.items():
+        out.counter("task_restarts_total", "Restarts of a supervised task after it crashed", supervised.restarts,
+                    task=name)
+
+    for server in interface.servers:
+        out.gauge("webui_connected", "1 while the WebUI is reachable and logged in", int(server.connected),
+                  server=server.name)
+        out.counter("webui_connects_total", "Logins to the WebUI, the first one and every reconnect",
+                    server.connects, server=server.name)
+        out.gauge("torrents", "Torrents mirrored from the WebUI", len(server.index.torrents), server=server.name)
+        for endpoint, stats in sorted(server.webui_stats.items()):
+            out.counter("webui_requests_total", "WebUI API requests", stats.requests,
+                        server=server.name, endpoint=endpoint)
+            out.counter("webui_request_errors_total", "WebUI API requests that failed", stats.errors,
+                        server=server.name, endpoint=endpoint)
+            out.counter("webui_response_bytes_total", "Bytes of WebUI API response bodies", stats.bytes,
+                        server=server.name, endpoint=endpoint)
+            out.counter("webui_wire_bytes_total", "Bytes of WebUI API responses as received, before gunzipping",
+                        stats.wire_bytes, server=server.name, endpoint=endpoint)
+            out.histogram("webui_request_seconds", "WebUI API request latency", stats.latency,
+                          server=server.name, endpoint=endpoint)
+
+    inhibitor = interface.inhibitor_plugin
+    out.gauge("inhibitor_connected", "1 while connected to the inhibitor", int(inhibitor.state.connected_to_inhibitor))
+    out.counter("inhibitor_connects_total", "Connections made to the inhibitor", inhibitor.connects)
+    out.gauge("inhibitor_compact_encoding", "1 while the inhibitor connection uses the compact encoding",
+              int(inhibitor.codec == helpers.compact))
+    out.counter("inhibitor_bytes_sent_total", "Bytes sent to the inhibitor", inhibitor.bytes_sent)
+    out.counter("inhibitor_bytes_received_total", "Bytes received from the inhibitor", inhibitor.bytes_received)
+    for msg_type, count in sorted(inhibitor.messages_sent.items()):
+        out.counter("inhibitor_messages_sent_total", "Messages sent to the inhibitor", count, type=msg_type)
+    for msg_type, count in sorted(inhibitor.messages_received.items()):
+        out.counter("inhibitor_messages_received_total", "Messages received from the inhibitor", count,
+                    type=msg_type)
+    out.histogram("inhibitor_rtt_seconds", "Handshake and refresh round trips to the inhibitor", inhibitor.rtt)
+
+    updater = interface.auto_updater
+    out.counter("update_checks_total", "Release checks against GitHub", updater.checks)
+    out.counter("update_check_failures_total", "Release checks that failed", updater.check_failures)
+    out.gauge("update_ratelimit_remaining", "GitHub API requests left in the rate limit bucket",
+              updater.bucket_remaining)
+    out.gauge("update_available", "1 when a newer release than the installed one exists",
+              int(updater.new_version_available))
+
+    for source in interface.metrics_sources:
+        source(out)
+    return out.text()
+
+
+class MetricsServer:
+    """A minimal HTTP endpoint answering GET /metrics, it refuses to listen on anything but a loopback address"""
+
+    def __init__(self, render, logging: combined_log.CombinedLogger, host: str = "127.0.0.1", port: int = 9788):
+        if host != "localhost" and not ipaddress.ip_address(host).is_loopback:
+            raise ValueError(f"Metrics are only served on localhost, not {host}")
+        self.render = render
+        self.logging = logging
+        self.host = host
+        self.port = port
+        self.scrapes = 0
+
+    async def run(self):
+        """Serve until cancelled, cancelling closes the listening socket"""
+        try:
+            server = await asyncio.start_server(self._serve, self.host, self.port)
+        except OSError as e:
+            # Usually a second skin with the same settings, retrying won't free the port
+            self.logging.error(f"Unable to serve metrics on {self.host}:{self.port}: {e}")
+            return
+        self.logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            method, path = (request.split(b"\r\n", 1)[0].split(b" ") + [b"", b""])[:2]
+            if method != b"GET":
+                status, body = "405 Method Not Allowed", b""
+            elif path.split(b"?", 1)[0] != b"/metrics":
+                status, body = "404 Not Found", b""
+            else:
+                status, body = "200 OK", self.render().encode('utf-8')
+                self.scrapes += 1
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except Exception as e:
+            self.logging.error(f"Error serving metrics: {e}\n{traceback.format_exc()}")
+        finally:
+            writer.close()
@@ -0,0 +1,23 @@
+import slot_values
+
+
+class ProgressSlot:
+    """A measure holding the progress of the torrent in one row, the row is the measure's Slot option and Source
+    names the Info measure's config it reads from"""
+
+    def __init__(self):
+        self.slot = 0
+        self.source = ""
+
+    def Reload(self, rm, maxValue) -> None:
+        self.slot = rm.RmReadInt("Slot", 0)
+        self.source = rm.RmReadString("Source", "")
+
+    def Update(self) -> float:
+        return slot_values.get(self.slot, source=self.source)
+
+    def GetString(self):
+        return None
+
+    def Finalize(self) -> None:
+        pass
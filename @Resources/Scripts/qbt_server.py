@@ -0,0 +1,316 @@
+import asyncio
+import itertools
+import time
+import traceback
+
+import qbittorrent.client
+import requests
+
+import combined_log
+from session_store import SessionStore
+from torrent_filter import TorrentIndex, Predicate, Everything
+from torrent_record import TorrentRecord
+from torrent_order import SortedTorrents, TopTorrents, top_k, speed_columns
+from webui_client import WebUIClient
+
+
+class QBTServer:
+    """One qBittorrent WebUI that the skin polls, all blocking WebUI calls are run on a worker thread
+
+    The server's torrents are mirrored locally from the sync/maindata deltas, sorting and filtering
+    the page is done against that copy instead of asking the server to re-list its library.
+    """
+
+    def __init__(self, host: str, username: str, password: str, name: str = None,
+                 logging: combined_log.CombinedLogger = None, timeout: float = 10.0):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.name = name if name is not None else host.split("/")[2] if "//" in host else host
+        self.logging = logging
+        self.timeout = timeout  # Seconds a WebUI request may take, keeps worker threads from hanging forever
+        self.qb = None
+        self.connected = False
+        self.version = "unknown"
+        self.rid = 0  # For querying main data
+        self.index = TorrentIndex()
+        self.order = None  # SortedTorrents for the current sort column, built on first use
+        self.top = None  # TopTorrents when sorting by a speed column instead
+        self.server_state = {}
+        self.synced_at = None  # time.monotonic() of the last sync applied, the estimates between polls start there
+        self.poll_task = None
+        # hash -> [state before the action, syncs left before giving up on the server confirming it] for
+        # torrents shown in the state an action is expected to put them in, None until the request went out
+        self.optimistic = {}
+        self.confirm_syncs = 2
+        # server_state field -> [value shown until the server reports it, syncs left or None until it was sent],
+        # for settings changed from the skin like the global speed limits
+        self.optimistic_state = {}
+        self.webui_stats = {}  # endpoint -> EndpointStats, read by the metrics endpoint
+        self.connects = 0
+        self.recorder = None  # TrafficRecorder capturing every response, set before the first poll
+        # Shown every delta (the RuleEngine, the TorrentSummary), each with begin, before, changed, removed and end
+        self.observers = []
+        self.sessions = None  # SessionStore the SID cookie is saved to and picked up from on the next load
+        self.session_key = SessionStore.key(username, host)
+
+    def _connect(self):
+        """Create the client and log in, or carry on with the session a previous run saved
+
+        A saved session is only given up when the server answers it with a 403, anything else (the server being
+        down, a timeout) is raised like any failed poll and the same session is tried again next time.
+        """
+        if self.qb is None:
+            sid = self.sessions.get(self.session_key) if self.sessions is not None else None
+            self.qb = WebUIClient(self.host, self.webui_stats, timeout=self.timeout, recorder=self.recorder,
+                                  name=self.name, sid=sid)
+        if self.qb.sid is None:
+            self._login()
+        else:
+            try:
+                self.version = self.qb.qbittorrent_version
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code != 403:
+                    raise
+                self.logging.info(f"{self.name}: Session expired, logging in")
+                self._login()
+        self.rid = 0
+        self.connected = True
+        self.connects += 1
+
+    def _login(self):
+        # login() replaces the client's session without closing the old one, which would hold its socket open
+        old_session = self.qb.session
+        self.qb.login(self.username, self.password)
+        if old_session is not self.qb.session:
+            old_session.close()
+        if self.sessions is not None:
+            if self.qb.sid is not None:
+                self.sessions.save(self.session_key, self.qb.sid)
+            else:
+                self.sessions.discard(self.session_key)
+        self.version = self.qb.qbittorrent_version
+
+    def _poll(self):
+        """Blocking part of a poll, runs on a worker thread"""
+        if not self.connected:
+            self._connect()
+        return self.qb.sync_main_data(rid=self.rid)
+
+    async def poll(self, event_loop) -> bool:
+        """Fetch the sync/maindata delta and apply it to the local copy, returns True on success"""
+        try:
+            qb_data = await event_loop.run_in_executor(None, self._poll)
+        except qbittorrent.client.LoginRequired:
+            self.connected = False
+            self.logging.critical(f"{self.name}: Login required")
+        except requests.exceptions.HTTPError as e:
+            self.connected = False
+            self.logging.critical(f"{self.name}: HTTP error: {e}")
+        except Exception as e:
+            self.connected = False
+            self.logging.error(f"{self.name}: Unable to get torrents: {e}\n{traceback.format_exc()}")
+        else:
+            self.apply_sync(qb_data)
+            return True
+        return False
+
+    def apply_sync(self, qb_data: dict):
+        """Merge a sync/maindata response into the local torrent index"""
+        full_update = bool(qb_data.get('full_update'))
+        if full_update:
+            self.index.clear()
+            self.order = None
+            self.top = None
+            self.optimistic.clear()
+        order, top, observers = self.order, self.top, self.observers
+        for observer in observers:
+            observer.begin(self, full_update)
+        for torrent_hash, changes in qb_data.get('torrents', {}).items():
+            new = torrent_hash not in self.index.torrents
+            if new and not isinstance(changes, TorrentRecord):
+                changes = dict(changes, hash=torrent_hash, server=self.name)
+            if observers:
+                old = None if new else self.index.torrents[torrent_hash]
+                befores = [observer.before(old, changes) for observer in observers]
+            torrent = self.index.upsert(torrent_hash, changes)
+            if observers:
+                for observer, before in zip(observers, befores):
+                    if before is not None:
+                        observer.changed(self, torrent, before)
+            # Only torrents whose sort column changed have to move
+            if order is not None and (new or order.sort_by in changes):
+                order.upsert(torrent_hash, torrent)
+            if top is not None and (new or top.sort_by in changes):
+                top.update(torrent_hash, torrent)
+        for torrent_hash in qb_data.get('torrents_removed', []):
+            if observers and torrent_hash in self.index.torrents:
+                for observer in observers:
+                    observer.removed(self, self.index.torrents[torrent_hash])
+            self.index.remove(torrent_hash)
+            if order is not None:
+                order.remove(torrent_hash)
+            if top is not None:
+                top.remove(torrent_hash)
+        for observer in observers:
+            observer.end()
+        self.server_state.update(qb_data.get('server_state', {}))
+        self.rid = qb_data['rid']
+        self.synced_at = time.monotonic()
+        if self.optimistic:
+            self._reconcile(qb_data.get('torrents', {}))
+        if self.optimistic_state:
+            self._reconcile_state(qb_data.get('server_state', {}))
+
+    def _reconcile(self, changed: dict):
+        """Drop optimistic states the server has answered, revert those it never confirmed
+
+        Deltas only carry fields that differ from what was last sent, so a torrent the action didn't change is
+        never mentioned again, after confirm_syncs syncs without its state it is put back.
+        """
+        for torrent_hash, entry in list(self.optimistic.items()):
+            if torrent_hash not in self.index.torrents or 'state' in changed.get(torrent_hash, ()):
+                del self.optimistic[torrent_hash]
+            elif entry[1] is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    self.revert([torrent_hash])
+
+    def set_optimistic(self, torrent_hash: str, state: str):
+        """Show a torrent in the state an action should put it in until the server says otherwise"""
+        torrent = self.index.torrents.get(torrent_hash)
+        if torrent is None or torrent.state == state:
+            return
+        self.optimistic.setdefault(torrent_hash, [torrent.state, None])
+        self._apply_local({torrent_hash: {'state': state}})
+
+    def confirm_sent(self, hashes):
+        """The request for these torrents went through, start counting syncs"""
+        for torrent_hash in hashes:
+            entry = self.optimistic.get(torrent_hash)
+            if entry is not None:
+                entry[1] = self.confirm_syncs
+
+    def revert(self, hashes):
+        """Put torrents back in the state they were in before their optimistic update"""
+        changes = {}
+        for torrent_hash in hashes:
+            entry = self.optimistic.pop(torrent_hash, None)
+            if entry is not None and torrent_hash in self.index.torrents:
+                changes[torrent_hash] = {'state': entry[0]}
+        if changes:
+            self._apply_local(changes)
+
+    def _apply_local(self, changes: dict):
+        """Apply changes made here rather than by the server, the observers and orderings see them like a delta
+
+        A sync confirming an optimistic state then changes nothing, the transition was reported when it was shown.
+        """
+        order, top, observers = self.order, self.top, self.observers
+        for observer in observers:
+            observer.begin(self, False)
+        for torrent_hash, fields in changes.items():
+            befores = [observer.before(self.index.torrents[torrent_hash], fields) for observer in observers]
+            torrent = self.index.upsert(torrent_hash, fields)
+            for observer, before in zip(observers, befores):
+                if before is not None:
+                    observer.changed(self, torrent, before)
+            if order is not None and order.sort_by in fields:
+                order.upsert(torrent_hash, torrent)
+            if top is not None and top.sort_by in fields:
+                top.update(torrent_hash, torrent)
+        for observer in observers:
+            observer.end()
+
+    def state_value(self, field: str, default=None):
+        """A server_state field as the skin shows it, a value set from the skin until the server has answered"""
+        entry = self.optimistic_state.get(field)
+        if entry is not None:
+            return entry[0]
+        return self.server_state.get(field, default)
+
+    def set_optimistic_state(self, field: str, value):
+        self.optimistic_state[field] = [value, None]
+
+    def confirm_state_sent(self, field: str):
+        entry = self.optimistic_state.get(field)
+        if entry is not None:
+            entry[1] = self.confirm_syncs
+
+    def revert_state(self, field: str):
+        self.optimistic_state.pop(field, None)
+
+    def _reconcile_state(self, changed: dict):
+        """Once sent, a value is dropped when a sync reports the field, or after confirm_syncs syncs that don't
+        (the server kept its value), from then on server_state is shown"""
+        for field, entry in list(self.optimistic_state.items()):
+            if entry[1] is None:
+                continue  # Still waiting for its request, a sync can only report the old value
+            entry[1] -= 1
+            if field in changed or entry[1] <= 0:
+                del self.optimistic_state[field]
+
+    def select(self, torrent_filter: Predicate, sort_by: str, reverse: bool, limit: int, offset: int = 0):
+        """Matching torrents from position offset up to limit in sort order, and the number that matched"""
+        keys = torrent_filter.select(self.index)
+        torrents = self.index.torrents
+        if sort_by in speed_columns:
+            return self._select_by_speed(keys, sort_by, reverse, limit)[offset:], len(keys)
+        if self.order is None or self.order.sort_by != sort_by:
+            self.order = SortedTorrents(sort_by)
+            self.order.build(torrents)
+        if isinstance(torrent_filter, Everything):
+            hashes = self.order.iter_hashes(offset, reverse)
+            return [torrents[h] for h in itertools.islice(hashes, limit - offset)], len(keys)
+        # Walking the ordering visits about limit * len(torrents) / len(keys) torrents to fill the page,
+        # for a narrow enough filter a heap over just the matches is cheaper
+        if len(keys) * len(keys) < limit * len(torrents):
+            return top_k((torrents[key] for key in keys), limit, sort_by, reverse)[offset:], len(keys)
+        matched = (h for h in self.order.iter_hashes(0, reverse) if h in keys)
+        return [torrents[h] for h in itertools.islice(matched, offset, limit)], len(keys)
+
+    def _select_by_speed(self, keys, sort_by: str, reverse: bool, limit: int) -> list:
+        """Speeds change every tick so they are never kept in order, the page comes from a bounded heap
+
+        Fastest-first pages near the top are answered from a pool of the fastest torrents that is kept up
+        to date from the deltas, anything else is a heap over every matching torrent.
+        """
+        torrents = self.index.torrents
+        if reverse and limit <= TopTorrents.size:
+            if self.top is None or self.top.sort_by != sort_by:
+                self.top = TopTorrents(sort_by)
+                self.top.build(torrents)
+            page = self.top.select(torrents, keys, limit)
+            if page is None:
+                self.top.build(torrents)
+                page = self.top.select(torrents, keys, limit)
+            if page is not None:
+                return page
+        return top_k((torrents[key] for key in keys), limit, sort_by, reverse)
+
+    def start_poll(self, event_loop) -> asyncio.Task:
+        """Start a poll unless one is still in flight, a slow server only ever has one request outstanding"""
+        if self.poll_task is None or self.poll_task.done():
+            self.poll_task = event_loop.create_task(self.poll(event_loop))
+        return self.poll_task
+
+    def cancel(self):
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+
+    def close(self):
+        """Cancel any poll and close the client's connections"""
+        self.cancel()
+        session = getattr(self.qb, 'session', None)
+        if session is not None:
+            session.close()
+        self.qb = None
+        self.connected = False
+
+
+def load_servers(secrets: dict, logging: combined_log.CombinedLogger) -> list:
+    """Build the server list from secrets.json, which holds either a "Servers" list or a single server's keys"""
+    server_secrets = secrets['Servers'] if 'Servers' in secrets else [secrets]
+    return [QBTServer(s['Host'], s['Username'], s['Password'], name=s.get('Name'), logging=logging,
+                      timeout=s.get('Timeout', 10.0))
+            for s in server_secrets]
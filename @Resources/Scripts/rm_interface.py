@@ -1,42 +1,77 @@
 import asyncio
 import configparser
+import heapq
+import itertools
 import logging
 import traceback
 import json
 import os
 import pathlib
+import time
 from os.path import exists
 
 import humanize
-import qbittorrent.client
-import requests
-from qbittorrent import Client
 
 import auto_update
 import combined_log
+import helpers
+import metrics
+import session_store
+import slot_values
+import speed_limits
+import torrent_estimate
+import traffic_recorder
+from command_queue import CommandQueue
 from inhibitor_plugin import InhibitorPlugin
-from torrent_formatter import torrent_format, no_torrent_template
+from qbt_server import load_servers
+from rule_engine import RuleEngine
+from single_flight import SingleFlight
+from supervisor import Supervisor
+from torrent_actions import ActionBatcher, is_paused
+from torrent_details import TorrentDetails
+from torrent_summary import TorrentSummary
+from speed_history import SpeedHistoryStore, sparkline, tiers as history_tiers
+from torrent_order import sort_key
+from torrent_filter import parse_filter, Everything
+from torrent_formatter import torrent_format, live_format, no_torrent_template
+
+_filter_names = {
+    'filter_all': "All",
+    'filter_active': "Active",
+    'filter_downloading': "Downloading",
+    'filter_seeding': "Seeding",
+    'filter_paused': "Paused",
+    'filter_errored': "Errored",
+}
 
 
 class RainMeterInterface:
 
-    def __init__(self, rainmeter, event_loop, logging: combined_log.CombinedLogger, debug=False):
+    def __init__(self, rainmeter, event_loop, logging: combined_log.CombinedLogger, debug=False,
+                 config_dir=None, autostart=True, rows=4, on_render=None, queue_renders=True, slot_source=""):
         try:
             self.logging = logging
-            self.logging.change_log_file(os.path.join(pathlib.Path(__file__).parent.resolve(), "Logs/Log.log"))
+            self.config_dir = pathlib.Path(__file__).parent.resolve() if config_dir is None else config_dir
+            self.logging.change_log_file(os.path.join(self.config_dir, "Logs/Log.log"))
             # logging.debug(f"Initial working directory: {os.getcwd()}")
             # os.chdir(os.path.dirname(os.path.abspath(__file__)))
             # logging.debug(f"Changed working directory to: {os.getcwd()}")
 
             self.logging.debug("Initializing RainMeterInterface")
-            self.rainmeter = rainmeter
+            # RmExecute calls are counted for the metrics endpoint, main.py hands over an already counting one
+            self.rainmeter = rainmeter if isinstance(rainmeter, metrics.CountingRainmeter) else \
+                metrics.CountingRainmeter(rainmeter)
             self.event_loop = event_loop
+            self.commands = CommandQueue(self.rainmeter, event_loop, self.logging)  # Every bang goes out through here
             self.debug = debug
 
             self.running = True
             self.torrents = {}
             self.rainmeter_values = {}
-            self.torrent_progress = ""
+            self.rows = rows  # Torrent rows in the skin, the Rows option of the Info measure
+            self.on_render = on_render  # Called with the interface after every render, the collector streams them
+            self.queue_renders = queue_renders  # Off in the collector, its skins get every render as a snapshot
+            self.slot_source = slot_source  # The Source option the skin's ProgressSlot measures read the rows from
 
             # ini_parser = configparser.ConfigParser()
             # logging.info("Loading qbt_ini.ini")
@@ -52,12 +87,11 @@ class RainMeterInterface:
             self.torrent_num = 0
             self.page_num = 1
             self.rid = 0  # For querying main data
-            self.torrent_sort = lambda d: d['added_on']
-            self.torrent_filter = lambda d: True
+            self.torrent_filter = Everything()
             self.torrent_reverse = True
             self.changing_state = False
             self.logging.debug("Loading secrets.json")
-            current_script_dir = pathlib.Path(__file__).parent.resolve()
+            current_script_dir = self.config_dir
 
             if not exists(os.path.join(current_script_dir, "secrets.json")):
                 with open(os.path.join(current_script_dir, "secrets.json"), "w") as f:
@@ -79,55 +113,113 @@ class RainMeterInterface:
             self.load_settings()
 
             self.logging.debug("secrets.json loaded")
-            self.qb_user = secrets['Username']
-            self.qb_pass = secrets['Password']
-            self.qb_host = secrets['Host']
-            self.qb = Client(self.qb_host)
+            self.servers = load_servers(secrets, self.logging)
+            if self.settings.get('remember_session', True):
+                # Saved next to secrets.json, a reload picks the sessions up instead of logging in again
+                sessions = session_store.SessionStore(os.path.join(current_script_dir, session_store.default_name),
+                                                      self.logging)
+                for server in self.servers:
+                    server.sessions = sessions
+            self.poll_timeout = self.settings.get('poll_timeout', 1.5)
+            self.poll_interval = self.settings.get('poll_interval', 2)
+            self.interpolate = self.settings.get('interpolate', True)
+            self.live_values = {}  # What the estimates between polls last changed the rows to, cleared by a render
+            self.speed_history = SpeedHistoryStore(os.path.join(self.config_dir, "speed_history.bin"),
+                                                   max_torrents=self.settings.get('history_torrents', 32),
+                                                   logging=self.logging)
+            self.speed_history.load()
             self.qb_connected = False
             self.qb_data = {}
-            self.getting_banged = False
             self.bang_string = ""
             self.logging.debug("Launching background tasks")
-            self.inhibitor_plugin = InhibitorPlugin(url="172.17.0.1", main_port=47675, alt_port=47676,
+            inhibitor_ports = self.settings.get('inhibitor_ports', [47675, 47676])
+            self.inhibitor_plugin = InhibitorPlugin(url=self.settings.get('inhibitor_host', "172.17.0.1"),
+                                                    main_port=inhibitor_ports[0], alt_port=inhibitor_ports[1],
                                                     logging=self.logging,
-                                                    on_update_available=self.inhibitor_update_available)
-            if not self.debug:
-                self.rainmeter.RmLog(self.rainmeter.LOG_NOTICE, "Launching background tasks")
-            self.inhibitor_plug_task = self.event_loop.create_task(self.inhibitor_plugin.run(self.event_loop))
-            self.refresh_task = self.event_loop.create_task(self.refresh_torrents())
-
+                                                    on_update_available=self.inhibitor_update_available,
+                                                    codecs=() if self.settings.get('inhibitor_codec') == "json"
+                                                    else (helpers.compact,))
             self.auto_updater = auto_update.GithubUpdater("JayFromProgramming", "QBT_rainmeter_skin",
                                                           restart_callback=self.on_update_installed,
                                                           update_available_callback=self.on_update_available,
                                                           logging=self.logging)
-            self.auto_update_task = self.event_loop.create_task(self.auto_updater.run())
             self.update_type_queued = None  # None, "local", "inhibitor"
+            self.recorder = None
+            capture = self.settings.get('capture_traffic')
+            if capture:
+                # For benchmarks/replay.py, everything the skin receives and the bangs it is sent
+                path = capture if isinstance(capture, str) else traffic_recorder.default_path
+                self.recorder = traffic_recorder.TrafficRecorder(os.path.join(self.config_dir, path),
+                                                                 logging=self.logging)
+                for server in self.servers:
+                    server.recorder = self.recorder
+                self.inhibitor_plugin.recorder = self.recorder
+                self.logging.info(f"Capturing traffic to {self.recorder.path}")
             self.version = self.auto_updater.version()
             # self.inhibitor_plugin.get_state_change().set()
             self.first_run_flag = False
-            self.change_waitress = self.event_loop.create_task(self.wait_for_change())
-
-            self.logging.debug("Background tasks launched")
-            self.refresh_task.add_done_callback(self._on_refresh_task_finished)
-            self.logging.debug("Background tasks launched")
+            self.supervisor = Supervisor(self.event_loop, self.logging)
+            # About five lines of detail text fit in the height of each row
+            self.details = TorrentDetails(self.event_loop, self.logging, max_lines=self.rows * 5,
+                                          files_cache_size=self.settings.get('details_cache', 16))
+            self.details.on_update = lambda: self.commands.put(self.details.bang())
+            self.actions = ActionBatcher(self.event_loop, self.logging)
+            self.limits = speed_limits.SpeedLimits(self.event_loop, self.logging,
+                                                   delay=self.settings.get('limit_delay', 0.6))
+            self.flights = SingleFlight(self.event_loop)
+            self.data_generation = 0  # Bumped after every refresh
+            self.page_cache = {}  # page_start -> (hashes, formatted rows) of the pages either side of the current one
+            self.prefetched_for = None
+            self.idle = asyncio.Event()  # Cleared while a refresh is running
+            self.idle.set()
+            self.details.idle = self.idle
+            self.refresh_seconds = metrics.Histogram()
+            self.bang_bytes = metrics.Histogram(metrics.bytes_buckets)
+            self.metrics_sources = []  # Callables adding their own samples to every scrape, the collector uses it
+            self.summary = TorrentSummary(lines=self.rows * 5)
+            self.rules = RuleEngine(self.settings.get('rules', []), self.logging)
+            for server in self.servers:
+                server.observers.append(self.summary)
+            if self.rules.rules:
+                for server in self.servers:
+                    server.observers.append(self.rules)
+                self.metrics_sources.append(self.rules.write_metrics)
+            if autostart:
+                self.start_background_tasks()
         except Exception as e:
             self.logging.critical(f"Unable to initialize RainMeterInterface: {e}\n{traceback.format_exc()}")
 
+    def start_background_tasks(self):
+        """Launch the polling, inhibitor, updater and state change tasks"""
+        if not self.debug:
+            self.rainmeter.RmLog(self.rainmeter.LOG_NOTICE, "Launching background tasks")
+        self.supervisor.supervise("inhibitor", lambda: self.inhibitor_plugin.run(self.event_loop))
+        self.supervisor.supervise("refresh", self.refresh_torrents)
+        if self.settings.get('check_updates', True):
+            self.supervisor.supervise("auto_update", self.auto_updater.run)
+        self.supervisor.supervise("change_waitress", self.wait_for_change)
+        if self.settings.get('metrics_port'):
+            try:
+                server = metrics.MetricsServer(lambda: metrics.collect(self), self.logging,
+                                               host=self.settings.get('metrics_host', "127.0.0.1"),
+                                               port=self.settings['metrics_port'])
+                self.supervisor.supervise("metrics", server.run)
+            except Exception as e:
+                self.logging.error(f"Not serving metrics: {e}")
+        self.supervisor.start_monitor()
+        self.logging.debug("Background tasks launched")
+
     def load_settings(self):
         """Loads the settings from the settings.json file"""
-        # Combine all filters into one lambda expression
+        # Combine all filters into one predicate over the local torrent indexes
         try:
             self.logging.debug("Loading settings")
-            if len(self.settings['filter']) == 0:
-                self.logging.debug("No filters set")
-                self.torrent_filter = lambda d: True
-            elif 'filter_all' in self.settings['filter']:
-                self.logging.debug("All torrents filter set")
-                self.torrent_filter = lambda d: True
-            elif 'filter_active' in self.settings['filter']:
-                self.logging.debug("Filtering active torrents")
-                self.torrent_filter = lambda d: d['state'] != "stalledUP" and d['state'] != "missingFiles"
-            self.torrent_sort = lambda d: d[self.settings['sort_by']]
+            try:
+                self.torrent_filter = parse_filter(self.settings['filter'])
+            except Exception as e:
+                self.logging.error(f"Invalid filter {self.settings['filter']}: {e}")
+                self.torrent_filter = Everything()
+            self.logging.debug(f"Filter: {self.torrent_filter}")
             self.torrent_reverse = self.settings['reverse']
         except Exception as e:
             self.logging.critical(f"Unable to load settings: {e}\n{traceback.format_exc()}")
@@ -140,7 +232,9 @@ class RainMeterInterface:
                 self.settings['sort_by'] = kwargs['sort_by']
             if 'reverse' in kwargs:
                 self.settings['reverse'] = kwargs['reverse']
-            with open(os.path.join(pathlib.Path(__file__).parent.resolve(), "settings.json"), "w") as settings_file:
+            if 'history_tier' in kwargs:
+                self.settings['history_tier'] = kwargs['history_tier']
+            with open(os.path.join(self.config_dir, "settings.json"), "w") as settings_file:
                 json.dump(self.settings, settings_file, indent=4)
         except Exception as e:
             self.logging.critical(f"Unable to set settings: {e}\n{traceback.format_exc()}")
@@ -148,7 +242,7 @@ class RainMeterInterface:
     async def on_update_installed(self):
         """Called when the update is installed"""
         self.logging.info("Refreshing all rainmeter skins...")
-        self.rainmeter.RmExecute("[!RefreshApp]")
+        self.commands.put("[!RefreshApp]")
         self.logging.error("Oh fuck, oh fuck")
 
     async def inhibitor_update_available(self, newest=None, current=None):
@@ -166,7 +260,7 @@ class RainMeterInterface:
         """
         if self.update_type_queued is not None:
             return
-        self.auto_update_task.cancel()  # Stop the auto updater so the user doesn't get multiple update prompts
+        self.supervisor.stop("auto_update")  # Stop the auto updater so the user doesn't get multiple update prompts
         await self.generate_update_popup(newest, current, source="QBT_rainmeter_skin", u_type="local")
 
     async def generate_update_popup(self, newest=None, current=None, source=None, u_type=None):
@@ -189,7 +283,7 @@ class RainMeterInterface:
                    f"[!SetOption CurrentVersion Text \"Current version: {current}\" \"QBT_rainmeter_skin\\update" \
                    f"-popup\"]" \
                    f"[!SetOption NewVersion Text \"New version: {newest}\" \"QBT_rainmeter_skin\\update-popup\"]"
-            self.rainmeter.RmExecute(bang)
+            self.commands.put(bang)
             self.update_type_queued = u_type
         except Exception as e:
             self.logging.error(f"Unable to show update popup: {e}\n{traceback.format_exc()}")
@@ -199,21 +293,20 @@ class RainMeterInterface:
         try:
             self.logging.info("Updating...")
             self.running = False
-            self.inhibitor_plug_task.cancel()
-            self.rainmeter.RmExecute("[!SetOption ConnectionMeter Text \"Performing update...\"]")
-            self.rainmeter.RmExecute("[!Redraw]")
+            self.supervisor.stop("inhibitor")
+            self.commands.put("[!SetOption ConnectionMeter Text \"Performing update...\"][!Redraw]")
             python_home = self.rainmeter.RmReadString("PythonHome", r"C:\Program Files\Python36", False)
             self.logging.info(f"Python home: {python_home}, preforming update")
             refresh = await self.auto_updater.preform_update(python_home)
             self.logging.info("Update complete")
             if not refresh:
-                self.rainmeter.RmExecute("[!RefreshApp]")
+                self.commands.put("[!RefreshApp]")
         except Exception as e:
             self.logging.error(f"Unable to update: {e}\n{traceback.format_exc()}")
 
     async def update_popup_callback(self, confirmed=None):
         try:
-            self.rainmeter.RmExecute("[!DeactivateConfig \"QBT_rainmeter_skin\\update-popup\"]")
+            self.commands.put("[!DeactivateConfig \"QBT_rainmeter_skin\\update-popup\"]")
             if confirmed:
                 if self.update_type_queued == "local":
                     await self.update_self()
@@ -226,89 +319,187 @@ class RainMeterInterface:
         except Exception as e:
             self.logging.error(f"Unable to update popup callback: {e}\n{traceback.format_exc()}")
 
-    def _on_refresh_task_finished(self):
-        self.rainmeter.RmLog(self.rainmeter.LOG_NOTICE, "Refresh task finished")
-        self.logging.critical("Refresh task finished")
-
     def get_bang(self) -> str:
         """Called by the rainmeter plugin to get the current display string"""
         return self.bang_string
 
-    def _connect(self):
+    async def refresh_torrents(self):
+        while self.running:
+            await self.refresh_once()
+            await asyncio.sleep(self.poll_interval)
+
+    async def refresh_once(self):
+        """Poll and re-render, a refresh triggered while one is running shares it"""
+        await self.flights.run('refresh', self._refresh)
+
+    async def _refresh(self):
+        """Poll every qBittorrent server concurrently and re-render as each one answers
+
+        A server that is slow to answer keeps its request in flight in the background (QBTServer.start_poll
+        never has more than one), the page is rendered from its last data until it catches up.
+        """
+        self.idle.clear()
+        start = time.perf_counter()
         try:
-            self.qb.login(self.qb_user, self.qb_pass)
-            self.qb_connected = True
+            polls = [server.start_poll(self.event_loop) for server in self.servers]
+            pending = set(polls)
+            deadline = self.event_loop.time() + self.poll_timeout
+            while pending:
+                timeout = deadline - self.event_loop.time()
+                if timeout <= 0:
+                    self.logging.debug(f"{len(pending)} server(s) still polling, rendering without them")
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if done and pending:
+                    await self.render()
         except Exception as e:
-            self.logging.critical(f"Unable to connect to server {e}\n{traceback.format_exc()}")
-            self.rainmeter.RmLog(self.rainmeter.LOG_ERROR, f"Unable to connect to server {e}")
-            self.qb_connected = False
+            self.logging.error(f"Failed to get torrents: {e}\n{traceback.format_exc()}")
+        finally:
+            self.data_generation += 1
+            self.merge_servers()
+            self.sample_speeds()
+            self.run_rules()
+            await self.render()
+            self.refresh_seconds.observe(time.perf_counter() - start)
+            self.idle.set()
+
+    async def render(self, flip=False):
+        """Select and render the current page
+
+        Renders never overlap, a render asked for while one is running waits for a single fresh one shared with
+        everything else asking in the meantime. With flip the page's rows are taken from the prefetch when it
+        holds the same torrents.
+        """
+        await self.flights.run('render', lambda: self._render(flip), rerun=True)
+
+    async def _render(self, flip):
+        self.merge_servers()
+        await self.parse_rm_values(prefetched=self.page_cache.get(self.page_start) if flip else None)
+        self.flights.schedule('prefetch', self.prefetch_adjacent)
+
+    def _page_key(self) -> tuple:
+        """What a prefetched page depends on besides the data"""
+        return (self.settings['sort_by'], self.settings['reverse'], repr(self.torrent_filter), self.rows,
+                self.data_generation)
+
+    def adjacent_starts(self) -> list:
+        """Where page_right and page_left would move page_start to"""
+        right = max(0, min(self.page_start + self.rows, self.torrent_num - self.rows))
+        left = max(0, self.page_start - self.rows)
+        return [start for start in (right, left) if start != self.page_start]
+
+    async def prefetch_adjacent(self):
+        """Format the pages either side of the current one on a worker thread so a flip can show them at once"""
+        try:
+            key = self._page_key()
+            if self.prefetched_for == (key, self.page_start):
+                return
+            pages = {}
+            for start in self.adjacent_starts():
+                torrents, _ = self.select_page(start)
+                values = await self.event_loop.run_in_executor(None, torrent_format, torrents, self.rows)
+                pages[start] = (tuple(torrent.hash for torrent in torrents), values)
+            if key == self._page_key():
+                self.page_cache = pages
+                self.prefetched_for = (key, self.page_start)
+        except Exception as e:
+            self.logging.error(f"Failed to prefetch pages: {e}\n{traceback.format_exc()}")
 
-    async def refresh_torrents(self):
-        while self.running:
-            try:
-                if not self.qb_connected:
-                    self._connect()
-                try:
-                    # Do all torrent sorting and filtering on server side
-                    torrent_filter = 'active' if self.settings['filter'] == 'filter_active' else 'all'
-                    torrents = self.qb.torrents(
-                        filter=torrent_filter,
-                        sort=self.settings['sort_by'],
-                        limit=4,
-                        offset=self.page_start,
-                        reverse=self.settings['reverse']
-                    )
-                    self.logging.debug(f"Page start: {self.page_start}")
-                    self.logging.debug(f"First torrent: {torrents[0]['name']}")
-                    qb_data = self.qb.sync_main_data(rid=self.rid)
-                    self.qb_data['url'] = self.qb.url.split("/")[2]
-                    self.qb_data['version'] = self.qb.qbittorrent_version
-                except qbittorrent.client.LoginRequired:
-                    self.qb_connected = False
-                    self.logging.critical("Login required")
-                except requests.exceptions.HTTPError as e:
-                    self.qb_connected = False
-                    self.logging.critical(f"HTTP error: {e}")
-                except Exception as e:
-                    self.qb_connected = False
-                    self.logging.error(f"Unable to get torrents: {e}\n{traceback.format_exc()}")
-                else:
-                    if 'free_space_on_disk' in qb_data['server_state']:
-                        self.qb_data['free_space'] = qb_data['server_state']['free_space_on_disk']
-                    if 'dl_info_speed' in qb_data['server_state']:
-                        self.qb_data['global_dl'] = qb_data['server_state']['dl_info_speed']
-                    if 'up_info_speed' in qb_data['server_state']:
-                        self.qb_data['global_up'] = qb_data['server_state']['up_info_speed']
-                    if 'total_peer_connections' in qb_data['server_state']:
-                        self.qb_data['total_peers'] = qb_data['server_state']['total_peer_connections']
-                    if 'full_update' in qb_data and qb_data['full_update']:
-                        self.torrent_num = len(qb_data['torrents'])
-                    self.rid = qb_data['rid']
-                    # self.logging.debug(f"Sort by: {self.torrent_sort} first torrent: {torrents[0]}")
-                    self.torrents = torrents
-            except Exception as e:
-                self.logging.error(f"Failed to get torrents: {e}\n{traceback.format_exc()}")
-            finally:
-                await self.parse_rm_values()
-                await asyncio.sleep(2)
+    def run_rules(self):
+        """Fire the timed rules that are due and execute the bangs rules fired since the last refresh"""
+        try:
+            self.rules.tick()
+            bangs = self.rules.take_bangs()
+            if bangs:
+                self.commands.put(bangs)
+        except Exception as e:
+            self.logging.error(f"Failed to run rules: {e}\n{traceback.format_exc()}")
+
+    def merge_servers(self):
+        """Combine the per-server data into the page being shown and the global totals"""
+        connected = [server for server in self.servers if server.connected]
+        self.qb_connected = len(connected) > 0
+        self.qb_data['url'] = ", ".join(server.name for server in self.servers)
+        self.qb_data['version'] = ", ".join(sorted(set(server.version for server in connected)))
+        self.qb_data['connected'] = len(connected)
+        for key, state_key in (('free_space', 'free_space_on_disk'), ('global_dl', 'dl_info_speed'),
+                               ('global_up', 'up_info_speed'), ('total_peers', 'total_peer_connections')):
+            self.qb_data[key] = sum(server.server_state.get(state_key, 0) for server in connected)
+        self.torrents, self.torrent_num = self.select_page(self.page_start, connected)
+        self.logging.debug(f"Page start: {self.page_start}")
+
+    def select_page(self, page_start: int, connected=None) -> tuple:
+        """The torrents of the page starting at page_start and the number of torrents matching the filter"""
+        if connected is None:
+            connected = [server for server in self.servers if server.connected]
+        # Filter and sort each server's local copy, then a k-way merge of the sorted lists gives the combined order.
+        # With one server the page can be read straight out of its ordering instead.
+        offset = page_start if len(connected) == 1 else 0
+        selections = [server.select(self.torrent_filter, self.settings['sort_by'], self.settings['reverse'],
+                                    page_start + self.rows, offset)
+                      for server in connected]
+        merged = heapq.merge(*(torrents for torrents, _ in selections),
+                             key=sort_key(self.settings['sort_by']), reverse=self.settings['reverse'])
+        torrents = list(itertools.islice(merged, page_start - offset, page_start - offset + self.rows))
+        return torrents, sum(count for _, count in selections)
+
+    def _find_torrent(self, torrent_hash):
+        server = self._find_server(torrent_hash)
+        return server.index.torrents[torrent_hash] if server is not None else None
+
+    def _find_server(self, torrent_hash):
+        for server in self.servers:
+            if torrent_hash in server.index.torrents:
+                return server
+        return None
+
+    def sample_speeds(self):
+        """Add this tick's global speeds and the speeds of recently shown torrents to the history"""
+        try:
+            self.speed_history.sample(self.qb_data.get('global_dl', 0), self.qb_data.get('global_up', 0),
+                                      self.torrents, self._find_torrent)
+        except Exception as e:
+            self.logging.error(f"Failed to sample speeds: {e}\n{traceback.format_exc()}")
+
+    def speed_graph_values(self) -> dict:
+        """Sparkline paths for the global speed graph and the graph behind each torrent's speeds"""
+        tier = self.settings.get('history_tier', '1m')
+        if tier not in self.speed_history.total.tiers:
+            tier = history_tiers[0][0]
+        dl, up = self.speed_history.total.series(tier)
+        peak = max(max(dl), max(up))
+        values = {'GlobalSpeedGraph': {
+            'DownPath': sparkline(dl, 600, 20, peak),
+            'UpPath': sparkline(up, 600, 20, peak),
+            'ToolTipText': f"Last {tier}, peak {humanize.naturalsize(peak)}/s (click to change)"}}
+        for i, torrent in enumerate(self.torrents):
+            history = self.speed_history.get(torrent.hash)
+            if history is None:
+                dl = up = [0.0]
+            else:
+                dl, up = history.series(tier)
+            peak = max(max(dl), max(up))
+            values[f'TorrentGraph{i}'] = {'DownPath': sparkline(dl, 200, 14, peak),
+                                          'UpPath': sparkline(up, 200, 14, peak)}
+        return values
 
     async def first_run(self):
         if self.settings['sort_by'] == 'name':
-            self.rainmeter.RmExecute("[!SetOption SortDropdownBoxText Text \"Sort by: Name\"]")
+            self.commands.put("[!SetOption SortDropdownBoxText Text \"Sort by: Name\"]")
         elif self.settings['sort_by'] == 'added_on':
-            self.rainmeter.RmExecute("[!SetOption SortDropdownBoxText Text \"Sort by: Added Date\"]")
+            self.commands.put("[!SetOption SortDropdownBoxText Text \"Sort by: Added Date\"]")
         elif self.settings['sort_by'] == 'upspeed':
-            self.rainmeter.RmExecute("[!SetOption SortDropdownBoxText Text \"Sort by: UL Speed\"]")
+            self.commands.put("[!SetOption SortDropdownBoxText Text \"Sort by: UL Speed\"]")
         elif self.settings['sort_by'] == 'dlspeed':
-            self.rainmeter.RmExecute("[!SetOption SortDropdownBoxText Text \"Sort by: DL Speed\"]")
-        if 'filter_all' in self.settings['filter']:
-            self.rainmeter.RmExecute("[!SetOption FilterDropdownBoxText Text \"Filter by: All\"]")
-        elif 'filter_active' in self.settings['filter']:
-            self.rainmeter.RmExecute("[!SetOption FilterDropdownBoxText Text \"Filter by: Active\"]")
+            self.commands.put("[!SetOption SortDropdownBoxText Text \"Sort by: DL Speed\"]")
+        filter_text = _filter_names.get(self.settings['filter'] if isinstance(self.settings['filter'], str) else
+                                        (self.settings['filter'] or ['filter_all'])[0])
+        if filter_text is not None:
+            self.commands.put(f"[!SetOption FilterDropdownBoxText Text \"Filter by: {filter_text}\"]")
         return True
 
-    async def parse_rm_values(self):
-        """Parse the rainmeter values"""
+    async def parse_rm_values(self, prefetched=None):
+        """Parse the rainmeter values, prefetched holds the page's formatted rows if they were prefetched"""
         if not self.first_run_flag:
             self.first_run_flag = True
             if not self.debug:
@@ -318,32 +509,45 @@ class RainMeterInterface:
         try:
             if not self.qb_connected:
                 """Set all torrent slots to an error state"""
-                self.rainmeter_values = no_torrent_template()
+                self.rainmeter_values = no_torrent_template(self.rows)
+                slot_values.publish((), self.slot_source)
                 self.rainmeter_values["ConnectionMeter"] = {"Text": f"Not connected to {self.qb_data['url']}"}
                 self.rainmeter_values["GlobalDownload"] = {"Text": "0B/s"}
                 self.rainmeter_values["GlobalUpload"] = {"Text": "0B/s"}
-                self.rainmeter_values['GlobalPeers'] = {"Text": "Connected peers: ???"}
+                self.rainmeter_values['GlobalPeers'] = {"Text": "Peers: ???"}
                 self.rainmeter_values['FreeSpace'] = {"Text": "Free space: ???"}
                 self.rainmeter_values['PageNumber'] = {'Text': "1/1"}
             else:
                 torrents = self.torrents
-                tprogress = {'progress': []}
-                for torrent in torrents:
-                    tprogress['progress'].append(torrent['progress'] * 100.0)
-                self.torrent_progress = json.dumps(tprogress)
-                self.rainmeter_values = torrent_format(torrents)
+                # Read by the ProgressSlot measures behind each row's progress bar
+                slot_values.publish((torrent.progress * 100.0 for torrent in torrents), self.slot_source)
+                if prefetched is not None and prefetched[0] == tuple(torrent.hash for torrent in torrents):
+                    self.rainmeter_values = dict(prefetched[1])
+                else:
+                    self.rainmeter_values = torrent_format(torrents, self.rows)
+                for meter, options in self.rules.row_values(torrents, self.rows).items():
+                    self.rainmeter_values[meter] = dict(self.rainmeter_values.get(meter, {}), **options)
                 self.logging.debug(f"First torrent: {self.rainmeter_values['TorrentName0']['Text']}")
-                self.rainmeter_values['Title'] = {'Text': f"BlockBust Viewer {self.version}"}
-                self.rainmeter_values['ConnectionMeter'] = {'Text': f"Connected to {self.qb_data['url']} "
-                                                                    f"qBittorrent {self.qb_data['version']}"}
-                self.rainmeter_values['GlobalDownload'] = {
-                    'Text': f"DL: {humanize.naturalsize(self.qb_data['global_dl'])}/s"}
-                self.rainmeter_values['GlobalUpload'] = {
-                    'Text': f"UP: {humanize.naturalsize(self.qb_data['global_up'])}/s"}
-                self.rainmeter_values['GlobalPeers'] = {'Text': f"Connected peers: {self.qb_data['total_peers']}"}
+                self.rainmeter_values['Title'] = {'Text': f"BlockBust Viewer {self.version}",
+                                                  'ToolTipText': self.supervisor.status_text()}
+                if len(self.servers) == 1:
+                    self.rainmeter_values['ConnectionMeter'] = {'Text': f"Connected to {self.qb_data['url']} "
+                                                                        f"qBittorrent {self.qb_data['version']}"}
+                else:
+                    self.rainmeter_values['ConnectionMeter'] = {
+                        'Text': f"Connected to {self.qb_data['connected']}/{len(self.servers)} servers",
+                        'ToolTipText': " | ".join(
+                            f"{server.name}: {'qBittorrent ' + server.version if server.connected else 'offline'}"
+                            for server in self.servers)}
+                self.rainmeter_values.update(self.limit_values())
+                self.rainmeter_values['GlobalPeers'] = {'Text': f"Peers: {self.qb_data['total_peers']}",
+                                                        'ToolTipText': "Connected peers"}
                 self.rainmeter_values['FreeSpace'] = \
                     {'Text': f"Free space: {humanize.naturalsize(self.qb_data['free_space'])}"}
-                self.rainmeter_values['PageNumber'] = {'Text': f"{self.page_num}/{self.torrent_num // 4}"}
+                self.rainmeter_values['PageNumber'] = {'Text': f"{self.page_num}/{self.torrent_num // self.rows}"}
+                self.rainmeter_values.update(self.speed_graph_values())
+                self.rainmeter_values.update(self.details.rendered)
+                self.rainmeter_values.update(self.summary.rendered())
                 self.rainmeter_values['InhibitorMeter'] = \
                     {'ToolTipText': 'Version: ' + await self.inhibitor_plugin.get_inhibitor_version()}
 
@@ -354,26 +558,81 @@ class RainMeterInterface:
             logging.error(f"Failed to parse rainmeter values: {e}\n{traceback.format_exc()}")
             self.rainmeter_values = {}
         else:
-            self.getting_banged = True
+            self.live_values = {}
             self.bang_string = ""
             for meter in self.rainmeter_values.keys():
                 for key, value in self.rainmeter_values[meter].items():
                     self.bang_string += f"[!SetOption {meter} {key} \"{value}\"]"
-                torrents = self.torrents
-                for i in range(len(torrents)):
-                    if 'better_rss' in torrents[i]['tags']:
-                        self.bang_string += f"[!ShowMeter RSSIcon{i}]"
-                    else:
-                        self.bang_string += f"[!HideMeter RSSIcon{i}]"
-            self.getting_banged = False
+            rss_icons = {f'RSSIcon{i}': 'better_rss' in torrent.tags for i, torrent in enumerate(self.torrents)}
+            for meter, visible in rss_icons.items():
+                self.bang_string += f"[!{'Show' if visible else 'Hide'}Meter {meter}]"
+            self.bang_bytes.observe(len(self.bang_string))
+            if self.queue_renders:
+                self.commands.set_options(self.rainmeter_values)
+                self.commands.show_meters(rss_icons)
+            if self.on_render is not None:
+                self.on_render(self)
+
+    def limit_values(self) -> dict:
+        """The global speeds with the limits set on them, in orange while the alternative limits are on"""
+        alt = speed_limits.current(self.servers, speed_limits.alt_field, False)
+        values = {}
+        for meter, label, key, name in (('GlobalDownload', "DL", 'global_dl', 'dl'),
+                                        ('GlobalUpload', "UP", 'global_up', 'up')):
+            limit = speed_limits.current(self.servers, speed_limits.fields[name])
+            text = f"{label}: {humanize.naturalsize(self.qb_data[key])}/s"
+            if limit:
+                text += f" / {humanize.naturalsize(limit)}"
+            values[meter] = {'Text': text, 'FontColor': "ffa500ff" if alt else "ffffffff",
+                             'ToolTipText': f"{'Alternative' if alt else 'Global'} {label} limit: "
+                                            f"{humanize.naturalsize(limit) + '/s' if limit else 'none'}#CRLF#"
+                                            f"Scroll to change, middle click to lift it"}
+        return values
 
     def get_string(self) -> str:
-        """Called by the rainmeter plugin to get the current display string"""
-        return self.torrent_progress
+        """Called by the rainmeter plugin to get the current display string, progress goes through slot_values"""
+        return ""
+
+    def update(self):
+        """Called by the rainmeter plugin on every Update, sends whatever is still waiting for its frame"""
+        if self.interpolate and self.queue_renders:
+            # The estimates are worked out on the event loop, estimate_rows sends the frame once they are queued
+            self.event_loop.call_soon_threadsafe(self.estimate_rows)
+        else:
+            self.commands.flush()
+
+    def estimate_rows(self):
+        """Move the page's progress, ETA, ratio and ages on from the last sync at the torrents' last speeds
+
+        Only the options that changed since the last render or estimate are queued, then the frame is sent with
+        them. A server that hasn't synced for three poll intervals stops moving until it does.
+        """
+        try:
+            if not self.qb_connected or not self.torrents:
+                return
+            synced_at = {server.name: server.synced_at for server in self.servers if server.connected}
+            estimates = torrent_estimate.estimate(self.torrents, synced_at,
+                                                  limit=self.poll_interval * 3 + self.poll_timeout)
+            changed = {}
+            for meter, options in live_format(estimates, self.rows).items():
+                shown = self.live_values.get(meter) or self.rainmeter_values.get(meter, {})
+                options = {option: value for option, value in options.items() if shown.get(option) != value}
+                if options:
+                    changed[meter] = options
+                    self.live_values[meter] = dict(shown, **options)
+            if changed:
+                slot_values.publish((estimate.progress * 100.0 for estimate in estimates), self.slot_source)
+                self.commands.set_options(changed)
+        except Exception as e:
+            self.logging.error(f"Failed to estimate rows: {e}\n{traceback.format_exc()}")
+        finally:
+            self.commands.flush()
 
     async def execute_bang(self, bang):
         """Called by the rainmeter plugin"""
         try:
+            if self.recorder is not None:
+                self.recorder.record("bang", args=bang)
             if bang == "updater_no":
                 await self.update_popup_callback(confirmed=False)
             if bang == "updater_yes":
@@ -381,32 +640,53 @@ class RainMeterInterface:
 
             if 'sort_' in bang:
                 if bang == 'sort_name':
-                    self.torrent_sort = lambda d: d['name']
                     self.torrent_reverse = False
                     self.set_settings(sort_by='name', reverse=False)
                 if bang == 'sort_added_date':
-                    self.torrent_sort = lambda d: d['added_on']
                     self.torrent_reverse = True
                     self.set_settings(sort_by='added_on', reverse=True)
                 if bang == 'sort_dl_speed':
-                    self.torrent_sort = lambda d: d['dlspeed']
                     self.torrent_reverse = True
                     self.set_settings(sort_by='dlspeed', reverse=True)
                 if bang == 'sort_ul_speed':
-                    self.torrent_sort = lambda d: d['upspeed']
                     self.torrent_reverse = True
                     self.set_settings(sort_by='upspeed', reverse=True)
                 self.page_start = 0
                 self.page_num = 1
-            if 'filter_' in bang:
-                if bang == 'filter_all':
-                    self.torrent_filter = lambda d: True
-                    self.set_settings(filter_by='filter_all')
-                if bang == 'filter_active':
-                    self.torrent_filter = lambda d: d['state'] != "stalledUP" and d['state'] != "missingFiles"
-                    self.set_settings(filter_by='filter_active')
+                self.page_cache = {}
+                # The local copy is re-sorted here, no need to wait for the next poll
+                await self.render()
+            if bang.startswith('filter_'):
+                # Filters run against the local indexes, so the new page can be shown straight away
+                self.set_settings(filter_by=bang)
+                self.load_settings()
                 self.page_start = 0
                 self.page_num = 1
+                self.page_cache = {}
+                await self.render()
+
+            if bang.startswith('history_'):
+                names = [name for name, _, _ in history_tiers]
+                if bang == 'history_next':
+                    current = self.settings.get('history_tier', '1m')
+                    tier = names[(names.index(current) + 1) % len(names)] if current in names else names[0]
+                else:
+                    tier = bang[len('history_'):]
+                if tier in names:
+                    self.set_settings(history_tier=tier)
+                    await self.render()
+
+            if bang.startswith('details_'):
+                await self.details_bang(bang)
+
+            if bang.startswith('summary_'):
+                await self.summary_bang(bang)
+
+            if bang.startswith('action_'):
+                await self.action_bang(bang)
+
+            if bang.startswith('limit_') or bang.startswith('altspeed_'):
+                await self.limits_bang(bang)
 
             if 'inhibit_' in bang:
                 self.inhibitor_plugin.get_state_change().clear()
@@ -421,37 +701,125 @@ class RainMeterInterface:
 
             if 'page_' in bang:
                 if bang == 'page_right':
-                    if not self.page_start + 4 == self.torrent_num:
-                        self.page_start += 4
+                    if not self.page_start + self.rows == self.torrent_num:
+                        self.page_start += self.rows
                         self.page_num += 1
-                        if self.page_start > self.torrent_num - 4:
-                            self.page_start = self.torrent_num - 4
+                        if self.page_start > self.torrent_num - self.rows:
+                            self.page_start = max(0, self.torrent_num - self.rows)
                 if bang == 'page_left':
                     if not self.page_start == 0:
-                        self.page_start -= 4
+                        self.page_start -= self.rows
                         self.page_num -= 1
                         if self.page_start < 0:
                             self.page_start = 0
                 if bang == 'page_reset':
                     self.page_start = 0
                     self.page_num = 1
-                await self.parse_rm_values()
-                self.rainmeter.RmExecute(self.bang_string)
+                # The adjacent pages were formatted after the last render, the flip shows them straight away
+                await self.render(flip=True)
         except Exception as e:
             logging.error(f"Failed to execute bang: {e}\n{traceback.format_exc()}")
 
+    async def details_bang(self, bang):
+        """details_<row> opens the detail panel on a row's torrent, details_tab and details_close work the panel"""
+        if bang == 'details_close':
+            self.supervisor.stop("details")
+            self.details.close()
+        elif bang == 'details_tab':
+            self.details.next_tab()
+        else:
+            row = int(bang[len('details_'):])
+            if row >= len(self.torrents):
+                return
+            torrent_hash = self.torrents[row].hash
+            server = self._find_server(torrent_hash)
+            if server is None:
+                return
+            if self.details.torrent_hash == torrent_hash:
+                self.supervisor.stop("details")
+                self.details.close()
+            else:
+                self.details.select(server, torrent_hash)
+                self.summary.close()
+                self.commands.set_options(self.summary.rendered())
+                if self.supervisor.tasks.get("details") is None or self.supervisor.tasks["details"].state != "running":
+                    self.supervisor.supervise("details", self.details.run)
+        self.commands.put(self.details.bang())
+
+    async def summary_bang(self, bang):
+        """summary_next opens the summary panel or moves it to the next kind of group, summary_close closes it"""
+        if bang == 'summary_close':
+            self.summary.close()
+        elif bang == 'summary_next':
+            self.summary.next_kind()
+            if self.summary.open and self.details.open:
+                # Both panels cover the rows, only one is shown at a time
+                self.supervisor.stop("details")
+                self.details.close()
+                self.commands.put(self.details.bang())
+        await self.render()
+
+    async def limits_bang(self, bang):
+        """limit_<dl|up>_<more|less|off|bytes per second> changes a global limit, altspeed_<toggle|on|off> the
+        alternative speed mode, both are sent once the skin has been left alone for limit_delay seconds"""
+        if bang.startswith('altspeed_'):
+            mode = bang[len('altspeed_'):]
+            if mode == 'toggle':
+                self.limits.toggle_alt(self.servers)
+            elif mode in ('on', 'off'):
+                self.limits.set_alt(self.servers, mode == 'on')
+            else:
+                return
+        else:
+            _, name, value = bang.split('_', 2)
+            if name not in speed_limits.fields:
+                return
+            field = speed_limits.fields[name]
+            if value in ('more', 'less'):
+                self.limits.step(self.servers, field, 1 if value == 'more' else -1)
+            elif value == 'off':
+                self.limits.set_limit(self.servers, field, 0)
+            elif value.isdigit():
+                self.limits.set_limit(self.servers, field, int(value))
+            else:
+                return
+        # The new value is shown straight away, the request goes out after the delay
+        await self.render()
+
+    async def action_bang(self, bang):
+        """action_<action>_<target>, the action is pause, resume, recheck, reannounce or toggle and the target a
+        row number, page for every torrent on the page or selected for the torrent in the detail panel"""
+        _, action, target = bang.split('_', 2)
+        if target == 'page':
+            hashes = [torrent.hash for torrent in self.torrents]
+        elif target == 'selected':
+            hashes = [self.details.torrent_hash] if self.details.open else []
+        else:
+            row = int(target)
+            hashes = [self.torrents[row].hash] if row < len(self.torrents) else []
+        by_server = {}
+        for torrent_hash in hashes:
+            server = self._find_server(torrent_hash)
+            if server is not None:
+                by_server.setdefault(server, []).append(torrent_hash)
+        if action == 'toggle' and hashes:
+            # Follow the first torrent so a mixed page ends up all paused or all running
+            first = self._find_torrent(hashes[0])
+            action = 'resume' if first is not None and is_paused(first) else 'pause'
+        for server, server_hashes in by_server.items():
+            self.actions.queue(server, action, server_hashes)
+        await self.render()
+
     async def wait_for_change(self):
         while self.running:
             try:
                 await self.inhibitor_plugin.get_state_change().wait()
                 self.logging.debug("Wait for change has been triggered")
-                self.rainmeter.RmExecute("[!HideMeter MeterLoadingAnimation]")
-                if await self.inhibitor_plugin.get_inhibitor_state():
-                    self.rainmeter.RmExecute("[!ShowMeter PlayButton][!HideMeter PauseButton]")
-                else:
-                    self.rainmeter.RmExecute("[!ShowMeter PauseButton][!HideMeter PlayButton]")
-                self.rainmeter.RmExecute(
-                    f"[!SetOption InhibitorMeter Text \"" + await self.inhibitor_plugin.get_inhibitor_status() + "\"]")
+                inhibited = await self.inhibitor_plugin.get_inhibitor_state()
+                self.commands.show_meters({'MeterLoadingAnimation': False, 'PlayButton': inhibited,
+                                           'PauseButton': not inhibited})
+                self.commands.set_options(
+                    {'InhibitorMeter': {'Text': await self.inhibitor_plugin.get_inhibitor_status()}})
                 self.changing_state = False
                 self.inhibitor_plugin.get_state_change().clear()
             except Exception as e:
@@ -460,21 +828,21 @@ class RainMeterInterface:
                 await asyncio.sleep(1)
 
     async def tear_down(self):
-        """Call this when the plugin is being unloaded"""
-        self.refresh_task.cancel()
-        self.inhibitor_plug_task.cancel()
-        self.auto_update_task.cancel()
-
-
-if __name__ == "__main__":
-    async def init():
-        rm = RainMeterInterface(None, event_loop, logging, debug=True)
-
-    logging = combined_log.CombinedLogger(
-        name="Rainmeter", level=logging.INFO,
-        formatter=
-        r"%(asctime)s - %(levelname)s - Thread: %(threadName)s - %(name)s - %(funcName)s - %(message)s"
-    )
-    event_loop = asyncio.new_event_loop()
-    event_loop.run_until_complete(init())
-
+        """Call this when the plugin is being unloaded, stops every task and closes every connection"""
+        self.running = False
+        self.supervisor.cancel_all()
+        self.flights.cancel()
+        slot_values.discard(self.slot_source)
+        if self.actions.pending:
+            self.logging.warning(f"Dropping {sum(map(len, self.actions.pending.values()))} unsent torrent action(s)")
+        self.actions.cancel()
+        if self.limits.pending:
+            self.logging.warning(f"Dropping {len(self.limits.pending)} unsent speed limit change(s)")
+        self.limits.cancel()
+        await self.inhibitor_plugin.close()
+        for server in self.servers:
+            server.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.commands.close()
+        self.speed_history.save()
@@ -0,0 +1,316 @@
+"""Rules from settings.json reacting to torrent events, evaluated only against the torrents each sync delta changed
+
+    "rules": [
+        {"event": "completed", "bang": "[!Play \\"#@#done.wav\\"]", "flash": 10},
+        {"event": "state", "state": ["error", "missingFiles"], "bar_color": "ff00ffff"},
+        {"event": "stalled", "minutes": 30, "bar_color": "ffa500ff", "filter": "filter_category:linux"},
+        {"event": "category_speed", "category": "movies", "above": 52428800, "bang": "..."}
+    ]
+
+Events are completed (progress reaching 100%), state (entering any of the given states or state groups, after
+"minutes" in it when given), stalled (stalledDL for "minutes") and category_speed (a category's total, or "dl"
+or "up" with "speed", going above "above" or below "below" bytes/s). "filter" takes the same specs as the filter
+setting and narrows which torrents a rule fires for. A rule can flash the row's name for "flash" seconds, colour
+its progress bar with "bar_color" for as long as the torrent stays completed or in the state, and run "bang"
+with {name}, {hash}, {server}, {state}, {category}, {tags}, {progress} and {rule} filled in (a category_speed
+rule only runs its bang, with {category}, {speed} and {rule}).
+
+Rules are grouped by what they react to, so a delta only reaches the rules for fields it actually changed, and
+timed rules sit in a heap of deadlines instead of being checked against every torrent on every tick.
+"""
+import heapq
+import itertools
+import time
+
+import humanize
+
+import combined_log
+from torrent_filter import parse_filter, expand_states
+
+default_font_color = "ffffffff"  # FontColor of styleTorrentName, a row's name goes back to it after flashing
+_unseen = ("", 0, None, 0, 0)  # What a torrent the engine hasn't seen before is compared against
+
+
+class _Placeholders(dict):
+
+    def __missing__(self, key):
+        return ""
+
+
+class Rule:
+    """One entry of the "rules" setting"""
+
+    def __init__(self, spec: dict, number: int):
+        self.name = spec.get('name', f"rule {number}")
+        self.event = spec['event']
+        self.states = frozenset()
+        self.minutes = float(spec.get('minutes', 0))
+        self.category = None
+        self.above = spec.get('above')
+        self.below = spec.get('below')
+        self.speed = spec.get('speed', 'total')
+        if self.event == 'stalled':
+            self.event = 'state'
+            self.states = frozenset(('stalledDL',))
+        elif self.event == 'state':
+            names = spec['state'] if isinstance(spec['state'], list) else [spec['state']]
+            self.states = frozenset(state for name in names for state in expand_states(name))
+        elif self.event == 'category_speed':
+            self.category = spec['category']
+            if (self.above is None) == (self.below is None):
+                raise ValueError("category_speed needs one of above or below")
+            if self.speed not in ('dl', 'up', 'total'):
+                raise ValueError(f"Unknown speed {self.speed}, expected dl, up or total")
+        elif self.event != 'completed':
+            raise ValueError(f"Unknown event {self.event}")
+        self.filter = parse_filter(spec.get('filter', []))
+        self.flash = float(spec.get('flash', 0))
+        self.flash_color = spec.get('flash_color', "ffd700ff")
+        self.bar_color = spec.get('bar_color')
+        self.bang = spec.get('bang', "")
+        if self.category is not None and (self.flash or self.bar_color):
+            raise ValueError("A category_speed rule has no row to flash or colour, it can only run a bang")
+        if not (self.flash or self.bar_color or self.bang):
+            raise ValueError("The rule has nothing to do")
+        try:
+            self.bang.format_map(_Placeholders())
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"Invalid placeholder in the bang: {e}")
+        self.fired = 0
+        self.active = False  # For category_speed, the speed is past the threshold
+
+    def __repr__(self):
+        return f"Rule({self.name!r}, {self.event!r})"
+
+
+class _Timed:
+    """The timed state rules sharing states and minutes, one timer per torrent serves all of them"""
+
+    __slots__ = ('states', 'minutes', 'rules')
+
+    def __init__(self, states: frozenset, minutes: float):
+        self.states = states
+        self.minutes = minutes
+        self.rules = []
+
+
+class RuleEngine:
+    """Evaluates the rules against the sync deltas of every server
+
+    QBTServer.apply_sync calls begin() for every delta, before() and changed() around each torrent it updates,
+    removed() for each torrent removed and end() once the delta is applied. A full update is taken as the
+    baseline, it sets bar colours for conditions already holding but fires nothing. The interface calls tick()
+    on every refresh for the timed rules, runs take_bangs() and merges row_values() into the page.
+    """
+
+    def __init__(self, specs: list, logging: combined_log.CombinedLogger):
+        self.logging = logging
+        self.rules = []
+        for number, spec in enumerate(specs or ()):
+            try:
+                self.rules.append(Rule(spec, number))
+            except Exception as e:
+                self.logging.error(f"Ignoring rule {number} {spec}: {e!r}")
+        self.on_completed = [rule for rule in self.rules if rule.event == 'completed']
+        self.on_state = {}  # state -> untimed rules entered or left through it
+        self.on_timed = {}  # state -> _Timed groups entered or left through it
+        self.on_category = {}  # category -> category_speed rules
+        timed = {}
+        for rule in self.rules:
+            if rule.minutes and rule.states:
+                group = timed.get((rule.states, rule.minutes))
+                if group is None:
+                    group = timed[(rule.states, rule.minutes)] = _Timed(rule.states, rule.minutes)
+                    for state in rule.states:
+                        self.on_timed.setdefault(state, []).append(group)
+                group.rules.append(rule)
+            else:
+                for state in rule.states:
+                    self.on_state.setdefault(state, []).append(rule)
+            if rule.category is not None:
+                self.on_category.setdefault(rule.category, []).append(rule)
+        # Before a baseline fires nothing, only the rules with a bar colour have anything to do
+        self.completed_colors = [rule for rule in self.on_completed if rule.bar_color]
+        self.watched = (('progress',) if self.on_completed else ()) + \
+                       (('state',) if self.on_state or self.on_timed else ()) + \
+                       (('category', 'dlspeed', 'upspeed') if self.on_category else ())
+        self.flashes = any(rule.flash for rule in self.rules)
+        self.timers = []  # Heap of (deadline, seq, _Timed, server, hash)
+        self.entered = {}  # (_Timed, server name, hash) -> seq of the timer started when the torrent entered
+        self.seq = itertools.count()
+        self.speeds = {}  # server name -> category -> [dlspeed, upspeed] summed over its torrents
+        self.touched = set()  # Categories whose speed changed in the current delta
+        self.baseline = False
+        self.flashing = {}  # hash -> (monotonic time the flash ends, colour)
+        self.bar_colors = {}  # hash -> (rule, server name) while the rule's condition holds
+        self.pending = []  # Bangs waiting for take_bangs()
+        self.flash_on = False
+        self.fired = 0
+
+    def begin(self, server, full_update: bool):
+        """A delta for server is about to be applied, a full update starts over from a new baseline"""
+        if not full_update:
+            return
+        self.baseline = True
+        self.speeds.pop(server.name, None)
+        self.touched.update(self.on_category)
+        for key in [key for key in self.entered if key[1] == server.name]:
+            del self.entered[key]
+        for torrent_hash in [h for h, held in self.bar_colors.items() if held[1] == server.name]:
+            del self.bar_colors[torrent_hash]
+
+    def before(self, torrent, changes):
+        """The watched values of a torrent before changes are applied to it, None when changes don't touch them"""
+        if torrent is None:
+            return _unseen
+        for field in self.watched:
+            if field in changes:
+                return torrent.state, torrent.progress, torrent.category, torrent.dlspeed, torrent.upspeed
+        return None
+
+    def changed(self, server, torrent, before: tuple):
+        """Fire whatever a torrent's change from before to its current values triggers"""
+        state, progress, category, dlspeed, upspeed = before
+        if torrent.state != state and (self.on_state or self.on_timed):
+            self._state_changed(server, torrent, state)
+        if self.on_completed and (torrent.progress >= 1) != (progress >= 1):
+            if torrent.progress >= 1:
+                quiet = before is _unseen
+                for rule in self.completed_colors if quiet else self.on_completed:
+                    self._fire(rule, server, torrent, quiet)
+            else:
+                self._release(torrent.hash, self.on_completed)
+        if self.on_category:
+            speeds = self.speeds.setdefault(server.name, {})
+            if category in self.on_category:
+                entry = speeds[category]
+                entry[0] -= dlspeed
+                entry[1] -= upspeed
+                self.touched.add(category)
+            if torrent.category in self.on_category:
+                entry = speeds.setdefault(torrent.category, [0, 0])
+                entry[0] += torrent.dlspeed
+                entry[1] += torrent.upspeed
+                self.touched.add(torrent.category)
+
+    def _state_changed(self, server, torrent, old: str):
+        new = torrent.state
+        for rule in itertools.chain(self.on_state.get(old, ()), self.on_state.get(new, ())):
+            was_in, now_in = old in rule.states, new in rule.states
+            if now_in and not was_in:
+                if rule.bar_color or not self.baseline:
+                    self._fire(rule, server, torrent, quiet=self.baseline)
+            elif was_in and not now_in:
+                self._release(torrent.hash, (rule,))
+        for group in itertools.chain(self.on_timed.get(old, ()), self.on_timed.get(new, ())):
+            was_in, now_in = old in group.states, new in group.states
+            if now_in and not was_in:
+                seq = next(self.seq)
+                self.entered[(group, server.name, torrent.hash)] = seq
+                heapq.heappush(self.timers, (time.monotonic() + group.minutes * 60, seq, group, server,
+                                             torrent.hash))
+            elif was_in and not now_in:
+                self.entered.pop((group, server.name, torrent.hash), None)
+                self._release(torrent.hash, group.rules)
+
+    def removed(self, server, torrent):
+        """A torrent is about to be removed from server's index"""
+        for group in self.on_timed.get(torrent.state, ()):
+            self.entered.pop((group, server.name, torrent.hash), None)
+        self.bar_colors.pop(torrent.hash, None)
+        self.flashing.pop(torrent.hash, None)
+        if torrent.category in self.on_category:
+            entry = self.speeds.setdefault(server.name, {}).get(torrent.category)
+            if entry is not None:
+                entry[0] -= torrent.dlspeed
+                entry[1] -= torrent.upspeed
+                self.touched.add(torrent.category)
+
+    def end(self):
+        """The delta is applied, check the categories whose speed it changed"""
+        for category in self.touched:
+            dl = up = 0
+            for speeds in self.speeds.values():
+                entry = speeds.get(category)
+                if entry is not None:
+                    dl += entry[0]
+                    up += entry[1]
+            for rule in self.on_category[category]:
+                speed = dl if rule.speed == 'dl' else up if rule.speed == 'up' else dl + up
+                active = speed > rule.above if rule.above is not None else speed < rule.below
+                if active and not rule.active and not self.baseline:
+                    if rule.bang:
+                        self.pending.append(rule.bang.format_map(_Placeholders(
+                            category=category, speed=humanize.naturalsize(speed) + "/s", rule=rule.name)))
+                    self._count(rule, category)
+                rule.active = active
+        self.touched.clear()
+        self.baseline = False
+
+    def tick(self):
+        """Fire the timed rules whose torrents stayed in their state long enough"""
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, seq, group, server, torrent_hash = heapq.heappop(self.timers)
+            if self.entered.get((group, server.name, torrent_hash)) != seq:
+                continue  # Left the state since, or a full update restarted its clock
+            torrent = server.index.torrents.get(torrent_hash)
+            if torrent is not None and torrent.state in group.states:
+                for rule in group.rules:
+                    self._fire(rule, server, torrent)
+
+    def _fire(self, rule: Rule, server, torrent, quiet: bool = False):
+        """Apply a rule to a torrent, quiet only sets the bar colour for a condition that was already holding"""
+        if not rule.filter.select(server.index, {torrent.hash}):
+            return
+        if rule.bar_color:
+            self.bar_colors[torrent.hash] = (rule, server.name)
+        if quiet:
+            return
+        if rule.flash:
+            self.flashing[torrent.hash] = (time.monotonic() + rule.flash, rule.flash_color)
+        if rule.bang:
+            self.pending.append(rule.bang.format_map(_Placeholders(
+                name=torrent.name, hash=torrent.hash, server=server.name, state=torrent.state,
+                category=torrent.category, tags=torrent.tags, progress=f"{torrent.progress * 100:.1f}%",
+                rule=rule.name)))
+        self._count(rule, torrent.name)
+
+    def _count(self, rule: Rule, subject):
+        rule.fired += 1
+        self.fired += 1
+        self.logging.info(f"Rule {rule.name} fired for {subject}")
+
+    def _release(self, torrent_hash: str, rules):
+        held = self.bar_colors.get(torrent_hash)
+        if held is not None and held[0] in rules:
+            del self.bar_colors[torrent_hash]
+
+    def take_bangs(self) -> str:
+        """The bangs rules fired since the last call, as one string for RmExecute"""
+        bangs = "".join(self.pending)
+        self.pending.clear()
+        return bangs
+
+    def row_values(self, torrents, rows: int) -> dict:
+        """Meter options for the page's rows, rule bar colours and the names flashing on and off every render"""
+        values = {}
+        for i, torrent in enumerate(torrents):
+            held = self.bar_colors.get(torrent.hash)
+            if held is not None:
+                values[f'TorrentProgressBar{i}'] = {'BarColor': held[0].bar_color}
+        if self.flashes:
+            now = time.monotonic()
+            self.flash_on = not self.flash_on
+            for torrent_hash in [h for h, (until, _) in self.flashing.items() if until <= now]:
+                del self.flashing[torrent_hash]
+            for i in range(rows):
+                flash = self.flashing.get(torrents[i].hash) if i < len(torrents) else None
+                values[f'TorrentName{i}'] = {'FontColor': flash[1] if flash is not None and self.flash_on
+                                             else default_font_color}
+        return values
+
+    def write_metrics(self, out):
+        for rule in self.rules:
+            out.counter("rules_fired_total", "Times a rule from settings.json fired", rule.fired, rule=rule.name)
+        out.gauge("rule_timers", "Timed rules waiting on a torrent to stay in its state", len(self.entered))
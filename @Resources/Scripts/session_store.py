@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+import traceback
+
+import combined_log
+
+if os.name == "nt":
+    import ctypes
+    from ctypes import wintypes
+
+default_name = "sessions.json"
+
+
+if os.name == "nt":
+    class _Blob(ctypes.Structure):
+        _fields_ = [("cbData", wintypes.DWORD), ("pbData", ctypes.POINTER(ctypes.c_char))]
+
+    def _crypt(function, data: bytes) -> bytes:
+        """Run data through CryptProtectData or CryptUnprotectData, bound to the current user's logon"""
+        buffer = ctypes.create_string_buffer(data, len(data))
+        blob_in = _Blob(len(data), ctypes.cast(buffer, ctypes.POINTER(ctypes.c_char)))
+        blob_out = _Blob()
+        # CRYPTPROTECT_UI_FORBIDDEN, a skin can't show a prompt
+        if not function(ctypes.byref(blob_in), None, None, None, None, 0x1, ctypes.byref(blob_out)):
+            raise ctypes.WinError()
+        try:
+            return ctypes.string_at(blob_out.pbData, blob_out.cbData)
+        finally:
+            ctypes.windll.kernel32.LocalFree(blob_out.pbData)
+
+    def _protect(data: bytes) -> bytes:
+        return _crypt(ctypes.windll.crypt32.CryptProtectData, data)
+
+    def _unprotect(data: bytes) -> bytes:
+        return _crypt(ctypes.windll.crypt32.CryptUnprotectData, data)
+
+
+class SessionStore:
+    """WebUI SID cookies kept next to secrets.json so a reload can skip auth/login
+
+    Sessions are keyed by user and host, a changed secrets.json never picks up the session of another login.
+    The file is written readable by its owner only (0600). Windows ignores that mode, there the file is
+    encrypted with DPAPI for the current user instead, so other accounts can't lift the cookies from it.
+    The servers save and discard sessions from their worker threads.
+    """
+
+    def __init__(self, path: str, logging: combined_log.CombinedLogger = None):
+        self.path = path
+        self.logging = logging
+        self.lock = threading.Lock()
+        self.sessions = None  # "user@host" -> SID, read on first use
+
+    @staticmethod
+    def key(username: str, host: str) -> str:
+        return f"{username}@{host.rstrip('/')}"
+
+    def _load(self) -> dict:
+        if self.sessions is None:
+            self.sessions = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "rb") as f:
+                        data = f.read()
+                    if os.name == "nt" and not data.lstrip().startswith(b"{"):
+                        data = _unprotect(data)  # A plain file from before is read as is and encrypted on the next save
+                    sessions = json.loads(data)
+                    self.sessions = {key: sid for key, sid in sessions.items() if isinstance(sid, str)}
+                except Exception as e:
+                    self.logging.warning(f"Unable to read saved sessions, logging in again: {e}")
+        return self.sessions
+
+    def _write(self):
+        try:
+            # Created with the restricted mode rather than narrowed after, the cookie is never readable by others
+            data = json.dumps(self.sessions).encode()
+            if os.name == "nt":
+                data = _protect(data)
+            descriptor = os.open(self.path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0),
+                                 0o600)
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(data)
+            os.replace(self.path + ".tmp", self.path)
+            os.chmod(self.path, 0o600)
+        except Exception as e:
+            self.logging.error(f"Unable to save sessions: {e}\n{traceback.format_exc()}")
+
+    def get(self, key: str):
+        """The saved SID for a login, None when there is none"""
+        with self.lock:
+            return self._load().get(key)
+
+    def save(self, key: str, sid: str):
+        with self.lock:
+            sessions = self._load()
+            if sessions.get(key) != sid:
+                sessions[key] = sid
+                self._write()
+
+    def discard(self, key: str):
+        """Forget a session the server no longer accepts"""
+        with self.lock:
+            if self._load().pop(key, None) is not None:
+                self._write()
@@ -0,0 +1,77 @@
+import asyncio
+
+
+class SingleFlight:
+    """Runs at most one task per key, concurrent callers for a key share the run that is in flight
+
+    With rerun=True a caller arriving while a run is in flight doesn't take its result, which may have been
+    computed from state that has changed since, but waits for one more run started once the current one ends.
+    Every caller arriving in the meantime shares that same follow-up run, built from the latest factory.
+    """
+
+    def __init__(self, event_loop):
+        self.event_loop = event_loop
+        self.running = {}  # key -> task in flight
+        self.follow_ups = {}  # key -> (future of the queued run, factory)
+        self.started = 0
+        self.shared = 0
+
+    def start(self, key, factory) -> asyncio.Future:
+        """The task in flight for key, or a new one running factory()"""
+        task = self.running.get(key)
+        if task is not None and not task.done():
+            self.shared += 1
+            return task
+        self.started += 1
+        task = self.event_loop.create_task(factory())
+        self.running[key] = task
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return task
+
+    def _finished(self, key, task):
+        if self.running.get(key) is task:
+            del self.running[key]
+        follow_up = self.follow_ups.pop(key, None)
+        if follow_up is None:
+            return
+        future, factory = follow_up
+        if future.done():
+            return
+        run = self.start(key, factory)
+        run.add_done_callback(lambda done: self._chain(done, future))
+
+    @staticmethod
+    def _chain(task, future: asyncio.Future):
+        if future.done():
+            return
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def schedule(self, key, factory) -> asyncio.Future:
+        """Start factory() now, or once the run in flight for key has finished if there is one"""
+        task = self.running.get(key)
+        if task is None or task.done():
+            return self.start(key, factory)
+        follow_up = self.follow_ups.get(key)
+        if follow_up is None:
+            future = self.event_loop.create_future()
+        else:
+            future = follow_up[0]
+            self.shared += 1
+        self.follow_ups[key] = (future, factory)
+        return future
+
+    async def run(self, key, factory, rerun: bool = False):
+        """Await the shared run for key, cancelling the caller never cancels the run other callers wait on"""
+        return await asyncio.shield(self.schedule(key, factory) if rerun else self.start(key, factory))
+
+    def cancel(self):
+        for future, _ in self.follow_ups.values():
+            future.cancel()
+        self.follow_ups.clear()
+        for task in list(self.running.values()):
+            task.cancel()
@@ -0,0 +1,24 @@
+"""Per-row numbers published by the main script for the ProgressSlot measures to read
+
+Every Python.dll measure runs in the same interpreter, so this module is shared between the Info measure that
+publishes and the slot measures that read, no string has to be formatted and parsed in between. That interpreter
+is shared by every loaded config too, so the values are kept per source: the Source option of the Info measure
+and of its slot measures, #CURRENTCONFIG# in the skin, keeps two configs from drawing each other's bars.
+"""
+
+_values = {}  # source -> tuple of values
+
+
+def publish(values, source: str = ""):
+    """Replace the values published for source, the tuple is swapped in whole so readers never see half an update"""
+    _values[source] = tuple(values)
+
+
+def discard(source: str = ""):
+    """Forget what a config published, once it is unloaded"""
+    _values.pop(source, None)
+
+
+def get(slot: int, default: float = 0.0, source: str = "") -> float:
+    values = _values.get(source, ())
+    return values[slot] if 0 <= slot < len(values) else default
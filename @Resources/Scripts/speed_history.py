@@ -0,0 +1,211 @@
+import array
+import collections
+import os
+import struct
+import time
+import traceback
+
+import combined_log
+
+# Name, seconds per point and number of points of each tier, every tier covers the span in its name
+tiers = (
+    ('1m', 4, 15),
+    ('1h', 60, 60),
+    ('24h', 900, 96),
+)
+
+_magic = b'QBSH'
+_file_version = 1
+_header = struct.Struct('<4sHHd')  # Magic, version, number of histories, time saved
+_tier_header = struct.Struct('<IIdddI')  # Step, points, bucket start, partial dl sum, partial up sum, samples
+
+
+class _Tier:
+    """Fixed size dl/up ring buffers, samples are averaged into one point per step"""
+
+    __slots__ = ('step', 'points', 'dl', 'up', 'head', 'bucket', 'dl_sum', 'up_sum', 'samples')
+
+    def __init__(self, step: int, points: int):
+        self.step = step
+        self.points = points
+        self.dl = array.array('f', bytes(4 * points))
+        self.up = array.array('f', bytes(4 * points))
+        self.head = 0  # Position the next finished point is written to, which is also the oldest point
+        self.bucket = None  # Start time of the point still being averaged
+        self.dl_sum = 0.0
+        self.up_sum = 0.0
+        self.samples = 0
+
+    def _push(self, dl: float, up: float):
+        self.dl[self.head] = dl
+        self.up[self.head] = up
+        self.head = (self.head + 1) % self.points
+
+    def add(self, now: float, dl: float, up: float):
+        bucket = now - now % self.step
+        if self.bucket is None:
+            self.bucket = bucket
+        elif bucket > self.bucket:
+            if self.samples:
+                self._push(self.dl_sum / self.samples, self.up_sum / self.samples)
+            else:
+                self._push(0.0, 0.0)
+            # Steps nothing was sampled in (the skin wasn't running) read as zero, one lap of the ring at most
+            for _ in range(min(int((bucket - self.bucket) // self.step) - 1, self.points)):
+                self._push(0.0, 0.0)
+            self.bucket = bucket
+            self.dl_sum = self.up_sum = 0.0
+            self.samples = 0
+        self.dl_sum += dl
+        self.up_sum += up
+        self.samples += 1
+
+    def _ordered(self, values: array.array) -> array.array:
+        return values[self.head:] + values[:self.head]
+
+    def series(self):
+        """Oldest to newest dl and up points, the newest being the average so far of the current step"""
+        dl, up = self._ordered(self.dl)[1:], self._ordered(self.up)[1:]
+        if self.samples:
+            dl.append(self.dl_sum / self.samples)
+            up.append(self.up_sum / self.samples)
+        else:
+            dl.append(0.0)
+            up.append(0.0)
+        return dl, up
+
+    def to_bytes(self) -> bytes:
+        bucket = self.bucket if self.bucket is not None else 0.0
+        return _tier_header.pack(self.step, self.points, bucket, self.dl_sum, self.up_sum, self.samples) + \
+            self._ordered(self.dl).tobytes() + self._ordered(self.up).tobytes()
+
+    def load_bytes(self, data: memoryview, pos: int) -> int:
+        step, points, bucket, dl_sum, up_sum, samples = _tier_header.unpack_from(data, pos)
+        if (step, points) != (self.step, self.points):
+            raise ValueError(f"Saved tier of {points}x{step}s does not match {self.points}x{self.step}s")
+        pos += _tier_header.size
+        self.dl = array.array('f', bytes(data[pos:pos + 4 * points]))
+        pos += 4 * points
+        self.up = array.array('f', bytes(data[pos:pos + 4 * points]))
+        pos += 4 * points
+        self.head = 0
+        self.bucket = bucket if bucket else None
+        self.dl_sum, self.up_sum, self.samples = dl_sum, up_sum, samples
+        return pos
+
+
+class SpeedHistory:
+    """Download and upload speed history of one torrent or of a whole server, in every tier"""
+
+    __slots__ = ('tiers',)
+
+    def __init__(self):
+        self.tiers = {name: _Tier(step, points) for name, step, points in tiers}
+
+    def add(self, now: float, dl: float, up: float):
+        for tier in self.tiers.values():
+            tier.add(now, dl, up)
+
+    def series(self, tier: str):
+        return self.tiers[tier].series()
+
+    def to_bytes(self) -> bytes:
+        return b''.join(tier.to_bytes() for tier in self.tiers.values())
+
+    def load_bytes(self, data: memoryview, pos: int) -> int:
+        for tier in self.tiers.values():
+            pos = tier.load_bytes(data, pos)
+        return pos
+
+
+class SpeedHistoryStore:
+    """The global speed history plus the histories of the most recently visible torrents
+
+    Memory does not grow with uptime (every history is a set of fixed size rings) or with the library
+    (only the last max_torrents torrents shown on a page keep a history). Everything is written to one
+    binary file every save_every seconds and on tear down, and read back on the next load.
+    """
+
+    def __init__(self, path: str, max_torrents: int = 32, save_every: float = 300,
+                 logging: combined_log.CombinedLogger = None):
+        self.path = path
+        self.max_torrents = max_torrents
+        self.save_every = save_every
+        self.logging = logging
+        self.total = SpeedHistory()
+        self.torrents = collections.OrderedDict()  # hash -> SpeedHistory, least recently visible first
+        self.last_save = time.time()
+
+    def sample(self, global_dl: float, global_up: float, visible: list, lookup, now: float = None):
+        """Record one tick, visible are the torrents on the page and lookup(hash) finds any other torrent"""
+        now = time.time() if now is None else now
+        self.total.add(now, global_dl, global_up)
+        for torrent in visible:
+            if torrent['hash'] in self.torrents:
+                self.torrents.move_to_end(torrent['hash'])
+            else:
+                self.torrents[torrent['hash']] = SpeedHistory()
+        while len(self.torrents) > self.max_torrents:
+            self.torrents.popitem(last=False)
+        for torrent_hash, history in self.torrents.items():
+            torrent = lookup(torrent_hash)
+            if torrent is None:
+                history.add(now, 0.0, 0.0)
+            else:
+                history.add(now, torrent.get('dlspeed', 0), torrent.get('upspeed', 0))
+        if now - self.last_save >= self.save_every:
+            self.save()
+
+    def get(self, torrent_hash: str):
+        return self.torrents.get(torrent_hash)
+
+    def save(self):
+        self.last_save = time.time()
+        try:
+            chunks = [_header.pack(_magic, _file_version, len(self.torrents), self.last_save),
+                      self.total.to_bytes()]
+            for torrent_hash, history in self.torrents.items():
+                key = torrent_hash.encode('ascii')
+                chunks.append(struct.pack('<B', len(key)) + key)
+                chunks.append(history.to_bytes())
+            with open(self.path + ".tmp", "wb") as f:
+                f.write(b''.join(chunks))
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            self.logging.error(f"Unable to save speed history: {e}\n{traceback.format_exc()}")
+
+    def load(self):
+        """Read the histories saved by a previous session, a missing or outdated file starts empty"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = memoryview(f.read())
+            magic, version, count, _ = _header.unpack_from(data, 0)
+            if magic != _magic or version != _file_version:
+                raise ValueError(f"Not a version {_file_version} speed history file")
+            pos = _header.size
+            total = SpeedHistory()
+            pos = total.load_bytes(data, pos)
+            torrents = collections.OrderedDict()
+            for _ in range(count):
+                key_length = data[pos]
+                torrent_hash = bytes(data[pos + 1:pos + 1 + key_length]).decode('ascii')
+                pos += 1 + key_length
+                history = SpeedHistory()
+                pos = history.load_bytes(data, pos)
+                torrents[torrent_hash] = history
+            while len(torrents) > self.max_torrents:
+                torrents.popitem(last=False)
+            self.total, self.torrents = total, torrents
+        except Exception as e:
+            self.logging.error(f"Unable to load speed history, starting empty: {e}\n{traceback.format_exc()}")
+
+
+def sparkline(values, width: float, height: float, peak: float) -> str:
+    """A Shape meter path drawing values left to right, peak being the value drawn at the top"""
+    if peak <= 0:
+        peak = 1
+    step = width / max(len(values) - 1, 1)
+    points = [f"{i * step:.1f},{height - min(value, peak) / peak * height:.1f}" for i, value in enumerate(values)]
+    return points[0] + "".join(f" | LineTo {point}" for point in points[1:])
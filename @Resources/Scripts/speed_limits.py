@@ -0,0 +1,109 @@
+import traceback
+
+import combined_log
+
+# The skin's names for the global limits -> the server_state field holding each and the Client method setting it
+fields = {'dl': 'dl_rate_limit', 'up': 'up_rate_limit'}
+_setters = {'dl_rate_limit': 'set_global_download_limit', 'up_rate_limit': 'set_global_upload_limit'}
+alt_field = 'use_alt_speed_limits'
+
+# Limits a scroll steps through, in bytes per second, 0 (unlimited) sits above the last one
+steps = tuple(kib * 1024 for kib in (64, 128, 256, 512, 1024, 2048, 5120, 10240, 20480, 51200, 102400))
+
+
+def step_limit(limit: int, direction: int) -> int:
+    """The limit one step up (direction > 0) or down from limit, stepping up from the top step lifts the limit"""
+    if direction > 0:
+        if limit <= 0:
+            return 0
+        return next((step for step in steps if step > limit), 0)
+    if limit <= 0:
+        return steps[-1]
+    return next((step for step in reversed(steps) if step < limit), steps[0])
+
+
+def current(servers, field: str, default=0):
+    """What the skin shows for a server_state field, the first connected server's value"""
+    for server in servers:
+        if server.connected:
+            return server.state_value(field, default)
+    return default
+
+
+class SpeedLimits:
+    """Sends the global download and upload limits and the alternative speed mode set from the skin
+
+    Every change is shown straight away (QBTServer.set_optimistic_state) and restarts a delay, only once the
+    skin has been left alone for that long does the last value go out, one request per server and setting.
+    A value the server already reports sends nothing, so toggling the alternative speeds twice costs no request.
+    The same limits are set on every connected server.
+    """
+
+    def __init__(self, event_loop, logging: combined_log.CombinedLogger, delay: float = 0.6):
+        self.event_loop = event_loop
+        self.logging = logging
+        self.delay = delay
+        self.pending = {}  # (server, field) -> value to send
+        self.flush_handle = None
+        self.requests = 0
+        self.tasks = set()
+
+    def set_limit(self, servers, field: str, limit: int):
+        """Set a limit in bytes per second, 0 lifts it"""
+        for server in servers:
+            if server.connected:
+                self._queue(server, field, max(0, int(limit)))
+
+    def step(self, servers, field: str, direction: int):
+        self.set_limit(servers, field, step_limit(current(servers, field), direction))
+
+    def set_alt(self, servers, enabled: bool):
+        for server in servers:
+            if server.connected:
+                self._queue(server, alt_field, bool(enabled))
+
+    def toggle_alt(self, servers):
+        self.set_alt(servers, not current(servers, alt_field, False))
+
+    def _queue(self, server, field: str, value):
+        server.set_optimistic_state(field, value)
+        self.pending[(server, field)] = value
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        self.flush_handle = self.event_loop.call_later(self.delay, self._start_flush)
+
+    def _start_flush(self):
+        task = self.event_loop.create_task(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self):
+        """Send every pending value the server doesn't already report"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        self.flush_handle = None
+        pending, self.pending = self.pending, {}
+        for (server, field), value in pending.items():
+            if server.server_state.get(field) == value:
+                server.revert_state(field)  # Back where the server already is
+                continue
+            try:
+                if server.qb is None:
+                    raise ConnectionError(f"{server.name} is not connected")
+                if field == alt_field:
+                    await self.event_loop.run_in_executor(None, server.qb.toggle_alternative_speed)
+                else:
+                    await self.event_loop.run_in_executor(None, getattr(server.qb, _setters[field]), value)
+                self.requests += 1
+                self.logging.info(f"{server.name}: {field} set to {value}")
+                server.confirm_state_sent(field)
+            except Exception as e:
+                self.logging.error(f"{server.name}: Setting {field} to {value} failed: {e}\n{traceback.format_exc()}")
+                server.revert_state(field)
+
+    def cancel(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        for task in list(self.tasks):
+            task.cancel()
@@ -0,0 +1,176 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+import combined_log
+
+
+class SupervisedTask:
+    """One long running coroutine owned by the supervisor and its restart history"""
+
+    def __init__(self, name: str, factory, restart: bool = True):
+        self.name = name
+        self.factory = factory  # Called with no arguments to get a fresh coroutine on every (re)start
+        self.restart = restart
+        self.task = None
+        self.state = "pending"  # pending, running, restarting, finished, failed, stopped
+        self.restarts = 0
+        self.failures = 0  # Failures in a row, drives the backoff
+        self.started_at = 0.0
+        self.last_error = None
+        self.restart_handle = None
+
+    def describe(self) -> str:
+        text = f"{self.name}: {self.state}"
+        if self.restarts:
+            text += f", {self.restarts} restart{'s' if self.restarts != 1 else ''}"
+        if self.last_error is not None and self.state != "running":
+            text += f" ({self.last_error})"
+        return text
+
+
+class Supervisor:
+    """Owns the interface's background tasks, restarts the ones that crash and watches the event loop for stalls
+
+    A crashed task is restarted after base_delay seconds, doubling for every crash in a row up to max_delay. A
+    task that ran for healthy_after seconds before crashing starts over from base_delay.
+
+    The lag probe wakes every probe_interval seconds and records how late it was woken, a watchdog thread checks
+    that the probe keeps running and when it hasn't for stall_after seconds logs what the loop thread is stuck on.
+    """
+
+    def __init__(self, event_loop, logging: combined_log.CombinedLogger, base_delay: float = 1.0,
+                 max_delay: float = 60.0, healthy_after: float = 30.0, probe_interval: float = 0.5,
+                 stall_after: float = 1.0, report_every: float = 600.0):
+        self.event_loop = event_loop
+        self.logging = logging
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.healthy_after = healthy_after
+        self.probe_interval = probe_interval
+        self.stall_after = stall_after
+        self.report_every = report_every
+        self.tasks = {}
+        self.lag = 0.0  # Lateness of the last probe wake up
+        self.max_lag = 0.0  # Worst lateness since the last report
+        self.stalls = 0
+        self.last_stall_stack = None
+        self._probe_task = None
+        self._heartbeat = None
+        self._loop_thread_id = None
+        self._stall_reported = False
+        self._watchdog = None
+        self._watchdog_stop = threading.Event()
+
+    def supervise(self, name: str, factory, restart: bool = True) -> SupervisedTask:
+        """Start factory() as a task named name, restarted with backoff whenever it raises"""
+        supervised = SupervisedTask(name, factory, restart=restart)
+        self.tasks[name] = supervised
+        self._start(supervised)
+        return supervised
+
+    def _start(self, supervised: SupervisedTask):
+        supervised.restart_handle = None
+        supervised.started_at = self.event_loop.time()
+        supervised.state = "running"
+        supervised.task = self.event_loop.create_task(supervised.factory())
+        supervised.task.add_done_callback(lambda task: self._on_done(supervised, task))
+
+    def _on_done(self, supervised: SupervisedTask, task: asyncio.Task):
+        if task is not supervised.task:
+            return
+        if task.cancelled():
+            supervised.state = "stopped"
+            self.logging.info(f"Task {supervised.name} cancelled")
+            return
+        error = task.exception()
+        if error is None:
+            supervised.state = "finished"
+            self.logging.info(f"Task {supervised.name} finished")
+            return
+        supervised.last_error = f"{type(error).__name__}: {error}"
+        trace = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+        self.logging.error(f"Task {supervised.name} crashed: {supervised.last_error}\n{trace}")
+        if not supervised.restart:
+            supervised.state = "failed"
+            return
+        if self.event_loop.time() - supervised.started_at >= self.healthy_after:
+            supervised.failures = 0
+        supervised.failures += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (supervised.failures - 1))
+        supervised.state = "restarting"
+        self.logging.warning(f"Restarting {supervised.name} in {delay:.1f}s (failure {supervised.failures} in a row)")
+        supervised.restart_handle = self.event_loop.call_later(delay, self._restart, supervised)
+
+    def _restart(self, supervised: SupervisedTask):
+        if supervised.state != "restarting":
+            return
+        supervised.restarts += 1
+        self._start(supervised)
+
+    def stop(self, name: str):
+        """Cancel a task for good, it won't be restarted"""
+        supervised = self.tasks.get(name)
+        if supervised is None:
+            return
+        if supervised.restart_handle is not None:
+            supervised.restart_handle.cancel()
+            supervised.restart_handle = None
+        supervised.state = "stopped"
+        if supervised.task is not None and not supervised.task.done():
+            supervised.task.cancel()
+
+    def start_monitor(self):
+        """Start the lag probe and the watchdog thread that reports stalls"""
+        self._probe_task = self.event_loop.create_task(self._lag_probe())
+        self._watchdog_stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="Loop watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def _lag_probe(self):
+        self._loop_thread_id = threading.get_ident()
+        last_report = time.monotonic()
+        while True:
+            self._heartbeat = time.monotonic()
+            self._stall_reported = False
+            expected = self.event_loop.time() + self.probe_interval
+            await asyncio.sleep(self.probe_interval)
+            self.lag = max(0.0, self.event_loop.time() - expected)
+            self.max_lag = max(self.max_lag, self.lag)
+            if time.monotonic() - last_report >= self.report_every:
+                last_report = time.monotonic()
+                self.logging.info(f"Health: {self.status_text()}")
+                self.max_lag = 0.0
+
+    def _watch(self):
+        """Runs on its own thread, the loop thread can't report on itself while it's blocked"""
+        while not self._watchdog_stop.wait(self.probe_interval):
+            if self.event_loop.is_closed():
+                return
+            heartbeat = self._heartbeat
+            if heartbeat is None or self._stall_reported:
+                continue
+            blocked = time.monotonic() - heartbeat - self.probe_interval
+            if blocked < self.stall_after:
+                continue
+            self._stall_reported = True
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "unavailable"
+            self.last_stall_stack = stack
+            self.logging.warning(f"Event loop blocked for over {blocked:.1f}s, it is currently at:\n{stack}")
+
+    def status_text(self) -> str:
+        tasks = " | ".join(supervised.describe() for supervised in self.tasks.values())
+        return f"{tasks} | loop lag {self.lag * 1000:.0f}ms (max {self.max_lag * 1000:.0f}ms, {self.stalls} stalls)"
+
+    def cancel_all(self):
+        """Stop every task, the probe and the watchdog"""
+        for name in list(self.tasks):
+            self.stop(name)
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        self._watchdog_stop.set()
@@ -0,0 +1,116 @@
+import traceback
+
+import combined_log
+
+# Action -> the Client method taking a list of hashes, every one of them is a single request with the hashes
+# joined by |
+methods = {
+    'pause': 'pause_multiple',
+    'resume': 'resume_multiple',
+    'recheck': 'recheck',
+    'reannounce': 'reannounce',
+}
+# Queuing one of these cancels the other for the same torrent if it hasn't been sent yet
+_opposites = {'pause': 'resume', 'resume': 'pause'}
+
+_paused_states = frozenset(('pausedDL', 'pausedUP', 'stoppedDL', 'stoppedUP'))
+
+
+def expected_state(action: str, torrent):
+    """The state qBittorrent is expected to report once the action is applied, None when it won't change"""
+    complete = torrent.progress >= 1
+    if action == 'pause':
+        return None if torrent.state in _paused_states else 'pausedUP' if complete else 'pausedDL'
+    if action == 'resume':
+        return None if torrent.state not in _paused_states else 'queuedUP' if complete else 'queuedDL'
+    if action == 'recheck':
+        return 'checkingUP' if complete else 'checkingDL'
+    return None
+
+
+def is_paused(torrent) -> bool:
+    return torrent.state in _paused_states
+
+
+class ActionBatcher:
+    """Collects torrent actions from the skin and sends each kind as one request per server
+
+    Every click restarts a short delay so a burst of clicks goes out together, but nothing waits longer than
+    max_wait. Torrents are shown in their expected state straight away (QBTServer.set_optimistic), a failed
+    request puts them back.
+    """
+
+    def __init__(self, event_loop, logging: combined_log.CombinedLogger, delay: float = 0.3, max_wait: float = 1.0):
+        self.event_loop = event_loop
+        self.logging = logging
+        self.delay = delay
+        self.max_wait = max_wait
+        self.pending = {}  # (server, action) -> set of hashes
+        self.flush_handle = None
+        self.first_queued = None
+        self.requests = 0
+        self.tasks = set()
+
+    def queue(self, server, action: str, hashes):
+        """Add hashes to the next request of their kind and show them in their expected state"""
+        if action not in methods:
+            raise ValueError(f"Unknown torrent action {action}")
+        queued = self.pending.setdefault((server, action), set())
+        opposite = self.pending.get((server, _opposites.get(action)))
+        for torrent_hash in hashes:
+            torrent = server.index.torrents.get(torrent_hash)
+            if torrent is None:
+                continue
+            if opposite is not None and torrent_hash in opposite:
+                # Paused and resumed again before anything was sent, nothing has to be sent at all
+                opposite.discard(torrent_hash)
+                server.revert([torrent_hash])
+                continue
+            queued.add(torrent_hash)
+            state = expected_state(action, torrent)
+            if state is not None:
+                server.set_optimistic(torrent_hash, state)
+        self.pending = {key: hashes for key, hashes in self.pending.items() if hashes}
+        self._schedule()
+
+    def _schedule(self):
+        now = self.event_loop.time()
+        if self.first_queued is None:
+            self.first_queued = now
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        delay = min(self.delay, max(0.0, self.first_queued + self.max_wait - now))
+        self.flush_handle = self.event_loop.call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        task = self.event_loop.create_task(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self):
+        """Send everything queued, one request per server and action"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        self.flush_handle = None
+        self.first_queued = None
+        pending, self.pending = self.pending, {}
+        for (server, action), hashes in pending.items():
+            hashes = sorted(hashes)
+            try:
+                if server.qb is None:
+                    raise ConnectionError(f"{server.name} is not connected")
+                await self.event_loop.run_in_executor(None, getattr(server.qb, methods[action]), hashes)
+                self.requests += 1
+                self.logging.info(f"{server.name}: {action} sent for {len(hashes)} torrent(s)")
+                server.confirm_sent(hashes)
+            except Exception as e:
+                self.logging.error(f"{server.name}: {action} failed for {len(hashes)} torrent(s): {e}\n"
+                                   f"{traceback.format_exc()}")
+                server.revert(hashes)
+
+    def cancel(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        for task in list(self.tasks):
+            task.cancel()
@@ -0,0 +1,232 @@
+import asyncio
+import heapq
+import time
+import traceback
+from collections import OrderedDict
+
+import humanize
+
+import combined_log
+
+tabs = ('files', 'peers', 'trackers')
+
+# Every meter of the panel, shown and hidden together
+panel_meters = ('DetailBackground', 'DetailTitle', 'DetailClose', 'DetailText', 'DetailPause', 'DetailResume',
+                'DetailRecheck', 'DetailReannounce')
+
+_tracker_status = {0: "Disabled", 1: "Not contacted", 2: "Working", 3: "Updating", 4: "Not working"}
+
+
+def _clean(text) -> str:
+    """Text that can sit inside a quoted !SetOption value"""
+    return str(text).replace('"', "'")
+
+
+class PeerTable:
+    """A torrent's peers mirrored from the sync/torrentPeers deltas"""
+
+    def __init__(self):
+        self.rid = 0
+        self.peers = {}  # "ip:port" -> peer fields
+
+    def apply(self, data: dict):
+        if data.get('full_update'):
+            self.peers.clear()
+        for peer_id, changes in data.get('peers', {}).items():
+            peer = self.peers.get(peer_id)
+            if peer is None:
+                self.peers[peer_id] = dict(changes)
+            else:
+                peer.update(changes)
+        for peer_id in data.get('peers_removed', []):
+            self.peers.pop(peer_id, None)
+        self.rid = data.get('rid', self.rid)
+
+    def lines(self, limit: int) -> list:
+        """The fastest peers, formatted one per line"""
+        fastest = heapq.nlargest(limit, self.peers.items(),
+                                 key=lambda item: item[1].get('dl_speed', 0) + item[1].get('up_speed', 0))
+        lines = [f"{len(self.peers)} peers"]
+        for peer_id, peer in fastest:
+            lines.append(f"{peer_id:<22.22} {_clean(peer.get('client', '')):<20.20} "
+                         f"{peer.get('progress', 0) * 100:5.1f}%  "
+                         f"D {humanize.naturalsize(peer.get('dl_speed', 0))}/s  "
+                         f"U {humanize.naturalsize(peer.get('up_speed', 0))}/s")
+        return lines
+
+
+class FilesCache:
+    """Rendered file lists kept per torrent hash, the least recently opened is evicted first
+
+    Only the lines the panel shows and a summary are kept, not the file list itself, a torrent with thousands of
+    files costs as much as one with a few.
+    """
+
+    def __init__(self, max_entries: int = 16, max_age: float = 10.0):
+        self.max_entries = max_entries
+        self.max_age = max_age  # A downloading torrent's files are fetched again once their lines are this old
+        self.entries = OrderedDict()  # hash -> (lines, progress when fetched, time fetched)
+
+    def get(self, torrent_hash: str, progress: float):
+        """The cached lines, or None when they have to be fetched"""
+        entry = self.entries.get(torrent_hash)
+        if entry is None:
+            return None
+        self.entries.move_to_end(torrent_hash)
+        lines, fetched_progress, fetched_at = entry
+        if fetched_progress != progress and time.monotonic() - fetched_at >= self.max_age:
+            return None
+        return lines
+
+    def put(self, torrent_hash: str, lines: list, progress: float):
+        self.entries[torrent_hash] = (lines, progress, time.monotonic())
+        self.entries.move_to_end(torrent_hash)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+def file_lines(files: list, limit: int) -> list:
+    complete = sum(1 for file in files if file.get('progress', 0) >= 1)
+    total = sum(file.get('size', 0) for file in files)
+    lines = [f"{len(files)} files, {complete} complete, {humanize.naturalsize(total)}"]
+    for file in files[:limit]:
+        lines.append(f"{file.get('progress', 0) * 100:5.1f}%  {humanize.naturalsize(file.get('size', 0)):>9}  "
+                     f"{_clean(file.get('name', ''))}")
+    if len(files) > limit:
+        lines.append(f"... and {len(files) - limit} more")
+    return lines
+
+
+def tracker_lines(trackers: list, limit: int) -> list:
+    # The first three entries are the DHT, PeX and LSD pseudo trackers
+    real = [tracker for tracker in trackers if not str(tracker.get('url', '')).startswith('** [')]
+    lines = [f"{len(real)} trackers"]
+    for tracker in real[:limit]:
+        lines.append(f"{_tracker_status.get(tracker.get('status'), '?'):<13} "
+                     f"seeds {tracker.get('num_seeds', 0):>4} peers {tracker.get('num_peers', 0):>4}  "
+                     f"{_clean(tracker.get('url', ''))}")
+    return lines
+
+
+class TorrentDetails:
+    """The files, peers and trackers of one selected torrent, only fetched while the panel is open
+
+    Every request and all of the formatting runs on a worker thread, the refresh cycle only picks up the values
+    rendered by the last fetch.
+    """
+
+    def __init__(self, event_loop, logging: combined_log.CombinedLogger, max_lines: int = 20,
+                 interval: float = 2.0, trackers_every: float = 10.0, files_cache_size: int = 16):
+        self.event_loop = event_loop
+        self.logging = logging
+        self.max_lines = max_lines
+        self.interval = interval
+        self.trackers_every = trackers_every
+        self.files = FilesCache(files_cache_size)
+        self.server = None
+        self.torrent_hash = None
+        self.tab = tabs[0]
+        self.peers = PeerTable()
+        self.lines = {tab: ["Loading..."] for tab in tabs}
+        self.trackers_at = 0.0
+        self.on_update = None  # Called with no arguments whenever new lines have been rendered
+        self.idle = None  # asyncio.Event set while the main refresh isn't running, fetches wait for it
+        self.rendered = self.closed_values()
+
+    @property
+    def open(self) -> bool:
+        return self.torrent_hash is not None
+
+    def select(self, server, torrent_hash: str):
+        """Point the panel at a torrent, run() does the fetching"""
+        self.server = server
+        self.torrent_hash = torrent_hash
+        self.peers = PeerTable()
+        self.lines = {tab: ["Loading..."] for tab in tabs}
+        self.lines['files'] = self.files.get(torrent_hash, self._torrent().progress) or ["Loading..."]
+        self.trackers_at = 0.0
+        self.render()
+
+    def close(self):
+        self.server = None
+        self.torrent_hash = None
+        self.peers = PeerTable()
+        self.rendered = self.closed_values()
+
+    def next_tab(self):
+        self.tab = tabs[(tabs.index(self.tab) + 1) % len(tabs)]
+        if self.open:
+            self.render()
+
+    def _torrent(self):
+        return self.server.index.torrents.get(self.torrent_hash)
+
+    async def run(self):
+        """Fetch the open torrent's details every interval seconds until the panel is closed"""
+        while self.open:
+            torrent = self._torrent()
+            if torrent is None or not self.server.connected:
+                await asyncio.sleep(self.interval)
+                continue
+            try:
+                if self.idle is not None:
+                    # Decoding a large file or peer list holds the GIL, keep it out of the refresh's way
+                    await self.idle.wait()
+                await self.fetch(torrent)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logging.error(f"Failed to fetch details of {self.torrent_hash}: {e}\n{traceback.format_exc()}")
+            await asyncio.sleep(self.interval)
+
+    async def fetch(self, torrent):
+        torrent_hash, server, peers = self.torrent_hash, self.server, self.peers
+        lines = {}
+        # Only the visible tab is fetched every time, the others when they are switched to or go stale
+        if self.tab == 'peers' or peers.rid == 0:
+            lines['peers'] = await self.event_loop.run_in_executor(None, self._fetch_peers, server, torrent_hash,
+                                                                   peers)
+        if self.files.get(torrent_hash, torrent.progress) is None:
+            progress = torrent.progress
+            files = await self.event_loop.run_in_executor(None, self._fetch_files, server, torrent_hash)
+            self.files.put(torrent_hash, files, progress)
+        lines['files'] = self.files.get(torrent_hash, torrent.progress) or self.lines['files']
+        if time.monotonic() - self.trackers_at >= self.trackers_every:
+            lines['trackers'] = await self.event_loop.run_in_executor(None, self._fetch_trackers, server,
+                                                                      torrent_hash)
+            self.trackers_at = time.monotonic()
+        if self.torrent_hash != torrent_hash:
+            return  # Another torrent was selected while this one was being fetched
+        self.lines.update(lines)
+        self.render()
+        if self.on_update is not None:
+            self.on_update()
+
+    def _fetch_peers(self, server, torrent_hash: str, peers: PeerTable) -> list:
+        """Blocking, runs on a worker thread"""
+        peers.apply(server.qb.sync_peers_data(torrent_hash, rid=peers.rid))
+        return peers.lines(self.max_lines - 1)
+
+    def _fetch_files(self, server, torrent_hash: str) -> list:
+        """Blocking, runs on a worker thread"""
+        return file_lines(server.qb.get_torrent_files(torrent_hash), self.max_lines - 2)
+
+    def _fetch_trackers(self, server, torrent_hash: str) -> list:
+        """Blocking, runs on a worker thread"""
+        return tracker_lines(server.qb.get_torrent_trackers(torrent_hash), self.max_lines - 1)
+
+    def render(self):
+        torrent = self._torrent()
+        name = _clean(torrent.name) if torrent is not None else "Torrent removed"
+        others = ", ".join(tab for tab in tabs if tab != self.tab)
+        self.rendered = {meter: {'Hidden': 0} for meter in panel_meters}
+        self.rendered['DetailTitle'].update(Text=f"{self.tab.capitalize()}: {name}", ToolTipText=f"Click for {others}")
+        self.rendered['DetailText']['Text'] = "#CRLF#".join(self.lines[self.tab])
+
+    @staticmethod
+    def closed_values() -> dict:
+        return {meter: {'Hidden': 1} for meter in panel_meters}
+
+    def bang(self) -> str:
+        return "".join(f"[!SetOption {meter} {key} \"{value}\"]" for meter, values in self.rendered.items()
+                       for key, value in values.items()) + "[!UpdateMeterGroup Details][!Redraw]"
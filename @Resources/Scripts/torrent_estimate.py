@@ -0,0 +1,45 @@
+"""How far a torrent has got since its server last reported it, from the speeds it was last reported at
+
+Between polls the rows move on by themselves: progress, bytes downloaded, ETA and ratio are worked out on every
+Update from the last sync, and the next sync puts the reported values back.
+"""
+import time
+
+unknown_eta = 8640000  # What qBittorrent reports when it can't tell
+
+
+class Estimate:
+    """The fields of a torrent a row shows that move between polls"""
+    __slots__ = ('progress', 'downloaded', 'amount_left', 'eta', 'ratio', 'added_on')
+
+    def __init__(self, torrent, elapsed: float):
+        self.added_on = torrent.added_on
+        downloaded, amount_left, progress = torrent.downloaded, torrent.amount_left, torrent.progress
+        gained = min(amount_left, torrent.dlspeed * elapsed) if amount_left > 0 else 0
+        if gained > 0:
+            # amount_left is the (1 - progress) of the torrent still missing, the gain takes its share of it
+            progress = min(1.0, progress + (1.0 - progress) * gained / amount_left)
+            downloaded += gained
+            amount_left -= gained
+        self.progress = progress
+        self.downloaded = int(downloaded)
+        self.amount_left = int(amount_left)
+        self.eta = torrent.eta if not 0 < torrent.eta < unknown_eta else max(0, int(torrent.eta - elapsed))
+        if downloaded > 0 and (gained > 0 or torrent.upspeed > 0):
+            self.ratio = (torrent.ratio * torrent.downloaded + torrent.upspeed * elapsed) / downloaded
+        else:
+            self.ratio = torrent.ratio
+
+
+def estimate(torrents, synced_at: dict, limit: float, now: float = None) -> list:
+    """An Estimate per torrent, synced_at maps each torrent's server name to when it last synced
+
+    A server that hasn't synced for limit seconds has stalled, its torrents stop moving there.
+    """
+    if now is None:
+        now = time.monotonic()
+    estimates = []
+    for torrent in torrents:
+        synced = synced_at.get(torrent.server)
+        estimates.append(Estimate(torrent, 0.0 if synced is None else min(max(0.0, now - synced), limit)))
+    return estimates
@@ -0,0 +1,290 @@
+import re
+from urllib.parse import urlparse
+
+from torrent_record import TorrentRecord
+
+# Groups of qBittorrent states the filter dropdown offers, mirrors the WebUI's own status filters
+_state_groups = {
+    'downloading': ['downloading', 'metaDL', 'forcedMetaDL', 'stalledDL', 'queuedDL', 'forcedDL', 'allocating',
+                    'checkingDL'],
+    'seeding': ['uploading', 'stalledUP', 'queuedUP', 'forcedUP', 'checkingUP'],
+    'paused': ['pausedDL', 'pausedUP', 'stoppedDL', 'stoppedUP'],
+    'errored': ['error', 'missingFiles', 'unknown'],
+}
+
+
+def expand_states(name: str) -> tuple:
+    """The states a group of the filter dropdown (downloading, seeding, paused, errored) stands for, or just name"""
+    return tuple(_state_groups.get(name, (name,)))
+
+
+def tracker_host(tracker: str) -> str:
+    """The host of a tracker URL, trackers are filtered and summed up by it"""
+    if not tracker:
+        return ""
+    return urlparse(tracker).hostname or tracker
+
+
+class TorrentIndex:
+    """The local torrent set for one server as TorrentRecords, with secondary indexes kept up to date
+
+    Each index maps a value to the set of hashes holding it, so selecting every torrent in a state,
+    category, tag or tracker is a dict lookup instead of a scan over the whole library.
+    """
+
+    indexed_fields = ('state', 'category', 'tags', 'tracker', 'active')
+    # The fields each index is derived from, a change to any of them re-indexes the torrent
+    _sources = {
+        'state': ('state',),
+        'category': ('category',),
+        'tags': ('tags',),
+        'tracker': ('tracker',),
+        'active': ('dlspeed', 'upspeed'),
+    }
+
+    def __init__(self):
+        self.torrents = {}
+        self.indexes = {field: {} for field in self.indexed_fields}
+        self.version = 0  # Bumped whenever membership of any index changes
+
+    @staticmethod
+    def _index_values(field: str, torrent: dict) -> tuple:
+        if field == 'tags':
+            tags = torrent.get('tags', "")
+            return tuple(tag.strip() for tag in tags.split(",") if tag.strip()) if tags else ()
+        if field == 'tracker':
+            return (tracker_host(torrent.get('tracker', "")),)
+        if field == 'active':
+            return (torrent.get('dlspeed', 0) > 0 or torrent.get('upspeed', 0) > 0,)
+        return (torrent.get(field),)
+
+    def _add_to_index(self, field: str, key, torrent: dict):
+        index = self.indexes[field]
+        for value in self._index_values(field, torrent):
+            index.setdefault(value, set()).add(key)
+
+    def _remove_from_index(self, field: str, key, torrent: dict):
+        index = self.indexes[field]
+        for value in self._index_values(field, torrent):
+            members = index.get(value)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del index[value]
+
+    def upsert(self, key, changes: dict) -> dict:
+        """Add a torrent or apply a sync/maindata delta to one, only the touched indexes are updated"""
+        torrent = self.torrents.get(key)
+        if torrent is None:
+            # The torrents of a full update may already be records, built by the WebUI client's decoder
+            torrent = changes if isinstance(changes, TorrentRecord) else TorrentRecord.from_api(changes)
+            self.torrents[key] = torrent
+            for field in self.indexed_fields:
+                self._add_to_index(field, key, torrent)
+            self.version += 1
+            return torrent
+        touched = [field for field in self.indexed_fields
+                   if any(source in changes for source in self._sources[field])]
+        for field in touched:
+            self._remove_from_index(field, key, torrent)
+        torrent.update(changes)
+        for field in touched:
+            self._add_to_index(field, key, torrent)
+        if touched:
+            self.version += 1
+        return torrent
+
+    def remove(self, key):
+        torrent = self.torrents.pop(key, None)
+        if torrent is not None:
+            for field in self.indexed_fields:
+                self._remove_from_index(field, key, torrent)
+            self.version += 1
+
+    def clear(self):
+        self.torrents = {}
+        self.indexes = {field: {} for field in self.indexed_fields}
+        self.version += 1
+
+    def lookup(self, field: str, value) -> set:
+        """All keys whose indexed field holds value, the returned set must not be modified"""
+        return self.indexes[field].get(value, set())
+
+    def values(self, field: str) -> list:
+        """The distinct values currently present in an index"""
+        return list(self.indexes[field].keys())
+
+    def __len__(self):
+        return len(self.torrents)
+
+
+class Predicate:
+    """A filter over a TorrentIndex, predicates combine with &, | and ~
+
+    select() returns the matching keys, restricted to candidates when given. Index-backed predicates
+    answer from the indexes and are evaluated first so that any scanning predicate only has to look at
+    the torrents that survived them.
+    """
+
+    indexed = True
+
+    def select(self, index: TorrentIndex, candidates: set = None) -> set:
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+
+class Everything(Predicate):
+
+    def select(self, index, candidates=None):
+        return index.torrents.keys() if candidates is None else candidates
+
+    def __repr__(self):
+        return "Everything()"
+
+
+class FieldIn(Predicate):
+    """Torrents whose indexed field holds any of the given values"""
+
+    def __init__(self, field: str, *values):
+        if field not in TorrentIndex.indexed_fields:
+            raise ValueError(f"{field} is not an indexed field")
+        self.field = field
+        self.values = values
+
+    def select(self, index, candidates=None):
+        if len(self.values) == 1:
+            matched = index.lookup(self.field, self.values[0])
+        else:
+            matched = set()
+            for value in self.values:
+                matched |= index.lookup(self.field, value)
+        return matched if candidates is None else candidates & matched
+
+    def __repr__(self):
+        return f"FieldIn({self.field!r}, {', '.join(repr(v) for v in self.values)})"
+
+
+class NameContains(Predicate):
+    """Case-insensitive substring match on the torrent name, this one has to scan"""
+
+    indexed = False
+
+    def __init__(self, text: str):
+        self.text = text.lower()
+
+    def select(self, index, candidates=None):
+        keys = index.torrents.keys() if candidates is None else candidates
+        torrents = index.torrents
+        return {key for key in keys if self.text in torrents[key].get('name', "").lower()}
+
+    def __repr__(self):
+        return f"NameContains({self.text!r})"
+
+
+class NameMatches(Predicate):
+    """Regular expression search on the torrent name"""
+
+    indexed = False
+
+    def __init__(self, pattern: str):
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+
+    def select(self, index, candidates=None):
+        keys = index.torrents.keys() if candidates is None else candidates
+        torrents = index.torrents
+        return {key for key in keys if self.pattern.search(torrents[key].get('name', ""))}
+
+    def __repr__(self):
+        return f"NameMatches({self.pattern.pattern!r})"
+
+
+class And(Predicate):
+
+    def __init__(self, *predicates):
+        # Index lookups narrow the candidates before anything has to scan
+        self.predicates = sorted(predicates, key=lambda p: not p.indexed)
+        self.indexed = all(p.indexed for p in predicates)
+
+    def select(self, index, candidates=None):
+        for predicate in self.predicates:
+            candidates = predicate.select(index, candidates)
+            if not candidates:
+                return set()
+        return candidates
+
+    def __repr__(self):
+        return f"And({', '.join(repr(p) for p in self.predicates)})"
+
+
+class Or(Predicate):
+
+    def __init__(self, *predicates):
+        self.predicates = predicates
+        self.indexed = all(p.indexed for p in predicates)
+
+    def select(self, index, candidates=None):
+        matched = set()
+        for predicate in self.predicates:
+            matched |= predicate.select(index, candidates)
+        return matched
+
+    def __repr__(self):
+        return f"Or({', '.join(repr(p) for p in self.predicates)})"
+
+
+class Not(Predicate):
+
+    def __init__(self, predicate: Predicate):
+        self.predicate = predicate
+        self.indexed = predicate.indexed
+
+    def select(self, index, candidates=None):
+        everything = index.torrents.keys() if candidates is None else candidates
+        return set(everything) - self.predicate.select(index, candidates)
+
+    def __repr__(self):
+        return f"Not({self.predicate!r})"
+
+
+def parse_filter(spec) -> Predicate:
+    """Build a predicate from a filter bang or the settings.json filter value
+
+    A list of specs is combined with AND. Recognised specs are filter_all, filter_active, filter_<state group>
+    (downloading, seeding, paused, errored) and filter_<field>:<value> where field is one of
+    state, category, tag, tracker, name (substring) or regex.
+    """
+    if isinstance(spec, (list, tuple)):
+        predicates = [parse_filter(s) for s in spec]
+        predicates = [p for p in predicates if not isinstance(p, Everything)]
+        if not predicates:
+            return Everything()
+        return predicates[0] if len(predicates) == 1 else And(*predicates)
+    if not spec or spec == 'filter_all':
+        return Everything()
+    name = spec[len('filter_'):] if spec.startswith('filter_') else spec
+    if name == 'active':
+        return FieldIn('active', True)
+    if name in _state_groups:
+        return FieldIn('state', *_state_groups[name])
+    field, _, value = name.partition(":")
+    if field == 'state':
+        return FieldIn('state', value)
+    if field == 'category':
+        return FieldIn('category', value)
+    if field == 'tag':
+        return FieldIn('tags', value)
+    if field == 'tracker':
+        return FieldIn('tracker', tracker_host(value) if "//" in value else value)
+    if field == 'name':
+        return NameContains(value)
+    if field == 'regex':
+        return NameMatches(value)
+    raise ValueError(f"Unknown filter {spec}")
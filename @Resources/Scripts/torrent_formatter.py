@@ -1,3 +1,4 @@
+import functools
 import logging
 import os
 import pathlib
@@ -64,42 +65,62 @@ def _display_time(seconds, granularity=2):
     return ' '.join(result[:granularity])
 
 
-def torrent_format(tr_dict):
-    rm_values = {}
-    for i in range(4):
-        rm_values[f'TorrentName{i}'] = {'Text': tr_dict[i]['name']}
-        rm_values[f'TorrentName{i}']['ToolTipText'] = tr_dict[i]['name']
-        temp_path = os.path.abspath(tr_dict[i]['content_path'].replace("/mnt/qnap/Shared", r"\\172.17.0.1\Shared"))
-        if os.path.isdir(temp_path):
-            save_path = temp_path
-        else:
-            save_path = os.path.dirname(temp_path)
+@functools.lru_cache(maxsize=4096)
+def _save_path(content_path: str) -> str:
+    """The folder Explorer opens for a torrent, isdir can go out to the network share so answers are kept"""
+    temp_path = os.path.abspath(content_path.replace("/mnt/qnap/Shared", r"\\172.17.0.1\Shared"))
+    if os.path.isdir(temp_path):
+        return temp_path
+    return os.path.dirname(temp_path)
+
+
+def torrent_format(tr_dict, rows=4):
+    rm_values = no_torrent_template(rows, start=len(tr_dict))  # Rows past the last torrent are blanked
+    for i in range(min(rows, len(tr_dict))):
+        torrent = tr_dict[i]
+        rm_values[f'TorrentName{i}'] = {'Text': torrent.name}
+        rm_values[f'TorrentName{i}']['ToolTipText'] = torrent.name
+        save_path = _save_path(torrent.content_path)
         rm_values[f'TorrentName{i}']['LeftMouseDoubleClickAction'] = f"\"\"[\"explorer.exe\" \"{save_path}\"]\"\""
-        rm_values[f'TorrentStatus{i}'] = {'Text': tr_dict[i]['state'][0].upper() + tr_dict[i]['state'][1:]}
-        rm_values[f'TorrentDSpeed{i}'] = {'Text': "Down speed: " + humanize.naturalsize(tr_dict[i]['dlspeed']) + "/s"}
+        rm_values[f'TorrentStatus{i}'] = {'Text': torrent.state[0].upper() + torrent.state[1:]}
+        rm_values[f'TorrentDSpeed{i}'] = {'Text': "Down speed: " + humanize.naturalsize(torrent.dlspeed) + "/s"}
         if rm_values[f'TorrentStatus{i}']['Text'] in _show_seeders:
-            rm_values[f'TorrentSeeds{i}'] = {'Text': f"Seeds: {tr_dict[i]['num_complete']}({tr_dict[i]['num_seeds']})"}
+            rm_values[f'TorrentSeeds{i}'] = {'Text': f"Seeds: {torrent.num_complete}({torrent.num_seeds})"}
         else:
             rm_values[f'TorrentSeeds{i}'] = {'Text': \
-                f"Leechs: {tr_dict[i]['num_incomplete']}({tr_dict[i]['num_leechs']})"}
-        rm_values[f'TorrentETA{i}'] = {'Text': "ETA: " + _display_time(tr_dict[i]['eta'])}
-        rm_values[f'TorrentPercentage{i}'] = {'Text': f"{tr_dict[i]['progress'] * 100:.1f}%"}
-        rm_values[f'TorrentProgress{i}'] = {'Text': \
-              humanize.naturalsize(tr_dict[i]['downloaded']) + "/" +\
-              humanize.naturalsize(tr_dict[i]['downloaded'] + tr_dict[i]['amount_left'])}
-        rm_values[f'TorrentProgressBar{i}'] = {'BarColor': _barColors[rm_values[f'TorrentStatus{i}']['Text']]}
-        rm_values[f'TorrentUSpeed{i}'] = {'Text': "Up speed: " + humanize.naturalsize(tr_dict[i]['upspeed']) + "/s"}
-        rm_values[f'TorrentAddedOn{i}'] = {'Text': humanize.naturaltime(
-            datetime.fromtimestamp(tr_dict[i]['added_on'], tz=timezone("US/Eastern")).replace(tzinfo=None)
-        )}
-        rm_values[f'TorrentRatio{i}'] = {'Text': f"Ratio: {tr_dict[i]['ratio']:.2f}"}
+                f"Leechs: {torrent.num_incomplete}({torrent.num_leechs})"}
+        _live_values(rm_values, i, torrent)
+        rm_values[f'TorrentProgressBar{i}'] = {'BarColor': _barColors.get(rm_values[f'TorrentStatus{i}']['Text'],
+                                                                       _barColors['Unknown'])}
+        rm_values[f'TorrentUSpeed{i}'] = {'Text': "Up speed: " + humanize.naturalsize(torrent.upspeed) + "/s"}
     logging.debug(f"First torrent: {rm_values['TorrentName0']}")
     return rm_values
 
 
-def no_torrent_template():
+def _live_values(rm_values, i, torrent):
+    """The meters of a row that change between polls, torrent may be a torrent_estimate.Estimate"""
+    rm_values[f'TorrentETA{i}'] = {'Text': "ETA: " + _display_time(torrent.eta)}
+    rm_values[f'TorrentPercentage{i}'] = {'Text': f"{torrent.progress * 100:.1f}%"}
+    rm_values[f'TorrentProgress{i}'] = {'Text': \
+          humanize.naturalsize(torrent.downloaded) + "/" +\
+          humanize.naturalsize(torrent.downloaded + torrent.amount_left)}
+    rm_values[f'TorrentAddedOn{i}'] = {'Text': humanize.naturaltime(
+        datetime.fromtimestamp(torrent.added_on, tz=timezone("US/Eastern")).replace(tzinfo=None)
+    )}
+    rm_values[f'TorrentRatio{i}'] = {'Text': f"Ratio: {torrent.ratio:.2f}"}
+
+
+def live_format(estimates, rows=4):
+    """Only the meters _live_values sets, for the rows of a page moved on between polls"""
+    rm_values = {}
+    for i in range(min(rows, len(estimates))):
+        _live_values(rm_values, i, estimates[i])
+    return rm_values
+
+
+def no_torrent_template(rows=4, start=0):
     rm_values = {}
-    for i in range(4):
+    for i in range(start, rows):
         rm_values[f'TorrentName{i}'] = {'Text': "No Info", 'ToolTipText': "No Info", 'LeftMouseDoubleClickAction': ""}
         rm_values[f'TorrentStatus{i}'] = {'Text': "Unknown"}
         rm_values[f'TorrentDSpeed{i}'] = {'Text': "Down speed: 0B/s"}
@@ -0,0 +1,174 @@
+import bisect
+import heapq
+import itertools
+import operator
+
+# Columns that change on nearly every tick, keeping these in order costs more than picking the top of the page
+speed_columns = ('dlspeed', 'upspeed')
+
+
+def sort_key(sort_by: str):
+    """Key function matching the order qBittorrent itself sorts a column in"""
+    if sort_by == 'name':
+        return lambda torrent: torrent.name.lower()
+    return operator.attrgetter(sort_by)
+
+
+class SortedTorrents:
+    """Torrent hashes kept in the order of one column, a torrent is only moved when its sort key changes
+
+    Entries are (sort value, hash) tuples held in a list of sorted buckets, so inserting or removing one
+    only shifts a bucket of at most `load` entries and reading a page at any position is a bisect over the
+    bucket offsets followed by a slice.
+    """
+
+    load = 512
+
+    def __init__(self, sort_by: str):
+        self.sort_by = sort_by
+        self.key = sort_key(sort_by)
+        self._buckets = []
+        self._maxes = []  # Last entry of each bucket
+        self._entries = {}  # hash -> the entry currently stored for it
+        self._offsets = None  # Position of the first entry of each bucket, rebuilt lazily
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, torrent_hash):
+        return torrent_hash in self._entries
+
+    def build(self, torrents: dict):
+        """Replace the contents with every torrent in a hash -> torrent dict"""
+        entries = sorted((self.key(torrent), torrent_hash) for torrent_hash, torrent in torrents.items())
+        self._entries = {entry[1]: entry for entry in entries}
+        self._buckets = [entries[i:i + self.load] for i in range(0, len(entries), self.load)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._offsets = None
+
+    def _insert(self, entry):
+        self._offsets = None
+        if not self._buckets:
+            self._buckets.append([entry])
+            self._maxes.append(entry)
+            return
+        pos = bisect.bisect_left(self._maxes, entry)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._buckets[pos].append(entry)
+            self._maxes[pos] = entry
+        else:
+            bisect.insort(self._buckets[pos], entry)
+        bucket = self._buckets[pos]
+        if len(bucket) > 2 * self.load:
+            half = len(bucket) // 2
+            self._buckets[pos:pos + 1] = [bucket[:half], bucket[half:]]
+            self._maxes[pos:pos + 1] = [bucket[half - 1], bucket[-1]]
+
+    def _delete(self, entry):
+        self._offsets = None
+        pos = bisect.bisect_left(self._maxes, entry)
+        bucket = self._buckets[pos]
+        del bucket[bisect.bisect_left(bucket, entry)]
+        if not bucket:
+            del self._buckets[pos]
+            del self._maxes[pos]
+        else:
+            self._maxes[pos] = bucket[-1]
+
+    def upsert(self, torrent_hash, torrent: dict):
+        """Add a torrent or reposition it, does nothing when its sort key has not changed"""
+        entry = (self.key(torrent), torrent_hash)
+        old = self._entries.get(torrent_hash)
+        if old == entry:
+            return
+        if old is not None:
+            self._delete(old)
+        self._entries[torrent_hash] = entry
+        self._insert(entry)
+
+    def remove(self, torrent_hash):
+        old = self._entries.pop(torrent_hash, None)
+        if old is not None:
+            self._delete(old)
+
+    def _bucket_offsets(self) -> list:
+        if self._offsets is None:
+            self._offsets = [0] + list(itertools.accumulate(len(b) for b in self._buckets))
+        return self._offsets
+
+    def iter_hashes(self, start: int = 0, reverse: bool = False):
+        """Hashes in sort order beginning at position start, finding the start is O(log n)"""
+        if start >= len(self._entries):
+            return
+        if reverse:
+            # Position p from the end is position len - 1 - p from the front
+            start = len(self._entries) - 1 - start
+        offsets = self._bucket_offsets()
+        pos = bisect.bisect_right(offsets, start) - 1
+        index = start - offsets[pos]
+        if reverse:
+            for bucket in itertools.chain((self._buckets[pos][index::-1],),
+                                          (b[::-1] for b in reversed(self._buckets[:pos]))):
+                for entry in bucket:
+                    yield entry[1]
+        else:
+            for bucket in itertools.chain((self._buckets[pos][index:],), self._buckets[pos + 1:]):
+                for entry in bucket:
+                    yield entry[1]
+
+
+class TopTorrents:
+    """A small pool that always holds the fastest torrents of a column whose values change every tick
+
+    Every torrent outside the pool sorts below `threshold`, so only torrents from a sync delta that rise
+    above it have to be looked at, and the first page is a bounded heap over the pool instead of over the
+    library. Torrents in the pool that slow down are pruned once it grows, and the pool is rebuilt from
+    the whole library only when too few of its members are still above the threshold to fill a page.
+    """
+
+    size = 64
+
+    def __init__(self, sort_by: str):
+        self.sort_by = sort_by
+        self.pool = set()
+        self.threshold = None  # None while the pool holds the whole library
+
+    def build(self, torrents: dict):
+        key = operator.attrgetter(self.sort_by)
+        entries = heapq.nlargest(self.size, ((key(torrent), h) for h, torrent in torrents.items()))
+        self.pool = {h for _, h in entries}
+        self.threshold = entries[-1] if len(entries) == self.size else None
+
+    def update(self, torrent_hash, torrent: dict):
+        if self.threshold is None or (getattr(torrent, self.sort_by), torrent_hash) > self.threshold:
+            self.pool.add(torrent_hash)
+
+    def remove(self, torrent_hash):
+        self.pool.discard(torrent_hash)
+
+    def select(self, torrents: dict, keys, limit: int):
+        """The fastest `limit` torrents among keys, None when the pool can't tell"""
+        if limit > self.size:
+            return None
+        key = operator.attrgetter(self.sort_by)
+        if self.threshold is None and len(self.pool) > self.size:
+            # Built while the library was smaller than the pool, now it has grown past it and can get a threshold
+            self.build(torrents)
+        elif len(self.pool) > 4 * self.size:
+            self.pool = {h for h in self.pool if (key(torrents[h]), h) >= self.threshold}
+        page = top_k((torrents[h] for h in self.pool if h in keys), limit, self.sort_by, True)
+        if self.threshold is None:
+            return page
+        if len(page) < limit or (key(page[-1]), page[-1].hash) < self.threshold:
+            return None
+        return page
+
+
+def top_k(torrents, count: int, sort_by: str, reverse: bool) -> list:
+    """The first `count` torrents in sort order using a bounded heap, O(n log count)"""
+    key = sort_key(sort_by)
+    # The hash breaks ties so the order is the same one SortedTorrents would give
+    tie_break_key = lambda torrent: (key(torrent), torrent.hash)
+    pick = heapq.nlargest if reverse else heapq.nsmallest
+    return pick(count, torrents, key=tie_break_key)
@@ -0,0 +1,73 @@
+# Every field the formatter, sorting, filters and RSS icon read, the rest of the 50+ keys the API sends is dropped
+fields = ('hash', 'server', 'name', 'content_path', 'state', 'category', 'tags', 'tracker', 'added_on',
+          'progress', 'downloaded', 'amount_left', 'ratio', 'eta', 'dlspeed', 'upspeed',
+          'num_complete', 'num_incomplete', 'num_seeds', 'num_leechs')
+_field_set = frozenset(fields)
+_string_fields = frozenset(('hash', 'server', 'name', 'content_path', 'state', 'category', 'tags', 'tracker'))
+# Strings that repeat across the library, each distinct value is stored once
+interned_fields = frozenset(('server', 'state', 'category', 'tags', 'tracker'))
+_plain_defaults = tuple((field, "" if field in _string_fields else 0) for field in fields
+                        if field not in interned_fields)
+
+_strings = {}
+
+
+def intern_string(value: str) -> str:
+    """The shared copy of a repeated string"""
+    return _strings.setdefault(value, value)
+
+
+def interned_count() -> int:
+    return len(_strings)
+
+
+class TorrentRecord:
+    """A torrent as the skin keeps it, only the fields in `fields` and with repeated strings shared
+
+    Fields are attributes, and the record can also be read like the API dict (record['name'], record.get('tags'))
+    so code written against the raw dicts keeps working.
+    """
+
+    __slots__ = fields
+
+    def __init__(self, values: dict):
+        for field in fields:
+            setattr(self, field, "" if field in _string_fields else 0)
+        self.update(values)
+
+    @classmethod
+    def from_api(cls, values: dict) -> 'TorrentRecord':
+        """A record from a whole torrent dict, several times quicker than applying it to the defaults as a delta"""
+        record = cls.__new__(cls)
+        get = values.get
+        for field, default in _plain_defaults:
+            setattr(record, field, get(field, default))
+        for field in interned_fields:
+            value = get(field, "")
+            setattr(record, field, intern_string(value) if isinstance(value, str) else value)
+        return record
+
+    def update(self, changes: dict):
+        """Apply a sync/maindata delta, fields the record doesn't keep are ignored"""
+        for field, value in changes.items():
+            if field in _field_set:
+                if field in interned_fields and isinstance(value, str):
+                    value = intern_string(value)
+                setattr(self, field, value)
+
+    def __getitem__(self, field: str):
+        if field not in _field_set:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field: str, default=None):
+        return getattr(self, field) if field in _field_set else default
+
+    def __contains__(self, field: str) -> bool:
+        return field in _field_set
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in fields}
+
+    def __repr__(self):
+        return f"TorrentRecord({self.hash!r}, {self.name!r})"
@@ -0,0 +1,194 @@
+import functools
+
+import humanize
+
+from torrent_filter import tracker_host
+
+kinds = ('category', 'tag', 'tracker')
+_kind_titles = {'category': "Categories", 'tag': "Tags", 'tracker': "Trackers"}
+_unnamed = {'category': "Uncategorized", 'tag': "Untagged", 'tracker': "No tracker"}
+
+# Every meter of the panel, shown and hidden together
+panel_meters = ('SummaryBackground', 'SummaryTitle', 'SummaryClose', 'SummaryText')
+
+# The fields a torrent's contribution is made from, a delta touching none of them leaves the totals alone
+watched = frozenset(('category', 'tags', 'tracker', 'dlspeed', 'upspeed', 'amount_left', 'downloaded', 'ratio'))
+# Totals of a group: torrents, DL speed, UP speed, bytes left, bytes downloaded, bytes uploaded (ratio x downloaded)
+_count, _dlspeed, _upspeed, _left, _downloaded, _uploaded = range(6)
+_unseen = ()  # The contribution of a torrent that wasn't there before the delta
+
+
+@functools.lru_cache(maxsize=4096)
+def group_keys(category: str, tags: str, tracker: str) -> tuple:
+    """The (kind, name) groups a torrent counts towards, a torrent without tags counts as untagged"""
+    tag_names = tuple(tag.strip() for tag in tags.split(",") if tag.strip()) if tags else ()
+    return (('category', category),) + tuple(('tag', tag) for tag in tag_names or ("",)) + \
+        (('tracker', tracker_host(tracker)),)
+
+
+def contribution(torrent) -> tuple:
+    """What a torrent adds to the totals of each of its groups"""
+    return (group_keys(torrent.category, torrent.tags, torrent.tracker), torrent.dlspeed, torrent.upspeed,
+            torrent.amount_left, torrent.downloaded, torrent.ratio * torrent.downloaded)
+
+
+def _apply(groups: dict, values: tuple, sign: int):
+    keys, dlspeed, upspeed, left, downloaded, uploaded = values
+    for key in keys:
+        totals = groups.get(key)
+        if totals is None:
+            totals = groups[key] = [0, 0, 0, 0, 0, 0.0]
+        totals[_count] += sign
+        if not totals[_count]:
+            # Dropped rather than left at zero, which also clears whatever rounding the float sums picked up
+            del groups[key]
+            continue
+        totals[_dlspeed] += sign * dlspeed
+        totals[_upspeed] += sign * upspeed
+        totals[_left] += sign * left
+        totals[_downloaded] += sign * downloaded
+        totals[_uploaded] += sign * uploaded
+
+
+def _shift(groups: dict, old: tuple, new: tuple):
+    """Move the totals of groups a torrent stays in from its old contribution to its new one"""
+    dlspeed = new[1] - old[1]
+    upspeed = new[2] - old[2]
+    left = new[3] - old[3]
+    downloaded = new[4] - old[4]
+    uploaded = new[5] - old[5]
+    for key in new[0]:
+        totals = groups[key]
+        totals[_dlspeed] += dlspeed
+        totals[_upspeed] += upspeed
+        totals[_left] += left
+        totals[_downloaded] += downloaded
+        totals[_uploaded] += uploaded
+
+
+def recompute(torrents) -> dict:
+    """The totals of every group summed from scratch"""
+    groups = {}
+    for torrent in torrents:
+        _apply(groups, contribution(torrent), 1)
+    return groups
+
+
+class TorrentSummary:
+    """Torrent count, DL/UP speed, bytes left and seeding ratio per category, tag and tracker
+
+    Kept per server from the torrents each sync delta changes: a changed torrent's old contribution is taken off
+    its groups and the new one added, so the totals cost nothing like a pass over the library. A full update
+    starts the server's totals over. The seeding ratio of a group is its uploaded bytes over its downloaded bytes,
+    with a torrent's uploaded bytes taken as its ratio times what it downloaded.
+    """
+
+    def __init__(self, lines: int = 20):
+        self.lines = lines  # Text lines the panel has room for
+        self.groups = {}  # server name -> (kind, name) -> totals
+        self.current = None  # The totals of the server whose delta is being applied
+        self.kind = None  # The kind of group the panel shows, None while it is closed
+
+    def begin(self, server, full_update: bool):
+        if full_update:
+            self.groups[server.name] = {}
+        self.current = self.groups.setdefault(server.name, {})
+
+    def before(self, torrent, changes):
+        """A torrent's contribution before changes are applied to it, None when changes don't touch it"""
+        if torrent is None:
+            return _unseen
+        if watched.isdisjoint(changes):
+            return None
+        return contribution(torrent)
+
+    def changed(self, server, torrent, before: tuple):
+        after = contribution(torrent)
+        if before is _unseen:
+            _apply(self.current, after, 1)
+        elif before[0] == after[0]:
+            # Most deltas are speeds and progress, the torrent stays in the same groups
+            _shift(self.current, before, after)
+        else:
+            _apply(self.current, before, -1)
+            _apply(self.current, after, 1)
+
+    def removed(self, server, torrent):
+        _apply(self.current, contribution(torrent), -1)
+
+    def end(self):
+        self.current = None
+
+    def totals(self, kind: str) -> dict:
+        """name -> totals of one kind of group, summed over the servers"""
+        merged = {}
+        for groups in self.groups.values():
+            for (group_kind, name), totals in groups.items():
+                if group_kind != kind:
+                    continue
+                entry = merged.get(name)
+                if entry is None:
+                    merged[name] = list(totals)
+                else:
+                    for i, value in enumerate(totals):
+                        entry[i] += value
+        return merged
+
+    def verify(self, servers) -> list:
+        """The groups whose kept totals differ from a recompute over the servers' torrents, empty when all agree"""
+        mismatches = []
+        for server in servers:
+            kept = self.groups.get(server.name, {})
+            expected = recompute(server.index.torrents.values())
+            for key in kept.keys() | expected.keys():
+                have, want = kept.get(key), expected.get(key)
+                if have is None or want is None or have[:_uploaded] != want[:_uploaded] or \
+                        abs(have[_uploaded] - want[_uploaded]) > 1e-6 * max(1.0, abs(want[_uploaded])):
+                    mismatches.append((server.name, key, have, want))
+        return mismatches
+
+    def next_kind(self):
+        """Open the panel on categories, or move it on to the next kind of group, closing it after the last"""
+        if self.kind is None:
+            self.kind = kinds[0]
+        else:
+            position = kinds.index(self.kind) + 1
+            self.kind = kinds[position] if position < len(kinds) else None
+
+    def close(self):
+        self.kind = None
+
+    @property
+    def open(self) -> bool:
+        return self.kind is not None
+
+    def rendered(self) -> dict:
+        """The panel's meter values, hidden while it is closed"""
+        if self.kind is None:
+            return {meter: {'Hidden': 1} for meter in panel_meters}
+        return summary_format(self.totals(self.kind), self.kind, self.lines)
+
+
+def summary_format(totals: dict, kind: str, lines: int = 20) -> dict:
+    """The summary panel showing totals of one kind of group, the busiest groups first"""
+    lines = max(1, lines)  # The line saying how many more there are needs one at least
+    rm_values = {meter: {'Hidden': 0} for meter in panel_meters}
+    others = ", ".join(_kind_titles[other].lower() for other in kinds if other != kind)
+    title = f"{_kind_titles[kind]}: {len(totals)}"
+    if kind == 'category':
+        # Every torrent has exactly one category, tags and trackers can't be added up the same way
+        title += f", {sum(entry[_count] for entry in totals.values())} torrents"
+    rm_values['SummaryTitle'].update(Text=title, ToolTipText=f"Click for {others}")
+    busiest = sorted(totals.items(), key=lambda item: (-(item[1][_dlspeed] + item[1][_upspeed]), -item[1][_count],
+                                                        item[0]))
+    text = []
+    for name, entry in busiest[:lines]:
+        ratio = entry[_uploaded] / entry[_downloaded] if entry[_downloaded] else 0.0
+        name = (name or _unnamed[kind]).replace('"', "'")
+        text.append(f"{name:<22.22} {entry[_count]:>6}  D {humanize.naturalsize(entry[_dlspeed])}/s  "
+                    f"U {humanize.naturalsize(entry[_upspeed])}/s  Left {humanize.naturalsize(entry[_left])}  "
+                    f"Ratio {ratio:.2f}")
+    if len(busiest) > lines:
+        text[-1] = f"... and {len(busiest) - lines + 1} more"
+    rm_values['SummaryText']['Text'] = "#CRLF#".join(text) if text else "No torrents"
+    return rm_values
@@ -0,0 +1,101 @@
+"""Captures WebUI responses, inhibitor frames and skin bangs with their timing for benchmarks/replay.py to play back
+
+Enable it with "capture_traffic" in settings.json, true for Logs/traffic.jsonl.gz or a path relative to the
+config folder. Every record is one JSON line:
+    {"t": 0.0, "src": "session", "started": <unix time>, "version": 1}           once per capture
+    {"t": 1.25, "src": "webui", "server": ..., "endpoint": ..., "query": ..., "data": ..., "status": 200, "body": ...}
+    {"t": 1.31, "src": "inhibitor", "frame": ...}                                  frames received from the inhibitor
+    {"t": 4.02, "src": "bang", "args": ...}                                        bangs executed by the skin
+t counts seconds since the capture started. The file is gzip and only ever appended to, every capture adds its
+own gzip member, so a crash costs at most the last flush_every seconds.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+
+import combined_log
+
+default_path = "Logs/traffic.jsonl.gz"
+version = 1
+
+
+class TrafficRecorder:
+
+    def __init__(self, path: str, logging: combined_log.CombinedLogger = None, flush_every: float = 1.0,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.logging = logging
+        self.flush_every = flush_every
+        self.max_bytes = max_bytes  # Uncompressed, recording stops once a capture has written this much
+        self.lock = threading.Lock()  # WebUI responses are recorded from the worker threads
+        if os.path.exists(path) and not _complete(path):
+            # A capture that never closed has no gzip trailer, anything appended after it couldn't be read back
+            os.replace(path, path + ".partial")
+            if logging is not None:
+                logging.warning(f"Moved the unfinished capture {path} to {path}.partial")
+        self.file = gzip.open(path, "ab")
+        self.start = time.monotonic()
+        self.last_flush = self.start
+        self.written = 0
+        self.records = 0
+        self.full = False
+        self.record("session", started=time.time(), version=version)
+
+    def record(self, src: str, **fields):
+        """Append one record, safe to call from any thread"""
+        line = json.dumps(dict(t=round(time.monotonic() - self.start, 6), src=src, **fields)).encode('utf-8') + b"\n"
+        with self.lock:
+            if self.file is None or self.full:
+                return
+            if self.written + len(line) > self.max_bytes:
+                self.full = True
+                if self.logging is not None:
+                    self.logging.warning(f"Traffic capture reached {self.max_bytes} bytes, no longer recording")
+                return
+            self.file.write(line)
+            self.written += len(line)
+            self.records += 1
+            now = time.monotonic()
+            if now - self.last_flush >= self.flush_every:
+                self.last_flush = now
+                self.file.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def _complete(path: str) -> bool:
+    try:
+        with gzip.open(path, "rb") as file:
+            while file.read(1024 * 1024):
+                pass
+        return True
+    except (EOFError, OSError, zlib.error):
+        return False
+
+
+def read_records(path: str):
+    """Every record in a capture file in order, a tail cut short by a crash is skipped"""
+    with gzip.open(path, "rb") as file:
+        try:
+            for line in file:
+                if line.endswith(b"\n"):
+                    yield json.loads(line)
+        except (EOFError, OSError, zlib.error):
+            pass
+
+
+def sessions(path: str) -> list:
+    """The records of a capture file split into one list per capture"""
+    result = []
+    for record in read_records(path):
+        if record["src"] == "session" or not result:
+            result.append([])
+        result[-1].append(record)
+    return result
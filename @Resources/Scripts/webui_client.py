@@ -0,0 +1,195 @@
+import json
+import re
+import time
+from urllib.parse import urlsplit
+
+import requests
+from qbittorrent import Client
+from qbittorrent.client import LoginRequired
+
+from metrics import Histogram
+from torrent_record import TorrentRecord
+
+try:
+    import orjson  # Optional, several times faster than the json module
+except ImportError:
+    orjson = None
+
+# sync/maindata bodies at least this big are parsed a torrent at a time, smaller ones in one call
+stream_threshold = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def loads(body: bytes):
+    """Parse a JSON body with the fastest backend installed"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def _skip(text: str, index: int) -> int:
+    return _whitespace.match(text, index).end()
+
+
+def _expect(text: str, index: int, char: str) -> int:
+    if text[index:index + 1] != char:
+        raise ValueError(f"Expected {char!r} at {index} of the sync/maindata body")
+    return _skip(text, index + 1)
+
+
+def _parse_torrents(text: str, index: int, records: bool, server: str) -> tuple:
+    """The torrents map starting at index, each torrent becomes a TorrentRecord when records is set"""
+    torrents = {}
+    index = _expect(text, index, '{')
+    if text[index:index + 1] == '}':
+        return torrents, index + 1
+    while True:
+        torrent_hash, index = _decoder.raw_decode(text, index)
+        index = _expect(text, _skip(text, index), ':')
+        values, index = _decoder.raw_decode(text, index)
+        if records:
+            values['hash'] = torrent_hash
+            values['server'] = server
+            values = TorrentRecord.from_api(values)
+        torrents[torrent_hash] = values
+        index = _skip(text, index)
+        if text[index:index + 1] != ',':
+            _expect(text, index, '}')
+            return torrents, index + 1
+        index = _skip(text, index + 1)
+
+
+def decode_maindata(body: bytes, server: str = None) -> dict:
+    """Parse a sync/maindata body
+
+    A big body is parsed one torrent at a time instead of in one call, every call is short so the thread
+    parsing it keeps giving the GIL back and the event loop keeps running. The torrents of a full update come
+    back as TorrentRecords built right here on the worker thread rather than by apply_sync on the event loop.
+    qBittorrent writes its keys sorted, so full_update is known by the time the torrents map is reached.
+    """
+    if len(body) < stream_threshold:
+        return loads(body)
+    text = body.decode('utf-8')
+    result = {}
+    index = _expect(text, _skip(text, 0), '{')
+    if text[index:index + 1] == '}':
+        return result
+    while True:
+        key, index = _decoder.raw_decode(text, index)
+        index = _expect(text, _skip(text, index), ':')
+        if key == 'torrents':
+            value, index = _parse_torrents(text, index, bool(result.get('full_update')), server)
+        else:
+            value, index = _decoder.raw_decode(text, index)
+        result[key] = value
+        index = _skip(text, index)
+        if text[index:index + 1] != ',':
+            _expect(text, index, '}')
+            return result
+        index = _skip(text, index + 1)
+
+
+class EndpointStats:
+    """Requests made to one WebUI API endpoint"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.wire_bytes = 0  # What actually came over the network, gzipped when the server compressed it
+        self.latency = Histogram()
+
+
+class WebUIClient(Client):
+    """python-qbittorrent's Client counting the requests, response bytes and latency of every API endpoint
+
+    stats is kept by the caller so the counts survive the client being replaced. With a TrafficRecorder every
+    response is captured as well, under the server's name. Responses are asked for gzipped, and are parsed
+    by loads() or, for sync/maindata, decode_maindata() on whichever worker thread made the request.
+    """
+
+    def __init__(self, url, stats: dict, verify=True, timeout=None, recorder=None, name: str = None,
+                 sid: str = None):
+        self.stats = stats  # endpoint -> EndpointStats
+        self.recorder = recorder
+        self.name = name
+        # The library's constructor probes app/preferences before anything else, a round trip that tells
+        # nothing the first real request doesn't. With a saved SID the client starts out logged in with it.
+        if not url.endswith('/'):
+            url += '/'
+        self.url = url + 'api/v2/'
+        self.verify = verify
+        self.timeout = timeout
+        self.session = requests.Session()
+        # qBittorrent only compresses with gzip, there is no point offering anything else
+        self.session.headers['Accept-Encoding'] = "gzip"
+        self.sid = sid
+        if sid is not None:
+            self.session.cookies.set('SID', sid)
+        self._is_authenticated = sid is not None
+
+    def login(self, username='admin', password='admin'):
+        """Log in on a new session, sid holds its cookie afterwards or None when the login failed
+
+        The library's login posts auth/login without a timeout, a server that never answers would hold the
+        worker thread forever, so the post is made here with the client's timeout.
+        """
+        self._is_authenticated = False
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = "gzip"
+        response = self.session.post(self.url + 'auth/login', data={'username': username, 'password': password},
+                                     verify=self.verify, timeout=self.timeout)
+        self._is_authenticated = response.text == 'Ok.'
+        self.sid = self.session.cookies.get('SID') if self._is_authenticated else None
+        return None if self._is_authenticated else response.text
+
+    def toggle_alternative_speed(self):
+        # Newer qBittorrent only takes a POST for anything that changes a setting, the library sends a GET
+        return self._post('transfer/toggleSpeedLimitsMode')
+
+    def sync_main_data(self, rid=0):
+        return self._request('sync/maindata', 'get', params={'rid': rid},
+                             decode=lambda body: decode_maindata(body, self.name))
+
+    def _request(self, endpoint, method, data=None, decode=None, **kwargs):
+        """The library's _request, parsing the raw body instead of the text requests decodes first"""
+        # The library puts the hash of per torrent calls into the endpoint, torrents/files?hash=..., the stats
+        # are kept per path so opening torrents doesn't add a new endpoint each time
+        path = endpoint.split('?', 1)[0]
+        stats = self.stats.get(path)
+        if stats is None:
+            stats = self.stats[path] = EndpointStats()
+        start = time.perf_counter()
+        try:
+            if not self._is_authenticated:
+                raise LoginRequired
+            kwargs['verify'] = self.verify
+            kwargs['timeout'] = self.timeout
+            if method == 'get':
+                response = self.session.get(self.url + endpoint, **kwargs)
+            else:
+                response = self.session.post(self.url + endpoint, data, **kwargs)
+            body = response.content
+            stats.bytes += len(body)
+            stats.wire_bytes += response.raw.tell() if hasattr(response.raw, 'tell') else len(body)
+            if self.recorder is not None:
+                self.recorder.record("webui", server=self.name, endpoint=endpoint, method=method,
+                                     query=urlsplit(response.request.url).query, data=data,
+                                     status=response.status_code, body=body.decode('utf-8', 'replace'))
+            response.raise_for_status()
+            if decode is not None:
+                return decode(body)
+            if not body:
+                return {}
+            try:
+                return loads(body)
+            except ValueError:
+                return body.decode('utf-8', 'replace')
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.requests += 1
+            stats.latency.observe(time.perf_counter() - start)
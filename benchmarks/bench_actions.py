@@ -0,0 +1,96 @@
+"""Bursts of pause/resume/recheck clicks against the WebUI stand-in, requests sent and how the local states end up
+
+    python benchmarks/bench_actions.py --clicks 40 --click-interval 0.02
+
+Every scenario checks that each torrent on the page ends up in the state the server reports once a few syncs
+went by, including when the server fails the request or accepts it without changing anything.
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+from bench_refresh import write_config
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import rm_interface
+
+
+def mismatches(interface, server) -> int:
+    """Torrents on the page whose local state differs from the server's"""
+    local = interface.servers[0].index.torrents
+    return sum(1 for torrent in interface.torrents
+               if local[torrent.hash].state != server.state.torrents[torrent.hash]["state"])
+
+
+def run_scenario(event_loop, interface, server, name: str, bangs: list, interval: float, syncs: int,
+                 fail=False, ignore=False) -> list:
+    server.state.fail_actions = fail
+    server.state.ignore_actions = ignore
+    actions_before = len(server.state.actions)
+    before = {torrent.hash: torrent.state for torrent in interface.torrents}
+    latencies = []
+    for bang in bangs:
+        start = time.perf_counter()
+        event_loop.run_until_complete(interface.execute_bang(bang))
+        latencies.append(time.perf_counter() - start)
+        event_loop.run_until_complete(asyncio.sleep(interval))
+    optimistic = sum(1 for torrent in interface.torrents if torrent.state != before.get(torrent.hash))
+    # Let the batcher send what is left, then poll like the refresh loop would
+    event_loop.run_until_complete(asyncio.sleep(interface.actions.max_wait + 0.2))
+    for _ in range(syncs):
+        event_loop.run_until_complete(interface.refresh_once())
+    sent = server.state.actions[actions_before:]  # Only the requests the server accepted
+    server.state.fail_actions = server.state.ignore_actions = False
+    return [name, len(bangs), len(sent),
+            sum(count for _, count in sent), optimistic, f"{summarize(latencies)['p50'] * 1000:.1f}",
+            len(interface.servers[0].optimistic), mismatches(interface, server)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--torrents", type=int, default=1000)
+    parser.add_argument("--clicks", type=int, default=40)
+    parser.add_argument("--click-interval", type=float, default=0.02, help="Seconds between clicks in a burst")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    server = FakeQBittorrentServer(args.torrents, churn=0.0).start()
+    rows = []
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_config(config_dir, [server])
+        event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(event_loop)
+        interface = rm_interface.RainMeterInterface(FakeRainmeter(), event_loop, bench_common.make_logger(),
+                                                    debug=True, config_dir=config_dir, autostart=False)
+        syncs = interface.servers[0].confirm_syncs + 1
+        try:
+            event_loop.run_until_complete(interface.refresh_once())
+            burst = [f"action_{rng.choice(['toggle', 'pause', 'resume', 'recheck'])}_{rng.randrange(4)}"
+                     for _ in range(args.clicks)]
+            rows.append(run_scenario(event_loop, interface, server, "row click burst", burst,
+                                     args.click_interval, syncs))
+            rows.append(run_scenario(event_loop, interface, server, "page pause x5", ["action_pause_page"] * 5,
+                                     args.click_interval, syncs))
+            rows.append(run_scenario(event_loop, interface, server, "pause then resume",
+                                     ["action_pause_page", "action_resume_page"], args.click_interval, syncs))
+            rows.append(run_scenario(event_loop, interface, server, "page resume, server fails",
+                                     ["action_resume_page"], args.click_interval, syncs, fail=True))
+            rows.append(run_scenario(event_loop, interface, server, "page recheck, server ignores",
+                                     ["action_recheck_page"], args.click_interval, syncs, ignore=True))
+        finally:
+            event_loop.run_until_complete(interface.tear_down())
+            event_loop.close()
+            server.stop()
+    print_table(f"Torrent actions against {args.torrents} torrents",
+                ["scenario", "clicks", "requests", "hashes sent", "shown at once", "click p50 ms",
+                 "unconfirmed", "wrong after sync"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Encode and decode cost and bytes on the wire of the inhibitor messages, JSON text against the compact encoding
+
+    python benchmarks/bench_codec.py --count 200000
+
+"APIMessageRX" is how every frame was read before: JSON loaded into the object's __dict__. "JSON" reads the same
+frame into the message's fixed __slots__ class, which is what the plugin does with an inhibitor server that
+doesn't offer the compact encoding. "object bytes" is what one decoded message keeps alive, its attribute values
+aside. Every decoded message is checked against the one that was encoded.
+"""
+import argparse
+import sys
+import time
+
+import bench_common
+from bench_common import print_table
+
+import helpers
+from helpers import APIMessageTX, APIMessageRX
+
+
+def messages() -> dict:
+    return {
+        "state_update": {"msg_type": "state_update", "inhibiting": True, "inhibited_by": ["Plex", "User"],
+                         "qbt_connection": True, "plex_connection": True, "net_connection": False,
+                         "message": None, "version": "V:1.4.2"},
+        "refresh": {"msg_type": "refresh", "token": "5f0c4b1e9a7d4c2e8b3a6f1d0e9c8b7a"},
+    }
+
+
+def timed(function, argument, count: int) -> tuple:
+    start = time.perf_counter()
+    for _ in range(count):
+        result = function(argument)
+    return (time.perf_counter() - start) / count, result
+
+
+def object_bytes(message) -> int:
+    size = sys.getsizeof(message)
+    if hasattr(message, "__dict__"):
+        size += sys.getsizeof(message.__dict__)
+    return size
+
+
+def run(name: str, values: dict, count: int) -> list:
+    rows = []
+    encoders = {"APIMessageRX": lambda fields: APIMessageTX(**fields).encode('utf-8'),
+                "JSON": lambda fields: APIMessageTX(**fields).encode('utf-8'),
+                "compact": lambda fields: APIMessageTX(**fields).encode('utf-8', helpers.compact)}
+    decoders = {"APIMessageRX": APIMessageRX, "JSON": helpers.decode, "compact": helpers.decode}
+    for codec, encoder in encoders.items():
+        encode_time, frame = timed(encoder, values, count)
+        decode_time, message = timed(decoders[codec], frame, count)
+        decoded = vars(message) if isinstance(message, APIMessageRX) else message.to_dict()
+        assert {key: value for key, value in decoded.items() if value is not None} == \
+               {key: value for key, value in values.items() if value is not None}, (codec, decoded)
+        rows.append([name, codec, len(frame), f"{encode_time * 1e6:.2f}", f"{decode_time * 1e6:.2f}",
+                     object_bytes(message)])
+    return rows
+
+
+def main(args):
+    rows = []
+    for name, values in messages().items():
+        rows.extend(run(name, values, args.count))
+    print_table(f"{args.count} encodes and decodes per message",
+                ["message", "codec", "bytes", "encode us", "decode us", "object bytes"], rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=200000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,131 @@
+"""Several skin instances each polling on their own vs thin clients of one collector process
+
+    python benchmarks/bench_collector.py --skins 3 --duration 20
+
+Both runs load the plugin in this process like Rainmeter would, with a local qBittorrent WebUI stand-in and the
+fake inhibitor server. In the collector run collector.py is started as a separate process. The table shows the
+WebUI requests and inhibitor handshakes, the threads and the CPU time the skins cost this process, and whether
+a page_right sent from the first skin showed up on all of them.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import bench_common
+from bench_common import print_table
+from fake_inhibitor import FakeInhibitorServer
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import main
+
+
+def write_config(config_dir: str, qbt: FakeQBittorrentServer, args):
+    with open(os.path.join(config_dir, "secrets.json"), "w") as f:
+        json.dump({"Servers": [{"Host": qbt.url, "Username": qbt.state.username,
+                                "Password": qbt.state.password, "Name": "fake"}]}, f)
+    with open(os.path.join(config_dir, "settings.json"), "w") as f:
+        json.dump({"filter": "filter_all", "sort_by": "added_on", "reverse": True, "check_updates": False,
+                   "inhibitor_host": "127.0.0.1", "inhibitor_ports": [args.main_port, args.alt_port]}, f)
+
+
+def page_text(rain: main.Rain) -> str:
+    bang = rain.rainmeter_interface.get_bang() if rain.rainmeter_interface is not None else ""
+    marker = "[!SetOption PageNumber Text \""
+    start = bang.find(marker)
+    return bang[start + len(marker):bang.find("\"", start + len(marker))] if start >= 0 else ""
+
+
+def wait_for(condition, timeout: float) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def run(mode: str, args, qbt: FakeQBittorrentServer, inhibitor: FakeInhibitorServer) -> list:
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_config(config_dir, qbt, args)
+        collector = None
+        options = {"ConfigDir": config_dir, "Rows": 4}
+        if mode == "collector":
+            collector = subprocess.Popen([sys.executable, os.path.join(bench_common.SCRIPTS_DIR, "collector.py"),
+                                          "--port", str(args.port), "--config-dir", config_dir])
+            options["Collector"] = f"127.0.0.1:{args.port}"
+
+        requests_before = sum(qbt.state.request_counts.values())
+        handshakes_before = inhibitor.handshakes
+        threads_before = threading.active_count()
+        cpu_start = time.process_time()
+        skins = []
+        for _ in range(args.skins):
+            rain = main.Rain()
+            rain.Reload(FakeRainmeter(options=options), 0)
+            skins.append(rain)
+        rendered = wait_for(lambda: all("TorrentName0" in (rain.rainmeter_interface.get_bang()
+                                                           if rain.rainmeter_interface is not None else "")
+                                        for rain in skins), 15.0)
+        end = time.monotonic() + args.duration
+        while time.monotonic() < end:
+            for rain in skins:
+                rain.Update()
+            time.sleep(args.update_interval)
+        threads = threading.active_count() - threads_before
+
+        # A page turn from the first skin, every skin sharing the data side should follow it
+        before = [page_text(rain) for rain in skins]
+        skins[0].ExecuteBang("page_right")
+        followed = wait_for(lambda: all(page_text(rain) != old for rain, old in zip(skins, before)), 5.0)
+
+        for rain in skins:
+            rain.Finalize()
+        cpu = time.process_time() - cpu_start
+        if collector is not None:
+            collector.terminate()
+            collector.wait(10)
+        return [mode, args.skins, "yes" if rendered else "NO", sum(qbt.state.request_counts.values()) - requests_before,
+                inhibitor.handshakes - handshakes_before, threads, f"{cpu:.2f}",
+                "all" if followed else "first only" if mode != "collector" else "NO"]
+
+
+def main_loop(args):
+    qbt = FakeQBittorrentServer(args.torrents).start()
+    inhibitor_loop = asyncio.new_event_loop()
+    inhibitor_thread = threading.Thread(target=inhibitor_loop.run_forever, name="Fake inhibitor", daemon=True)
+    inhibitor_thread.start()
+    inhibitor = FakeInhibitorServer(main_port=args.main_port, alt_port=args.alt_port)
+    asyncio.run_coroutine_threadsafe(inhibitor.start(), inhibitor_loop).result()
+
+    rows = [run(mode, args, qbt, inhibitor) for mode in ("in-process", "collector")]
+
+    asyncio.run_coroutine_threadsafe(inhibitor.stop(), inhibitor_loop).result()
+    inhibitor_loop.call_soon_threadsafe(inhibitor_loop.stop)
+    inhibitor_thread.join()
+    qbt.stop()
+    print_table(f"{args.skins} skins for {args.duration}s, {args.torrents} torrents",
+                ["mode", "skins", "rendered", "WebUI requests", "inhibitor handshakes", "skin threads",
+                 "skin CPU s", "page turn seen by"], rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--skins", type=int, default=3)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--torrents", type=int, default=2000)
+    parser.add_argument("--update-interval", type=float, default=0.1, help="Seconds between Update calls")
+    parser.add_argument("--port", type=int, default=47780, help="Port the collector listens on")
+    parser.add_argument("--main-port", type=int, default=47785)
+    parser.add_argument("--alt-port", type=int, default=47786)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main_loop(parse_args())
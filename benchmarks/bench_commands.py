@@ -0,0 +1,102 @@
+"""RmExecute calls and bytes the plugin sends to Rainmeter while a skin is being used
+
+    python benchmarks/bench_commands.py --duration 20 --torrents 2000 --burst 6
+
+The plugin is loaded through main.Rain like Rainmeter would, against the qBittorrent WebUI stand-in and the fake
+inhibitor. Update is called once a second (Update=100 with UpdateDivider=10), and every few seconds a burst of
+page bangs and an inhibit toggle come in. Everything Rainmeter would be sent is counted, so the same run works
+against any version of the scripts.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+import bench_common
+from bench_common import print_table
+from fake_inhibitor import FakeInhibitorServer
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import main
+
+
+def write_config(config_dir: str, qbt: FakeQBittorrentServer, args):
+    with open(os.path.join(config_dir, "secrets.json"), "w") as f:
+        json.dump({"Servers": [{"Host": qbt.url, "Username": qbt.state.username,
+                                "Password": qbt.state.password, "Name": "fake"}]}, f)
+    with open(os.path.join(config_dir, "settings.json"), "w") as f:
+        json.dump({"filter": "filter_all", "sort_by": "added_on", "reverse": True, "check_updates": False,
+                   "inhibitor_host": "127.0.0.1", "inhibitor_ports": [args.main_port, args.alt_port]}, f)
+
+
+def run(args, qbt: FakeQBittorrentServer) -> list:
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_config(config_dir, qbt, args)
+        rm = FakeRainmeter(options={"ConfigDir": config_dir, "Rows": 4})
+        rain = main.Rain()
+        rain.Reload(rm, 0)
+        time.sleep(args.warmup)
+        rm.reset()
+        start = time.monotonic()
+        next_update = next_burst = start
+        inhibit = False
+        while time.monotonic() - start < args.duration:
+            now = time.monotonic()
+            if now >= next_burst:
+                for i in range(args.burst):
+                    rain.ExecuteBang("page_right" if i % 2 == 0 else "page_left")
+                    time.sleep(0.01)
+                inhibit = not inhibit
+                rain.ExecuteBang("inhibit_true" if inhibit else "inhibit_false")
+                next_burst += args.burst_every
+            if now >= next_update:
+                rain.Update()
+                next_update += 1.0
+            time.sleep(0.01)
+        elapsed = time.monotonic() - start
+        with rm.lock:
+            executed = list(rm.executed)
+        rain.Finalize()
+    commands = sum(bang.count("[!") for bang in executed)
+    return [len(executed), f"{len(executed) / elapsed:.1f}", commands, f"{rm.execute_bytes / elapsed / 1024:.1f}",
+            sum(bang.count("[!Redraw]") for bang in executed), max((bang.count("[!Redraw]") for bang in executed),
+                                                                   default=0)]
+
+
+def main_loop(args):
+    qbt = FakeQBittorrentServer(args.torrents).start()
+    inhibitor_loop = asyncio.new_event_loop()
+    inhibitor_thread = threading.Thread(target=inhibitor_loop.run_forever, name="Fake inhibitor", daemon=True)
+    inhibitor_thread.start()
+    inhibitor = FakeInhibitorServer(main_port=args.main_port, alt_port=args.alt_port)
+    asyncio.run_coroutine_threadsafe(inhibitor.start(), inhibitor_loop).result()
+    try:
+        row = run(args, qbt)
+    finally:
+        asyncio.run_coroutine_threadsafe(inhibitor.stop(), inhibitor_loop).result()
+        inhibitor_loop.call_soon_threadsafe(inhibitor_loop.stop)
+        inhibitor_thread.join()
+        qbt.stop()
+    print_table(f"{args.duration:.0f}s of a skin, {args.torrents} torrents, a burst of {args.burst} page bangs and an "
+                f"inhibit toggle every {args.burst_every:.0f}s",
+                ["RmExecute calls", "per second", "commands", "KiB/s", "redraws", "most redraws in one call"], [row])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--torrents", type=int, default=2000)
+    parser.add_argument("--burst", type=int, default=6, help="Page bangs in each burst")
+    parser.add_argument("--burst-every", type=float, default=3.0)
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds given to the first poll and handshake")
+    parser.add_argument("--main-port", type=int, default=47795)
+    parser.add_argument("--alt-port", type=int, default=47796)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main_loop(parse_args())
@@ -0,0 +1,44 @@
+import logging
+import os
+import pathlib
+import statistics
+import sys
+
+SCRIPTS_DIR = os.path.join(pathlib.Path(__file__).parent.parent.resolve(), "@Resources", "Scripts")
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+from combined_log import CombinedLogger  # noqa: E402
+
+
+def make_logger(level=logging.WARNING) -> CombinedLogger:
+    """A CombinedLogger like the one main.py builds, quiet by default so it doesn't skew timings"""
+    return CombinedLogger(name="Benchmark", level=level,
+                          formatter=r"%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s")
+
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile, good enough for benchmark reporting"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(values) -> dict:
+    return {
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else 0.0,
+        "mean": statistics.mean(values) if values else 0.0,
+    }
+
+
+def print_table(title: str, header: list, rows: list):
+    print(f"\n{title}")
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(header)]
+    print("  ".join(str(h).rjust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print("  ".join(str(c).rjust(w) for c, w in zip(row, widths)))
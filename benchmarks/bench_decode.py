@@ -0,0 +1,114 @@
+"""Decoding full sync/maindata updates of 1 to 50 MB, and what gzip saves on the wire
+
+    python benchmarks/bench_decode.py --sizes 1 5 10 25 50
+
+Each body is decoded on a worker thread the way QBTServer polls, while a probe on the event loop records how
+long the loop was kept from running (the decoder holds the GIL for as long as a single parse call takes).
+apply_sync then runs on the loop, as it does after every poll. "json.loads" is what python-qbittorrent did,
+"orjson" parses in one call with the faster backend and "decode_maindata" is the WebUI client's decoder.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import bench_common
+from bench_common import print_table
+from fake_qbittorrent import FakeQBittorrentServer, make_torrent
+
+import webui_client
+from qbt_server import QBTServer
+
+
+def full_update(size_mb: float, seed: int = 1) -> bytes:
+    """A full update of about size_mb, keys sorted the way qBittorrent writes them"""
+    rng = random.Random(seed)
+    per_torrent = len(json.dumps(make_torrent(rng, 0))) + 2
+    torrents = {}
+    for i in range(int(size_mb * 1024 * 1024 / per_torrent)):
+        torrent = make_torrent(rng, i)
+        torrents[torrent.pop("hash")] = torrent
+    return json.dumps({"rid": 1, "full_update": True, "torrents": torrents, "server_state": {}},
+                      sort_keys=True).encode("utf-8")
+
+
+async def probe(stop: asyncio.Event, worst: list, interval: float = 0.001):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        worst[0] = max(worst[0], time.perf_counter() - expected)
+
+
+async def decode_on_worker(event_loop, decode, body: bytes) -> tuple:
+    """Decode like a poll does, returns the data, seconds taken and the longest the loop was held up"""
+    stop, worst = asyncio.Event(), [0.0]
+    probe_task = event_loop.create_task(probe(stop, worst))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    data = await event_loop.run_in_executor(None, decode, body)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    return data, elapsed, worst[0]
+
+
+def decoders() -> list:
+    result = [("json.loads", lambda body: json.loads(body.decode("utf-8")))]
+    if webui_client.orjson is not None:
+        result.append(("orjson", webui_client.orjson.loads))
+    result.append(("decode_maindata", lambda body: webui_client.decode_maindata(body, "bench")))
+    return result
+
+
+def wire(torrents: int) -> list:
+    rows = []
+    for compress in (False, True):
+        server = FakeQBittorrentServer(torrents, compress=compress).start()
+        try:
+            stats = {}
+            client = webui_client.WebUIClient(server.url, stats, name="bench")
+            client.login(server.state.username, server.state.password)
+            start = time.perf_counter()
+            data = client.sync_main_data(0)
+            elapsed = time.perf_counter() - start
+            rows.append(["gzip" if compress else "identity", len(data["torrents"]),
+                         f"{stats['sync/maindata'].wire_bytes / 1024 ** 2:.1f}",
+                         f"{stats['sync/maindata'].bytes / 1024 ** 2:.1f}", f"{elapsed * 1000:.0f}"])
+        finally:
+            server.stop()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 5, 10, 25, 50], help="Body sizes in MB")
+    parser.add_argument("--wire-torrents", type=int, default=10000, help="Library size for the gzip comparison")
+    args = parser.parse_args()
+
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    logger = bench_common.make_logger()
+    rows = []
+    try:
+        for size in args.sizes:
+            body = full_update(size)
+            for name, decode in decoders():
+                data, elapsed, stall = event_loop.run_until_complete(decode_on_worker(event_loop, decode, body))
+                server = QBTServer("http://bench:8080/", "", "", name="bench", logging=logger)
+                start = time.perf_counter()
+                server.apply_sync(data)
+                applied = time.perf_counter() - start
+                rows.append([f"{len(body) / 1024 ** 2:.1f}", len(data["torrents"]), name, f"{elapsed * 1000:.0f}",
+                             f"{stall * 1000:.0f}", f"{applied * 1000:.0f}", f"{max(stall, applied) * 1000:.0f}"])
+                del data, server
+    finally:
+        event_loop.close()
+    print_table("Full sync/maindata update, decoded on a worker thread then applied on the event loop",
+                ["MB", "torrents", "decoder", "decode ms", "loop held ms", "apply_sync ms", "worst stall ms"], rows)
+    print_table(f"sync/maindata over HTTP from the fake WebUI, {args.wire_torrents} torrents",
+                ["encoding", "torrents", "wire MB", "body MB", "request ms"], wire(args.wire_torrents))
+
+
+if __name__ == "__main__":
+    main()
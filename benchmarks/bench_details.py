@@ -0,0 +1,72 @@
+"""Refresh cycle cost with the detail panel closed and open on a torrent with many files and peers
+
+    python benchmarks/bench_details.py --files 20000 --peers 5000 --cycles 30
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+from bench_refresh import write_config
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import rm_interface
+
+
+def cycles(event_loop, interface, count: int, gap: float) -> tuple:
+    latencies, cpu_times = [], []
+    for _ in range(count):
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        event_loop.run_until_complete(interface.refresh_once())
+        cpu_times.append(time.thread_time() - cpu_start)
+        latencies.append(time.perf_counter() - wall_start)
+        # The sleep between refreshes, when the detail fetches get their turn
+        event_loop.run_until_complete(asyncio.sleep(gap))
+    return summarize(latencies), summarize(cpu_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--torrents", type=int, default=10000)
+    parser.add_argument("--files", type=int, default=20000, help="Files in every torrent")
+    parser.add_argument("--peers", type=int, default=5000, help="Peers of every torrent")
+    parser.add_argument("--cycles", type=int, default=30)
+    parser.add_argument("--gap", type=float, default=0.5, help="Seconds between refreshes, the skin waits 2")
+    args = parser.parse_args()
+
+    server = FakeQBittorrentServer(args.torrents, files_per_torrent=args.files, peers_per_torrent=args.peers).start()
+    rows = []
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_config(config_dir, [server])
+        rm = FakeRainmeter()
+        event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(event_loop)
+        interface = rm_interface.RainMeterInterface(rm, event_loop, bench_common.make_logger(), debug=True,
+                                                    config_dir=config_dir, autostart=False)
+        interface.details.interval = 0.05  # Fetch as often as possible to make any interference show
+        interface.details.files.max_age = 0.0
+        try:
+            event_loop.run_until_complete(interface.refresh_once())
+            for label in ("panel closed", "panel open"):
+                if label == "panel open":
+                    event_loop.run_until_complete(interface.details_bang("details_0"))
+                requests_before = dict(server.state.request_counts)
+                latency, cpu = cycles(event_loop, interface, args.cycles, args.gap)
+                detail_requests = sum(server.state.request_counts.get(endpoint, 0) - requests_before.get(endpoint, 0)
+                                      for endpoint in ("sync/torrentPeers", "torrents/files", "torrents/trackers"))
+                rows.append([label, f"{latency['p50'] * 1000:.1f}", f"{latency['p99'] * 1000:.1f}",
+                             f"{cpu['p50'] * 1000:.1f}", detail_requests,
+                             len(interface.details.rendered.get('DetailText', {}).get('Text', ""))])
+        finally:
+            event_loop.run_until_complete(interface.tear_down())
+            event_loop.close()
+            server.stop()
+    print_table(f"Refresh with {args.torrents} torrents, details on {args.files} files and {args.peers} peers",
+                ["", "refresh p50 ms", "refresh p99 ms", "loop CPU p50 ms", "detail requests", "panel chars"], rows)
+
+
+if __name__ == "__main__":
+    main()
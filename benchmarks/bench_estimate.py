@@ -0,0 +1,106 @@
+"""How far the rows are from the truth between polls, shown as last polled or moved on by the estimates
+
+    python benchmarks/bench_estimate.py --intervals 2 5 10 --seconds 600
+
+Downloading torrents are simulated second by second, each one's speed wanders around its own average. Every
+poll interval a sync carrying their current values is applied to a QBTServer, and every second (the Info
+measure's Update) the rows are read the way the skin shows them. "stale" shows the values of the last sync,
+"estimated" moves them on with torrent_estimate. The errors are against the simulated truth at that second.
+"Percentage changes" is how many Updates change a row's percentage text, how live the skin looks. Right after
+each sync the estimates have to equal what was synced.
+"""
+import argparse
+import random
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+
+from qbt_server import QBTServer
+import torrent_estimate
+from torrent_formatter import live_format
+
+
+def simulate(args, interval: float) -> dict:
+    rng = random.Random(args.seed)
+    truth = {}
+    for i in range(args.torrents):
+        size = rng.randint(200, 40000) * 1024 ** 2
+        downloaded = int(size * rng.random() * 0.5)
+        truth[f"{i:040x}"] = {"size": size, "downloaded": downloaded, "average": rng.randint(64, 20480) * 1024,
+                              "dlspeed": 0, "upspeed": rng.randint(0, 1024) * 1024, "uploaded": 0,
+                              "added_on": int(time.time()) - rng.randint(60, 86400)}
+    server = QBTServer("http://127.0.0.1", "admin", "adminadmin", name="fake", logging=bench_common.make_logger())
+    errors = {"stale": [], "estimated": []}
+    eta_errors = {"stale": [], "estimated": []}
+    changes = {"stale": 0, "estimated": 0}
+    last_text = {"stale": {}, "estimated": {}}
+    costs, rid, synced_at = [], 0, None
+    for second in range(args.seconds):
+        for torrent in truth.values():
+            # What was downloaded in the second, qBittorrent's ETA goes by the average speed instead
+            torrent["dlspeed"] = max(0, int(torrent["average"] * rng.lognormvariate(0, args.jitter)))
+            torrent["downloaded"] = min(torrent["size"], torrent["downloaded"] + torrent["dlspeed"])
+            torrent["uploaded"] += torrent["upspeed"]
+        if second % interval == 0:
+            rid += 1
+            server.apply_sync({"rid": rid, "full_update": rid == 1, "torrents": {
+                torrent_hash: {"name": torrent_hash, "state": "downloading", "added_on": torrent["added_on"],
+                               "progress": torrent["downloaded"] / torrent["size"],
+                               "downloaded": torrent["downloaded"],
+                               "amount_left": torrent["size"] - torrent["downloaded"],
+                               "eta": int((torrent["size"] - torrent["downloaded"]) / torrent["average"]),
+                               "dlspeed": torrent["dlspeed"], "upspeed": torrent["upspeed"],
+                               "ratio": torrent["uploaded"] / max(1, torrent["downloaded"])}
+                for torrent_hash, torrent in truth.items()}})
+            synced_at = {server.name: second}
+            records = [server.index.torrents[torrent_hash] for torrent_hash in truth]
+            for record, estimate in zip(records, torrent_estimate.estimate(records, synced_at, 1e9, now=second)):
+                assert (estimate.progress, estimate.downloaded, estimate.eta) == \
+                       (record.progress, record.downloaded, record.eta), record.hash
+        start = time.perf_counter()
+        estimates = torrent_estimate.estimate(records[:args.rows], synced_at, limit=interval * 3, now=second)
+        live_format(estimates, args.rows)
+        costs.append(time.perf_counter() - start)
+        estimates = torrent_estimate.estimate(records, synced_at, limit=interval * 3, now=second)
+        for mode, shown in (("stale", records), ("estimated", estimates)):
+            for record, row in zip(records, shown):
+                torrent = truth[record.hash]
+                left = torrent["size"] - torrent["downloaded"]
+                errors[mode].append(abs(row.progress - torrent["downloaded"] / torrent["size"]) * 100)
+                if left:
+                    eta_errors[mode].append(abs(row.eta - left / torrent["average"]))
+                text = f"{row.progress * 100:.1f}%"
+                changes[mode] += last_text[mode].get(record.hash) != text
+                last_text[mode][record.hash] = text
+    readings = args.seconds * args.torrents
+    return {mode: {"progress": summarize(errors[mode]), "eta": summarize(eta_errors[mode]),
+                   "changes": changes[mode] / readings, "cost": summarize(costs)} for mode in errors}
+
+
+def main(args):
+    rows = []
+    for interval in args.intervals:
+        result = simulate(args, interval)
+        for mode, values in result.items():
+            rows.append([interval, mode, f"{values['progress']['mean']:.3f}", f"{values['progress']['p99']:.3f}",
+                         f"{values['eta']['p50']:.0f}", f"{values['changes'] * 100:.0f}%",
+                         f"{values['cost']['p50'] * 1e6:.0f}" if mode == "estimated" else "-"])
+    print_table(f"{args.torrents} downloading torrents for {args.seconds}s, speeds jitter {args.jitter}",
+                ["poll s", "rows", "progress error mean pp", "p99 pp", "ETA error p50 s", "percentage changes",
+                 f"estimate us per Update ({args.rows} rows)"], rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--intervals", type=int, nargs="+", default=[2, 5, 10])
+    parser.add_argument("--seconds", type=int, default=600)
+    parser.add_argument("--torrents", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=4)
+    parser.add_argument("--jitter", type=float, default=0.3, help="Spread of the per second speeds, lognormal sigma")
+    parser.add_argument("--seed", type=int, default=2)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,128 @@
+"""Requests sent and time to the new value on screen when the speed limits are scrolled through from the skin
+
+    python benchmarks/bench_limits.py --bursts 10 --scrolls 12
+
+The plugin is loaded through main.Rain against the qBittorrent WebUI stand-in and the fake inhibitor. Each burst
+scrolls the download limit (limit_dl_more / limit_dl_less) every --gap seconds and toggles the alternative speeds
+twice, which has to cost no request at all. "shown ms" is how long each scroll took to reach an RmExecute with
+the new limit. Once a burst has settled the stand-in must hold the limit the skin shows.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+from fake_inhibitor import FakeInhibitorServer
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import humanize
+
+import main
+import speed_limits
+
+
+def wait_for(condition, timeout: float) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.002)
+    return False
+
+
+def shown(rm: FakeRainmeter, text: str, start: int) -> bool:
+    with rm.lock:
+        return any(text in bang for bang in rm.executed[start:])
+
+
+def run(args, qbt: FakeQBittorrentServer) -> dict:
+    rng = random.Random(4)
+    transfer = ("transfer/setDownloadLimit", "transfer/setUploadLimit", "transfer/toggleSpeedLimitsMode")
+    with tempfile.TemporaryDirectory() as config_dir:
+        with open(os.path.join(config_dir, "secrets.json"), "w") as f:
+            json.dump({"Servers": [{"Host": qbt.url, "Username": qbt.state.username,
+                                    "Password": qbt.state.password, "Name": "fake"}]}, f)
+        with open(os.path.join(config_dir, "settings.json"), "w") as f:
+            json.dump({"filter": "filter_all", "sort_by": "added_on", "reverse": True, "check_updates": False,
+                       "limit_delay": args.delay, "inhibitor_host": "127.0.0.1",
+                       "inhibitor_ports": [args.main_port, args.alt_port]}, f)
+        rm = FakeRainmeter(options={"ConfigDir": config_dir, "Rows": 4})
+        rain = main.Rain()
+        rain.Reload(rm, 0)
+        wait_for(lambda: rain.rainmeter_interface is not None and rain.rainmeter_interface.bang_string, 10.0)
+        before = {endpoint: qbt.state.request_counts.get(endpoint, 0) for endpoint in transfer}
+        shown_times, mismatches = [], 0
+        limit = 0
+        for _ in range(args.bursts):
+            for _ in range(args.scrolls):
+                direction = 1 if rng.random() < 0.5 else -1
+                limit = speed_limits.step_limit(limit, direction)
+                text = f"DL: " if not limit else f" / {humanize.naturalsize(limit)}\""
+                with rm.lock:
+                    start = len(rm.executed)
+                began = time.perf_counter()
+                rain.ExecuteBang("limit_dl_more" if direction > 0 else "limit_dl_less")
+                if wait_for(lambda: shown(rm, text, start), 2.0):
+                    shown_times.append(time.perf_counter() - began)
+                rain.Update()
+                time.sleep(args.gap)
+            rain.ExecuteBang("altspeed_toggle")
+            time.sleep(args.gap)
+            rain.ExecuteBang("altspeed_toggle")
+            # The request goes out after the delay and the poll after it brings the server's value back
+            time.sleep(args.delay + args.settle)
+            server = rain.rainmeter_interface.servers[0]
+            mismatches += qbt.state.limits["dl_rate_limit"] != limit or server.optimistic_state != {} or \
+                server.server_state.get("dl_rate_limit") != limit
+        requests = {endpoint: qbt.state.request_counts.get(endpoint, 0) - before[endpoint] for endpoint in transfer}
+        rain.Finalize()
+    return {"shown": summarize(shown_times), "requests": requests, "mismatches": mismatches,
+            "scrolls": args.bursts * args.scrolls}
+
+
+def main_loop(args):
+    qbt = FakeQBittorrentServer(args.torrents).start()
+    inhibitor_loop = asyncio.new_event_loop()
+    inhibitor_thread = threading.Thread(target=inhibitor_loop.run_forever, name="Fake inhibitor", daemon=True)
+    inhibitor_thread.start()
+    inhibitor = FakeInhibitorServer(main_port=args.main_port, alt_port=args.alt_port)
+    asyncio.run_coroutine_threadsafe(inhibitor.start(), inhibitor_loop).result()
+    try:
+        result = run(args, qbt)
+    finally:
+        asyncio.run_coroutine_threadsafe(inhibitor.stop(), inhibitor_loop).result()
+        inhibitor_loop.call_soon_threadsafe(inhibitor_loop.stop)
+        inhibitor_thread.join()
+        qbt.stop()
+    requests = result["requests"]
+    print_table(f"{args.bursts} bursts of {args.scrolls} scrolls {args.gap * 1000:.0f} ms apart and two alternative "
+                f"speed toggles, {args.delay:.1f}s delay",
+                ["scrolls", "shown p50 ms", "shown p99 ms", "setDownloadLimit", "toggleSpeedLimitsMode",
+                 "bursts not settled"],
+                [[result["scrolls"], f"{result['shown']['p50'] * 1000:.1f}", f"{result['shown']['p99'] * 1000:.1f}",
+                  requests["transfer/setDownloadLimit"], requests["transfer/toggleSpeedLimitsMode"],
+                  result["mismatches"]]])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bursts", type=int, default=10)
+    parser.add_argument("--scrolls", type=int, default=12)
+    parser.add_argument("--gap", type=float, default=0.05, help="Seconds between scrolls")
+    parser.add_argument("--delay", type=float, default=0.6, help="limit_delay in settings.json")
+    parser.add_argument("--settle", type=float, default=2.5, help="Seconds given to the poll after each burst")
+    parser.add_argument("--torrents", type=int, default=500)
+    parser.add_argument("--main-port", type=int, default=47825)
+    parser.add_argument("--alt-port", type=int, default=47826)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main_loop(parse_args())
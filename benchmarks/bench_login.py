@@ -0,0 +1,107 @@
+"""Time to the first frame after a reload and the auth traffic it takes, with and without the saved session
+
+    python benchmarks/bench_login.py --reloads 20
+
+Each reload loads the plugin through main.Rain against the qBittorrent WebUI stand-in and the fake inhibitor and
+waits for the first render. "expired" forgets every session on the stand-in before each reload, so the saved
+SID is answered with a 403 and the plugin has to log in again. The requests columns count what the stand-in
+saw per reload, the saved sessions file has to stay readable by its owner only.
+"""
+import argparse
+import asyncio
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+from fake_inhibitor import FakeInhibitorServer
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import main
+import session_store
+
+
+def wait_for(condition, timeout: float) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.002)
+    return False
+
+
+def run(args, qbt: FakeQBittorrentServer, mode: str) -> list:
+    counts = qbt.state.request_counts
+    with tempfile.TemporaryDirectory() as config_dir:
+        with open(os.path.join(config_dir, "secrets.json"), "w") as f:
+            json.dump({"Servers": [{"Host": qbt.url, "Username": qbt.state.username,
+                                    "Password": qbt.state.password, "Name": "fake"}]}, f)
+        with open(os.path.join(config_dir, "settings.json"), "w") as f:
+            json.dump({"filter": "filter_all", "sort_by": "added_on", "reverse": True, "check_updates": False,
+                       "remember_session": mode != "off", "inhibitor_host": "127.0.0.1",
+                       "inhibitor_ports": [args.main_port, args.alt_port]}, f)
+        rm = FakeRainmeter(options={"ConfigDir": config_dir, "Rows": 4})
+        times, before = [], dict(counts)
+        for i in range(args.reloads + 1):
+            if mode == "expired":
+                with qbt.state.lock:
+                    qbt.state.sessions.clear()
+            if i == 1:
+                before = dict(counts)  # The first reload has nothing saved yet in any mode
+            rain = main.Rain()
+            start = time.perf_counter()
+            rain.Reload(rm, 0)
+            rendered = wait_for(lambda: rain.rainmeter_interface is not None and
+                                rain.rainmeter_interface.bang_string, 10.0)
+            if i > 0:
+                times.append(time.perf_counter() - start if rendered else float("inf"))
+            rain.Finalize()
+            rm.reset()
+        path = os.path.join(config_dir, session_store.default_name)
+        mode_bits = stat.S_IMODE(os.stat(path).st_mode) if os.path.exists(path) else None
+    if mode_bits is not None and os.name == "posix":
+        assert mode_bits == 0o600, f"{path} is {oct(mode_bits)}"
+    reloads = args.reloads
+    requests = {endpoint: (counts.get(endpoint, 0) - before.get(endpoint, 0)) / reloads
+                for endpoint in ("auth/login", "app/version", "app/preferences", "sync/maindata")}
+    result = summarize(times)
+    return [mode, f"{result['p50'] * 1000:.1f}", f"{result['p90'] * 1000:.1f}", f"{requests['auth/login']:.2f}",
+            f"{requests['app/version']:.2f}", f"{requests['app/preferences']:.2f}",
+            "-" if mode_bits is None else oct(mode_bits)]
+
+
+def main_loop(args):
+    qbt = FakeQBittorrentServer(args.torrents).start()
+    inhibitor_loop = asyncio.new_event_loop()
+    inhibitor_thread = threading.Thread(target=inhibitor_loop.run_forever, name="Fake inhibitor", daemon=True)
+    inhibitor_thread.start()
+    inhibitor = FakeInhibitorServer(main_port=args.main_port, alt_port=args.alt_port)
+    asyncio.run_coroutine_threadsafe(inhibitor.start(), inhibitor_loop).result()
+    try:
+        rows = [run(args, qbt, mode) for mode in ("off", "saved", "expired")]
+    finally:
+        asyncio.run_coroutine_threadsafe(inhibitor.stop(), inhibitor_loop).result()
+        inhibitor_loop.call_soon_threadsafe(inhibitor_loop.stop)
+        inhibitor_thread.join()
+        qbt.stop()
+    print_table(f"{args.reloads} reloads, {args.torrents} torrents",
+                ["session", "first frame p50 ms", "p90 ms", "logins", "app/version", "app/preferences",
+                 "file mode"], rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reloads", type=int, default=20)
+    parser.add_argument("--torrents", type=int, default=200)
+    parser.add_argument("--main-port", type=int, default=47805)
+    parser.add_argument("--alt-port", type=int, default=47806)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main_loop(parse_args())
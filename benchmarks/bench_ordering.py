@@ -0,0 +1,87 @@
+"""Page selection cost against the local torrent set, incremental ordering and bounded heaps vs re-sorting
+
+    python benchmarks/bench_ordering.py --sizes 10000 50000 --ticks 20
+
+The growing scenario starts from a library smaller than a speed pool and adds torrents every tick until it
+reaches the size, every page is checked against a full sort.
+"""
+import argparse
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+from fake_qbittorrent import FakeQBittorrentState, make_torrent
+
+from qbt_server import QBTServer
+from torrent_filter import Everything, FieldIn
+from torrent_order import sort_key
+
+
+def naive_page(server: QBTServer, torrent_filter, sort_by: str, reverse: bool, start: int):
+    """What re-sorting the whole library on every tick costs"""
+    keys = torrent_filter.select(server.index)
+    torrents = sorted((server.index.torrents[k] for k in keys), key=sort_key(sort_by), reverse=reverse)
+    return torrents[start:start + 4]
+
+
+def run(size: int, ticks: int, sort_by: str, churn: float, torrent_filter, deep: bool, grow: bool) -> dict:
+    initial = 10 if grow else size
+    state = FakeQBittorrentState(initial, churn=churn)
+    server = QBTServer("http://fake/", "admin", "adminadmin", logging=bench_common.make_logger())
+    server.apply_sync(state.sync_maindata({"rid": 0}))
+    start = size // 2 if deep else 0
+    # Build the ordering once, the way the first render after a sort change would
+    server.select(torrent_filter, sort_by, True, start + 4, start)
+    sync_times, select_times, naive_times = [], [], []
+    for _ in range(ticks):
+        delta = state.sync_maindata({"rid": server.rid})
+        if grow:
+            # New torrents arrive in the delta like ones added in qBittorrent
+            for i in range(len(state.torrents), min(size, len(state.torrents) + (size - initial) // ticks + 1)):
+                torrent = make_torrent(state.rng, i)
+                state.torrents[torrent["hash"]] = torrent
+                state.hashes.append(torrent["hash"])
+                delta["torrents"][torrent["hash"]] = {k: v for k, v in torrent.items() if k != "hash"}
+        t0 = time.perf_counter()
+        server.apply_sync(delta)
+        t1 = time.perf_counter()
+        page, _ = server.select(torrent_filter, sort_by, True, start + 4, start)
+        t2 = time.perf_counter()
+        expected = naive_page(server, torrent_filter, sort_by, True, start)
+        t3 = time.perf_counter()
+        sync_times.append(t1 - t0)
+        select_times.append(t2 - t1)
+        naive_times.append(t3 - t2)
+        key = sort_key(sort_by)
+        assert [key(t) for t in page] == [key(t) for t in expected], "Page differs from a full sort"
+    return {"sync": summarize(sync_times), "select": summarize(select_times), "naive": summarize(naive_times)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--ticks", type=int, default=20)
+    args = parser.parse_args()
+
+    scenarios = [
+        # name, sort column, fraction of torrents changing per tick, filter, deep page, library growing from 10
+        ("speed sort, heavy churn", "dlspeed", 0.9, Everything(), False, False),
+        ("speed sort, light churn", "upspeed", 0.05, Everything(), False, False),
+        ("speed sort, growing", "dlspeed", 0.05, Everything(), False, True),
+        ("added date, first page", "added_on", 0.05, Everything(), False, False),
+        ("added date, deep page", "added_on", 0.05, Everything(), True, False),
+        ("name, seeding filter", "name", 0.05, FieldIn('state', 'uploading', 'stalledUP'), False, False),
+        ("name, narrow filter", "name", 0.05, FieldIn('category', 'books'), False, False),
+    ]
+    rows = []
+    for size in args.sizes:
+        for name, sort_by, churn, torrent_filter, deep, grow in scenarios:
+            result = run(size, args.ticks, sort_by, churn, torrent_filter, deep, grow)
+            rows.append([size, name, f"{result['sync']['p50'] * 1000:.2f}", f"{result['select']['p50'] * 1000:.3f}",
+                         f"{result['select']['p99'] * 1000:.3f}", f"{result['naive']['p50'] * 1000:.2f}"])
+    print_table(f"Per tick cost, {args.ticks} ticks", ["torrents", "scenario", "apply delta ms", "select p50 ms",
+                                                        "select p99 ms", "full sort ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
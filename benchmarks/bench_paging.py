@@ -0,0 +1,111 @@
+"""Page flips with and without the adjacent page prefetch, and scroll-wheel bursts racing the refresh
+
+    python benchmarks/bench_paging.py --torrents 10000 --flips 40 --isdir-delay 0.005
+
+--isdir-delay makes every os.path.isdir call take that long, the way it does when content paths point at a
+network share. A flip is timed from the bang to the page being handed to Rainmeter.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+from bench_refresh import write_config
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import rm_interface
+import torrent_formatter
+
+
+async def no_prefetch():
+    pass
+
+
+def flips(event_loop, interface, count: int, prefetch: bool, gap: float) -> dict:
+    if not prefetch:
+        interface.prefetch_adjacent = no_prefetch
+    else:
+        interface.__dict__.pop('prefetch_adjacent', None)
+    interface.page_cache = {}
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        event_loop.run_until_complete(interface.execute_bang("page_right"))
+        latencies.append(time.perf_counter() - start)
+        # A user doesn't flip faster than the prefetch can keep up, give it the time a frame or two would
+        event_loop.run_until_complete(asyncio.sleep(gap))
+    return summarize(latencies)
+
+
+def burst(event_loop, interface, size: int) -> list:
+    """size page_right bangs at once while a refresh is running"""
+    renders_before = interface.flights.started
+    page_before = interface.page_start
+
+    async def run():
+        refresh = asyncio.ensure_future(interface.refresh_once())
+        await asyncio.gather(*(interface.execute_bang("page_right") for _ in range(size)))
+        await refresh
+
+    start = time.perf_counter()
+    event_loop.run_until_complete(run())
+    elapsed = time.perf_counter() - start
+    expected = min(page_before + size * interface.rows, max(0, interface.torrent_num - interface.rows))
+    shown = interface.rainmeter_values['TorrentName0']['Text']
+    correct = shown == interface.torrents[0].name and interface.page_start == expected
+    return [size, f"{elapsed * 1000:.1f}", interface.flights.started - renders_before, "yes" if correct else "NO"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--torrents", type=int, default=10000)
+    parser.add_argument("--flips", type=int, default=40)
+    parser.add_argument("--isdir-delay", type=float, default=0.005, help="Seconds every isdir call takes")
+    parser.add_argument("--gap", type=float, default=0.1, help="Seconds between flips")
+    args = parser.parse_args()
+
+    isdir = os.path.isdir
+
+    def slow_isdir(path):
+        time.sleep(args.isdir_delay)
+        return isdir(path)
+
+    os.path.isdir = slow_isdir
+    server = FakeQBittorrentServer(args.torrents).start()
+    flip_rows, burst_rows = [], []
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_config(config_dir, [server])
+        event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(event_loop)
+        interface = rm_interface.RainMeterInterface(FakeRainmeter(), event_loop, bench_common.make_logger(),
+                                                    debug=True, config_dir=config_dir, autostart=False)
+        try:
+            event_loop.run_until_complete(interface.refresh_once())
+            for prefetch in (False, True):
+                # Every flip lands on torrents whose isdir answer isn't known yet, like paging through a library
+                interface.page_start = 0 if prefetch else interface.torrent_num // 2
+                torrent_formatter._save_path.cache_clear()
+                event_loop.run_until_complete(interface.render())
+                event_loop.run_until_complete(asyncio.sleep(args.gap))
+                latency = flips(event_loop, interface, args.flips, prefetch, args.gap)
+                flip_rows.append(["prefetch" if prefetch else "no prefetch", f"{latency['p50'] * 1000:.1f}",
+                                  f"{latency['p90'] * 1000:.1f}", f"{latency['max'] * 1000:.1f}"])
+            for size in (1, 5, 20):
+                burst_rows.append(burst(event_loop, interface, size))
+        finally:
+            event_loop.run_until_complete(interface.tear_down())
+            event_loop.close()
+            server.stop()
+            os.path.isdir = isdir
+    print_table(f"Page flips, {args.torrents} torrents, isdir takes {args.isdir_delay * 1000:.0f}ms",
+                ["", "flip p50 ms", "flip p90 ms", "flip max ms"], flip_rows)
+    print_table("page_right bursts during a refresh", ["bangs", "elapsed ms", "flights started", "final page right"],
+                burst_rows)
+
+
+if __name__ == "__main__":
+    main()
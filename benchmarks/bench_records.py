@@ -0,0 +1,77 @@
+"""Memory held per torrent as raw API dicts vs TorrentRecords, and the cost of reading the rendered fields
+
+    python benchmarks/bench_records.py --sizes 10000 50000
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+import bench_common  # noqa: F401 (puts the scripts on the path)
+from bench_common import print_table
+from fake_qbittorrent import FakeQBittorrentState
+
+import torrent_record
+from torrent_filter import TorrentIndex
+from torrent_record import TorrentRecord
+
+# What torrent_format and the sorts read for every torrent on a page
+_rendered = ('name', 'content_path', 'state', 'dlspeed', 'upspeed', 'num_complete', 'num_seeds', 'num_incomplete',
+             'num_leechs', 'eta', 'progress', 'downloaded', 'amount_left', 'added_on', 'ratio', 'tags')
+
+
+def traced(build):
+    """The object build() returns and the bytes it still holds once built"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return built, after - before
+
+
+def build_index(payload: str) -> TorrentIndex:
+    index = TorrentIndex()
+    for torrent in json.loads(payload):
+        index.upsert(torrent['hash'], torrent)
+    return index
+
+
+def read_time(torrents, read) -> float:
+    start = time.perf_counter()
+    for torrent in torrents:
+        read(torrent)
+    return time.perf_counter() - start
+
+
+def run(size: int) -> list:
+    state = FakeQBittorrentState(size)
+    # Decoded from JSON so the dicts own their strings the way the client's would
+    payload = json.dumps(state.torrents_info({}))
+    dicts, dict_bytes = traced(lambda: json.loads(payload))
+    records, record_bytes = traced(lambda: [TorrentRecord(torrent) for torrent in json.loads(payload)])
+    index, index_bytes = traced(lambda: build_index(payload))
+
+    dict_read = read_time(dicts, lambda torrent: [torrent[field] for field in _rendered])
+    record_read = read_time(records, lambda torrent: [getattr(torrent, field) for field in _rendered])
+    return [size, len(dicts[0]), f"{dict_bytes / size:.0f}", f"{record_bytes / size:.0f}",
+            f"{index_bytes / size:.0f}", f"{dict_bytes / record_bytes:.1f}x",
+            f"{dict_read * 1000:.1f}", f"{record_read * 1000:.1f}", torrent_record.interned_count()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000])
+    args = parser.parse_args()
+
+    rows = [run(size) for size in args.sizes]
+    print_table("Bytes held per torrent",
+                ["torrents", "API keys", "dict B", "record B", "indexed B", "saving", "dict read ms",
+                 "record read ms", "interned"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Drive RainMeterInterface's refresh path against a fake Rainmeter and a local qBittorrent WebUI stand-in
+
+    python benchmarks/bench_refresh.py --sizes 100 1000 10000 50000 --cycles 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import rm_interface
+
+
+def write_config(config_dir: str, servers: list, settings: dict = None):
+    with open(os.path.join(config_dir, "secrets.json"), "w") as f:
+        json.dump({"Servers": [{"Username": server.state.username, "Password": server.state.password,
+                                "Host": server.url, "Name": f"fake{i}"} for i, server in enumerate(servers)]}, f)
+    with open(os.path.join(config_dir, "settings.json"), "w") as f:
+        json.dump(settings or {"filter": "filter_all", "sort_by": "added_on", "reverse": True}, f)
+
+
+def run_size(torrent_count: int, cycles: int, settings: dict = None, server_count: int = 1,
+             slow_delay: float = 0.0) -> dict:
+    # The library is split evenly over the servers, the last one can be made slow
+    servers = [FakeQBittorrentServer(torrent_count // server_count, seed=i + 1,
+                                     delay=slow_delay if i == server_count - 1 else 0.0).start()
+               for i in range(server_count)]
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_config(config_dir, servers, settings)
+        rm = FakeRainmeter()
+        event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(event_loop)
+        interface = rm_interface.RainMeterInterface(rm, event_loop, bench_common.make_logger(), debug=True,
+                                                    config_dir=config_dir, autostart=False)
+        latencies, cpu_times, bang_bytes = [], [], []
+        try:
+            # The first cycle logs in and pulls the full sync/maindata, keep it out of the steady state numbers
+            event_loop.run_until_complete(interface.refresh_once())
+            warm_bytes = sum(server.state.bytes_sent for server in servers)
+            for _ in range(cycles):
+                rm.reset()
+                wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                event_loop.run_until_complete(interface.refresh_once())
+                # What the render queued, Rain.Update sends anything still waiting for its frame
+                interface.update()
+                cpu_times.append(time.thread_time() - cpu_start)
+                latencies.append(time.perf_counter() - wall_start)
+                bang_bytes.append(rm.execute_bytes)
+        finally:
+            event_loop.run_until_complete(interface.tear_down())
+            event_loop.close()
+            for server in servers:
+                server.stop()
+        return {
+            "torrents": torrent_count,
+            "latency": summarize(latencies),
+            "cpu": summarize(cpu_times),
+            "bang_bytes": summarize(bang_bytes),
+            "server_bytes": sum(server.state.bytes_sent for server in servers) - warm_bytes,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--sort-by", default="added_on")
+    parser.add_argument("--filter", default="filter_all")
+    parser.add_argument("--servers", type=int, default=1, help="Split the library over this many WebUI stand-ins")
+    parser.add_argument("--slow-delay", type=float, default=0.0, help="Seconds of latency added to the last server")
+    args = parser.parse_args()
+
+    settings = {"filter": args.filter, "sort_by": args.sort_by, "reverse": True}
+    rows = []
+    for size in args.sizes:
+        result = run_size(size, args.cycles, settings, args.servers, args.slow_delay)
+        lat, cpu, out = result["latency"], result["cpu"], result["bang_bytes"]
+        rows.append([size, f"{lat['p50'] * 1000:.1f}", f"{lat['p90'] * 1000:.1f}", f"{lat['p99'] * 1000:.1f}",
+                     f"{cpu['mean'] * 1000:.2f}", f"{out['mean']:.0f}",
+                     f"{result['server_bytes'] / args.cycles / 1024:.0f}"])
+    print_table(f"Refresh cycle, {args.cycles} cycles per size (sort={args.sort_by}, filter={args.filter}, "
+                f"servers={args.servers})",
+                ["torrents", "p50 ms", "p90 ms", "p99 ms", "cpu ms/cycle", "bang bytes", "wire KiB/cycle"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Reload and finalize the plugin over and over and check nothing is left behind
+
+    python benchmarks/bench_reload.py --reloads 1000
+
+Each cycle runs Rain.Reload against a fake Rainmeter, a local qBittorrent WebUI stand-in and the fake inhibitor
+server, waits for the first render, sends a bang and calls Finalize. Every tenth cycle Reload is called twice
+to go through the path that reuses the running loop. Thread count, open file descriptors and traced memory are
+sampled after a warm up and must stay flat, the script exits non-zero if they don't.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import bench_common  # noqa: F401 (puts the scripts on the path)
+from bench_common import print_table
+from fake_inhibitor import FakeInhibitorServer
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import main
+
+
+def open_fds() -> int:
+    """Open file descriptors (sockets included), -1 where /proc isn't available"""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+
+def sample(settle: float) -> dict:
+    # The WebUI stand-in serves each connection on its own thread, give them a moment to see the client hang up
+    time.sleep(settle)
+    gc.collect()
+    return {"threads": threading.active_count(), "fds": open_fds(), "memory": tracemalloc.get_traced_memory()[0]}
+
+
+def wait_for(condition, timeout: float) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def reload_cycle(rm: FakeRainmeter, double: bool) -> bool:
+    rain = main.Rain()
+    rain.Reload(rm, 0)
+    if double:
+        rain.Reload(rm, 0)
+    rendered = wait_for(lambda: rain.rainmeter_interface is not None and rain.rainmeter_interface.bang_string, 5.0)
+    if rendered:
+        rain.Update()
+        rain.ExecuteBang("page_right")
+    rain.Finalize()
+    return rendered
+
+
+def main_loop(args) -> int:
+    qbt = FakeQBittorrentServer(args.torrents).start()
+    inhibitor_loop = asyncio.new_event_loop()
+    inhibitor_thread = threading.Thread(target=inhibitor_loop.run_forever, name="Fake inhibitor", daemon=True)
+    inhibitor_thread.start()
+    inhibitor = FakeInhibitorServer(main_port=args.main_port, alt_port=args.alt_port)
+    asyncio.run_coroutine_threadsafe(inhibitor.start(), inhibitor_loop).result()
+
+    failures = 0
+    samples = []
+    with tempfile.TemporaryDirectory() as config_dir:
+        with open(os.path.join(config_dir, "secrets.json"), "w") as f:
+            json.dump({"Servers": [{"Host": qbt.url, "Username": qbt.state.username,
+                                    "Password": qbt.state.password, "Name": "fake"}]}, f)
+        with open(os.path.join(config_dir, "settings.json"), "w") as f:
+            json.dump({"filter": "filter_all", "sort_by": "added_on", "reverse": True, "check_updates": False,
+                       "inhibitor_host": "127.0.0.1", "inhibitor_ports": [args.main_port, args.alt_port]}, f)
+        rm = FakeRainmeter(options={"ConfigDir": config_dir, "Rows": 4})
+        tracemalloc.start()
+        start = time.perf_counter()
+        for i in range(1, args.reloads + 1):
+            if not reload_cycle(rm, double=i % 10 == 0):
+                failures += 1
+            rm.reset()
+            if i == args.warmup or i % args.sample_every == 0 or i == args.reloads:
+                samples.append(dict(sample(args.settle), reload=i, elapsed=time.perf_counter() - start))
+        tracemalloc.stop()
+
+    asyncio.run_coroutine_threadsafe(inhibitor.stop(), inhibitor_loop).result()
+    inhibitor_loop.call_soon_threadsafe(inhibitor_loop.stop)
+    inhibitor_thread.join()
+    qbt.stop()
+
+    print_table(f"{args.reloads} reloads, {failures} without a first render",
+                ["reload", "elapsed s", "threads", "open fds", "traced KiB"],
+                [[s["reload"], f"{s['elapsed']:.1f}", s["threads"], s["fds"], f"{s['memory'] / 1024:.0f}"]
+                 for s in samples])
+
+    baseline = next(s for s in samples if s["reload"] >= args.warmup)
+    last = samples[-1]
+    problems = []
+    if last["threads"] > baseline["threads"]:
+        problems.append(f"thread count grew from {baseline['threads']} to {last['threads']}")
+    if last["fds"] > baseline["fds"] + args.fd_slack:
+        problems.append(f"open file descriptors grew from {baseline['fds']} to {last['fds']}")
+    growth = last["memory"] - baseline["memory"]
+    if growth > args.memory_slack * 1024:
+        problems.append(f"traced memory grew by {growth / 1024:.0f} KiB")
+    if failures:
+        problems.append(f"{failures} reloads never rendered")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print("OK: threads, file descriptors and memory stayed flat")
+    return 1 if problems else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reloads", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--sample-every", type=int, default=100)
+    parser.add_argument("--torrents", type=int, default=200)
+    parser.add_argument("--main-port", type=int, default=47775)
+    parser.add_argument("--alt-port", type=int, default=47776)
+    parser.add_argument("--settle", type=float, default=0.5, help="Seconds to wait before each sample")
+    parser.add_argument("--fd-slack", type=int, default=2, help="Descriptors allowed to appear after the warm up")
+    parser.add_argument("--memory-slack", type=int, default=1024, help="KiB of traced memory growth allowed")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main_loop(parse_args()))
@@ -0,0 +1,126 @@
+"""Cost of evaluating settings.json rules on every sync delta, against scanning the library for each rule
+
+    python benchmarks/bench_rules.py --sizes 10000 50000 --rules 0 100 500 --ticks 30
+
+Deltas come from the fake WebUI's churn, plus a few torrents changing state every tick so the state and
+completion rules have something to fire on. "full scan ms" checks every rule against every torrent once,
+which is what a tick would cost without the incremental evaluation.
+"""
+import argparse
+import random
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+from fake_qbittorrent import FakeQBittorrentState, _categories
+
+from qbt_server import QBTServer
+from rule_engine import RuleEngine
+
+_rule_states = ["error", "missingFiles", "stalledDL", "pausedDL", "errored", "uploading"]
+
+
+def make_rules(count: int, rng: random.Random) -> list:
+    """A mix of every kind of rule, most of them narrowed by a filter the way a big rule list would be"""
+    rules = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            rules.append({"name": f"done {i}", "event": "completed", "flash": 10,
+                          "filter": f"filter_category:{rng.choice(_categories)}"})
+        elif kind == 1:
+            rules.append({"name": f"state {i}", "event": "state", "state": rng.choice(_rule_states),
+                          "bar_color": "ff00ffff", "filter": f"filter_tag:{rng.choice(['manual', 'archive'])}"})
+        elif kind == 2:
+            rules.append({"name": f"stalled {i}", "event": "stalled", "minutes": rng.choice([10, 30, 60]),
+                          "bar_color": "ffa500ff"})
+        else:
+            rules.append({"name": f"speed {i}", "event": "category_speed", "category": rng.choice(_categories),
+                          "above": rng.randint(1, 200) * 1024 ** 2, "bang": "[!Log \"{category} at {speed}\"]"})
+    return rules
+
+
+def full_scan(engine: RuleEngine, server: QBTServer) -> int:
+    """Check every rule against every torrent, returns how many matched"""
+    matched = 0
+    torrents = list(server.index.torrents.values())
+    for rule in engine.rules:
+        if rule.event == 'completed':
+            matched += sum(1 for torrent in torrents if torrent.progress >= 1)
+        elif rule.event == 'state':
+            matched += sum(1 for torrent in torrents if torrent.state in rule.states)
+        else:
+            speed = sum(torrent.dlspeed + torrent.upspeed for torrent in torrents if torrent.category == rule.category)
+            matched += speed > rule.above
+    return matched
+
+
+def check_speeds(engine: RuleEngine, server: QBTServer):
+    """The incrementally kept category speeds have to equal a recount"""
+    for category in engine.on_category:
+        expected = [0, 0]
+        for torrent in server.index.lookup('category', category):
+            torrent = server.index.torrents[torrent]
+            expected[0] += torrent.dlspeed
+            expected[1] += torrent.upspeed
+        kept = engine.speeds.get(server.name, {}).get(category, [0, 0])
+        assert kept == expected, f"{category}: kept {kept}, recount {expected}"
+
+
+def run(size: int, rule_count: int, ticks: int, churn: float) -> dict:
+    rng = random.Random(2)
+    state = FakeQBittorrentState(size, churn=churn)
+    logger = bench_common.make_logger()
+    engine = RuleEngine(make_rules(rule_count, rng), logger)
+    server = QBTServer("http://fake/", "admin", "adminadmin", logging=logger)
+    if engine.rules:
+        server.observers.append(engine)
+    start = time.perf_counter()
+    server.apply_sync(state.sync_maindata({"rid": 0}))
+    baseline = time.perf_counter() - start
+    hashes = list(state.torrents)
+    apply_times, tick_times = [], []
+    for _ in range(ticks):
+        delta = state.sync_maindata({"rid": server.rid})
+        for torrent_hash in rng.sample(hashes, max(1, size // 1000)):
+            new_state = rng.choice(["error", "missingFiles", "stalledDL", "downloading", "uploading", "pausedDL"])
+            state.torrents[torrent_hash]["state"] = new_state
+            delta["torrents"].setdefault(torrent_hash, {})["state"] = new_state
+        t0 = time.perf_counter()
+        server.apply_sync(delta)
+        t1 = time.perf_counter()
+        engine.tick()
+        engine.take_bangs()
+        t2 = time.perf_counter()
+        apply_times.append(t1 - t0)
+        tick_times.append(t2 - t1)
+    check_speeds(engine, server)
+    start = time.perf_counter()
+    full_scan(engine, server)
+    scan = time.perf_counter() - start
+    return {"baseline": baseline, "apply": summarize(apply_times), "tick": summarize(tick_times), "scan": scan,
+            "fired": engine.fired, "rules": len(engine.rules)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--rules", type=int, nargs="+", default=[0, 100, 500])
+    parser.add_argument("--ticks", type=int, default=30)
+    parser.add_argument("--churn", type=float, default=0.05, help="Fraction of torrents changing every tick")
+    args = parser.parse_args()
+
+    rows = []
+    for size in args.sizes:
+        for rule_count in args.rules:
+            result = run(size, rule_count, args.ticks, args.churn)
+            rows.append([size, result["rules"], f"{result['baseline'] * 1000:.0f}",
+                         f"{result['apply']['p50'] * 1000:.2f}", f"{result['apply']['p99'] * 1000:.2f}",
+                         f"{result['tick']['p50'] * 1000:.3f}", result["fired"], f"{result['scan'] * 1000:.0f}"])
+    print_table(f"Per delta cost with rules, {args.ticks} ticks at {args.churn:.0%} churn",
+                ["torrents", "rules", "full update ms", "apply p50 ms", "apply p99 ms", "tick ms", "fired",
+                 "full scan ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
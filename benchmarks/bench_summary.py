@@ -0,0 +1,92 @@
+"""Cost of keeping the category, tag and tracker summary up to date on every sync delta, against summing the library
+
+    python benchmarks/bench_summary.py --sizes 10000 50000 --ticks 30
+
+Deltas come from the fake WebUI's churn, plus a few torrents every tick that move category, change tags or
+tracker, are added or are removed, so every path of the incremental upkeep runs. After every delta the kept
+totals are checked against a full recompute and the run fails on the first difference. "recompute ms" is what
+building the totals from scratch costs, which is what every refresh would pay without the incremental upkeep.
+"""
+import argparse
+import random
+import time
+
+import bench_common
+from bench_common import summarize, print_table
+from fake_qbittorrent import FakeQBittorrentState, make_torrent, _categories, _tags, _trackers
+
+from qbt_server import QBTServer
+from torrent_summary import TorrentSummary, recompute, kinds
+
+
+def reshuffle(state: FakeQBittorrentState, delta: dict, rng: random.Random, count: int):
+    """Move torrents between groups, add some and remove others, in the state and in the delta"""
+    for torrent_hash in rng.sample(state.hashes, count):
+        torrent = state.torrents[torrent_hash]
+        field, values = rng.choice([("category", _categories), ("tags", _tags), ("tracker", _trackers)])
+        torrent[field] = rng.choice(values)
+        delta["torrents"].setdefault(torrent_hash, {})[field] = torrent[field]
+    removed = rng.sample(state.hashes, count)
+    for torrent_hash in removed:
+        del state.torrents[torrent_hash]
+        delta["torrents"].pop(torrent_hash, None)
+    state.hashes = [torrent_hash for torrent_hash in state.hashes if torrent_hash in state.torrents]
+    delta["torrents_removed"] = removed
+    for _ in range(count):
+        torrent = make_torrent(rng, rng.randrange(10 ** 9))
+        state.torrents[torrent["hash"]] = torrent
+        state.hashes.append(torrent["hash"])
+        delta["torrents"][torrent["hash"]] = {k: v for k, v in torrent.items() if k != "hash"}
+
+
+def run(size: int, ticks: int, churn: float, summary_on: bool) -> dict:
+    rng = random.Random(3)
+    state = FakeQBittorrentState(size, churn=churn)
+    server = QBTServer("http://fake/", "admin", "adminadmin", logging=bench_common.make_logger())
+    summary = TorrentSummary()
+    if summary_on:
+        server.observers.append(summary)
+    server.apply_sync(state.sync_maindata({"rid": 0}))
+    apply_times, render_times = [], []
+    for _ in range(ticks):
+        delta = state.sync_maindata({"rid": server.rid})
+        reshuffle(state, delta, rng, max(1, size // 1000))
+        start = time.perf_counter()
+        server.apply_sync(delta)
+        apply_times.append(time.perf_counter() - start)
+        if summary_on:
+            mismatches = summary.verify([server])
+            assert not mismatches, f"{len(mismatches)} groups differ from a recompute, first {mismatches[0]}"
+            summary.kind = kinds[len(render_times) % len(kinds)]
+            start = time.perf_counter()
+            summary.rendered()
+            render_times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    groups = recompute(server.index.torrents.values())
+    scan = time.perf_counter() - start
+    return {"apply": summarize(apply_times), "render": summarize(render_times) if render_times else None,
+            "scan": scan, "groups": len(groups)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--ticks", type=int, default=30)
+    parser.add_argument("--churn", type=float, default=0.05, help="Fraction of torrents changing every tick")
+    args = parser.parse_args()
+
+    rows = []
+    for size in args.sizes:
+        without = run(size, args.ticks, args.churn, False)
+        with_summary = run(size, args.ticks, args.churn, True)
+        rows.append([size, with_summary["groups"], f"{without['apply']['p50'] * 1000:.2f}",
+                     f"{with_summary['apply']['p50'] * 1000:.2f}", f"{with_summary['apply']['p99'] * 1000:.2f}",
+                     f"{with_summary['render']['p50'] * 1000:.3f}", f"{with_summary['scan'] * 1000:.0f}"])
+    print_table(f"Per delta cost of the summary, {args.ticks} ticks at {args.churn:.0%} churn, totals checked "
+                f"against a recompute after every delta",
+                ["torrents", "groups", "apply ms without", "apply p50 ms", "apply p99 ms", "render ms",
+                 "recompute ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
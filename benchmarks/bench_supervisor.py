@@ -0,0 +1,129 @@
+"""Crashes a supervised task and blocks the event loop, fails unless the supervisor notices and recovers
+
+    python benchmarks/bench_supervisor.py --crashes 4 --block 1.0
+
+The task raises on its first --crashes starts and then keeps running. Each restart has to come after the
+backoff, base_delay doubled for every crash in a row, and not much later. Then a callback blocks the loop
+thread for --block seconds: the watchdog has to report one stall with the blocking call in its stack, and
+the periodic health line has to carry about that much lag as the worst the probe measured.
+"""
+import argparse
+import asyncio
+import logging
+import re
+import sys
+import time
+
+import bench_common
+from bench_common import print_table
+
+from supervisor import Supervisor
+
+
+class Recorder(logging.Handler):
+    """Keeps every record the supervisor logs"""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.messages = []
+
+    def emit(self, record: logging.LogRecord):
+        self.messages.append((record.levelno, record.getMessage()))
+
+    def count(self, level: int, text: str) -> int:
+        return sum(1 for levelno, message in self.messages if levelno == level and text in message)
+
+
+def block_loop(seconds: float):
+    time.sleep(seconds)  # Stands in for blocking work done on the loop thread by mistake
+
+
+async def run(args, supervisor: Supervisor) -> dict:
+    starts, crashes = [], []
+
+    async def flaky():
+        starts.append(time.monotonic())
+        await asyncio.sleep(0.01)
+        if len(crashes) < args.crashes:
+            crashes.append(time.monotonic())
+            raise RuntimeError(f"crash {len(crashes)}")
+        await asyncio.Event().wait()
+
+    supervisor.start_monitor()
+    supervised = supervisor.supervise("flaky", flaky)
+    deadline = time.monotonic() + args.base_delay * 2 ** args.crashes + 5.0
+    while len(starts) <= args.crashes and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(args.probe_interval * 4)
+    asyncio.get_running_loop().call_soon(block_loop, args.block)
+    # The health line after the block carries the worst lag since the one before
+    await asyncio.sleep(args.report_every + args.probe_interval * 4)
+    gaps = [start - crash for crash, start in zip(crashes, starts[1:])]
+    return {"starts": len(starts), "gaps": gaps, "state": supervised.state, "restarts": supervised.restarts}
+
+
+def main_loop(args) -> int:
+    log = bench_common.make_logger(logging.INFO)
+    recorder = Recorder()
+    log.addHandler(recorder)
+    event_loop = asyncio.new_event_loop()
+    supervisor = Supervisor(event_loop, log, base_delay=args.base_delay, max_delay=args.base_delay * 2 ** 10,
+                            probe_interval=args.probe_interval, stall_after=args.block / 2,
+                            report_every=args.report_every)
+    try:
+        result = event_loop.run_until_complete(run(args, supervisor))
+    finally:
+        supervisor.cancel_all()
+        event_loop.run_until_complete(asyncio.sleep(0.05))
+        event_loop.close()
+    health = [message for level, message in recorder.messages if message.startswith("Health: ")]
+    result["max_lag"] = max((int(lag) / 1000 for line in health for lag in re.findall(r"max (\d+)ms", line)),
+                            default=0.0)
+
+    expected = [args.base_delay * 2 ** i for i in range(args.crashes)]
+    rows = [[f"restart {i + 1}", f"{want * 1000:.0f}", f"{gap * 1000:.0f}" if gap is not None else "-"]
+            for i, (want, gap) in enumerate(zip(expected, result["gaps"] + [None] * args.crashes))]
+    rows.append(["loop lag", f"{args.block * 1000:.0f}", f"{result['max_lag'] * 1000:.0f}"])
+    print_table(f"{args.crashes} crashes, then the loop blocked for {args.block:.1f}s",
+                ["", "expected ms", "observed ms"], rows)
+
+    problems = []
+    if result["restarts"] != args.crashes or result["state"] != "running":
+        problems.append(f"{result['restarts']} restarts and the task {result['state']}, expected {args.crashes} "
+                        f"and running")
+    for i, (want, gap) in enumerate(zip(expected, result["gaps"])):
+        if not want <= gap <= want + args.slack:
+            problems.append(f"restart {i + 1} came {gap * 1000:.0f}ms after its crash, expected {want * 1000:.0f}ms")
+    if recorder.count(logging.ERROR, "Task flaky crashed") != args.crashes:
+        problems.append("not every crash was logged")
+    if recorder.count(logging.WARNING, "Restarting flaky") != args.crashes:
+        problems.append("not every restart was logged with its delay")
+    if not health:
+        problems.append("no health line was logged")
+    elif not args.block * 0.8 <= result["max_lag"]:
+        problems.append(f"the health lines report {result['max_lag'] * 1000:.0f}ms of lag for a {args.block:.1f}s "
+                        f"block")
+    if supervisor.stalls != 1 or "block_loop" not in (supervisor.last_stall_stack or ""):
+        problems.append(f"{supervisor.stalls} stalls reported, expected one naming block_loop")
+    if not recorder.count(logging.WARNING, "Event loop blocked"):
+        problems.append("the stall was never logged")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print("OK: every crash was restarted after its backoff, the block was measured and reported")
+    return 1 if problems else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--crashes", type=int, default=4)
+    parser.add_argument("--base-delay", type=float, default=0.1, help="Backoff after the first crash, seconds")
+    parser.add_argument("--block", type=float, default=1.0, help="Seconds the loop thread is blocked for")
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    parser.add_argument("--report-every", type=float, default=0.5, help="Seconds between health lines")
+    parser.add_argument("--slack", type=float, default=0.1, help="Seconds a restart may come after its backoff")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main_loop(parse_args()))
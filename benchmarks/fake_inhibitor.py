@@ -0,0 +1,209 @@
+import asyncio
+import json
+import time
+import uuid
+
+import bench_common  # noqa: F401 puts the plugin's Scripts folder on the path
+import helpers
+
+FRAME_END = b"\n\r"
+
+
+class FakeInhibitorServer:
+    """Local stand-in for the QBT inhibitor API server, speaks the \\n\\r framed JSON protocol InhibitorPlugin uses
+
+    Besides answering handshake/refresh/command messages it can misbehave on demand: bursts of updates,
+    frames split across writes, garbage JSON, corrupt frames, half-closed sockets, restarts answered with
+    renew_conn and dropping the main port so the plugin has to fail over to the alternate one. codecs are the encodings it agrees to when a handshake offers
+    them, () answers like an inhibitor server from before the compact encoding.
+    """
+
+    def __init__(self, host="127.0.0.1", main_port=47675, alt_port=47676, codecs=(helpers.compact,)):
+        self.host = host
+        self.main_port = main_port
+        self.alt_port = alt_port
+        self.codecs = tuple(codecs)
+        self.servers = {}
+        self.clients = []
+        self.state = {
+            "inhibiting": False,
+            "inhibited_by": [],
+            "qbt_connection": True,
+            "plex_connection": True,
+            "net_connection": True,
+            "message": None,
+            "version": "V:fake",
+        }
+        self.seq = 0
+        self.sent_at = {}  # message text -> perf_counter when it was written
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_received = 0
+        self.handshakes = 0
+        self.renewals = 0  # Handshakes answered with renew_conn after restart()
+        self.renewing = False
+        self.last_token = None
+        self.last_handshake = None
+        self.commands = []
+
+    async def start(self, main=True, alt=True):
+        if main:
+            await self.open_port(self.main_port)
+        if alt:
+            await self.open_port(self.alt_port)
+        return self
+
+    async def open_port(self, port: int):
+        if port not in self.servers:
+            self.servers[port] = await asyncio.start_server(self._handle, self.host, port)
+
+    async def close_port(self, port: int, drop_clients=True):
+        """Stop listening on a port, optionally kicking everyone connected through it"""
+        server = self.servers.pop(port, None)
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+        if drop_clients:
+            for client in [c for c in self.clients if c["port"] == port]:
+                client["writer"].close()
+
+    async def stop(self):
+        for port in list(self.servers):
+            await self.close_port(port)
+        for client in list(self.clients):
+            client["writer"].close()
+        # Let the connection handlers see the close before the loop goes away
+        while self.clients:
+            await asyncio.sleep(0.01)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = {"reader": reader, "writer": writer, "port": writer.get_extra_info("sockname")[1], "token": None,
+                  "half_closed": False, "codec": "json"}
+        self.clients.append(client)
+        try:
+            while True:
+                frame = await helpers.read_frame(reader, client["codec"])
+                self.frames_received += 1
+                try:
+                    msg = self.decode(frame, client["codec"])
+                except Exception:
+                    continue
+                await self._dispatch(client, msg)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            if client in self.clients:
+                self.clients.remove(client)
+            writer.close()
+
+    async def _dispatch(self, client: dict, msg: dict):
+        msg_type = msg.get("msg_type")
+        if msg_type == "handshake":
+            self.handshakes += 1
+            self.last_handshake = time.perf_counter()
+            # After a restart the server picks the last session up again and answers with renew_conn
+            msg_type = "renew_conn" if self.renewing and self.last_token is not None else "new_conn"
+            self.renewals += msg_type == "renew_conn"
+            client["token"] = self.last_token if msg_type == "renew_conn" else uuid.uuid4().hex
+            self.last_token = client["token"]
+            codec = next((codec for codec in msg.get("codecs") or () if codec in self.codecs), None)
+            if codec is None:
+                await self._send(client, {"msg_type": msg_type, "token": client["token"]})
+            else:
+                await self._send(client, {"msg_type": msg_type, "token": client["token"], "codec": codec})
+                client["codec"] = codec
+            await self._send(client, self.state_update())
+        elif msg_type == "refresh":
+            await self._send(client, self.state_update())
+        elif msg_type == "command":
+            self.commands.append(msg)
+            self.state["inhibiting"] = bool(msg.get("inhibit"))
+            self.state["inhibited_by"] = ["User"] if msg.get("inhibit") else []
+            await self.broadcast(self.state_update())
+        else:
+            if msg_type == "sys_command":
+                self.commands.append(msg)
+            await self._send(client, {"msg_type": "ack"})
+
+    def state_update(self, **changes) -> dict:
+        self.state.update(changes)
+        return {"msg_type": "state_update", **self.state}
+
+    def encode(self, msg: dict, codec: str = "json") -> bytes:
+        if codec == helpers.compact:
+            return helpers.encode_compact(msg)
+        return json.dumps(msg).encode("utf-8") + FRAME_END
+
+    @staticmethod
+    def decode(frame: bytes, codec: str = "json") -> dict:
+        if codec != helpers.compact or frame[:1] == b"{":
+            return json.loads(frame[:-len(FRAME_END)])
+        msg = helpers.decode(frame, codec)
+        return msg.to_dict() if isinstance(msg, helpers.Message) else vars(msg)
+
+    async def _send(self, client: dict, msg, chunk_size: int = None, chunk_delay: float = 0.0):
+        data = msg if isinstance(msg, bytes) else self.encode(msg, client["codec"])
+        writer = client["writer"]
+        if writer.is_closing() or client["half_closed"]:
+            return
+        if chunk_size is None:
+            writer.write(data)
+        else:
+            for i in range(0, len(data), chunk_size):
+                writer.write(data[i:i + chunk_size])
+                await writer.drain()
+                await asyncio.sleep(chunk_delay)
+        await writer.drain()
+        self.frames_sent += 1
+        self.bytes_sent += len(data)
+
+    async def broadcast(self, msg, **kwargs):
+        for client in list(self.clients):
+            try:
+                await self._send(client, msg, **kwargs)
+            except (ConnectionError, OSError):
+                pass
+
+    async def send_change(self, **kwargs) -> str:
+        """Push a state_update with a unique message so the plugin sees a state change, returns that message"""
+        self.seq += 1
+        text = f"soak {self.seq}"
+        self.sent_at[text] = time.perf_counter()
+        await self.broadcast(self.state_update(message=text), **kwargs)
+        return text
+
+    async def burst(self, count: int):
+        """Send a run of state changes back to back without yielding between them"""
+        for _ in range(count):
+            await self.send_change()
+
+    async def split_frame(self, chunk_size=3, chunk_delay=0.01) -> str:
+        """Deliver a state change a few bytes at a time"""
+        return await self.send_change(chunk_size=chunk_size, chunk_delay=chunk_delay)
+
+    async def garbage(self):
+        """A frame that is correctly terminated but is not JSON"""
+        await self.broadcast(b"{\"msg_type\": \"state_upd" + FRAME_END)
+
+    async def corrupt(self):
+        """A frame that doesn't start with "{", read as a compact header it claims a 4 GiB payload"""
+        await self.broadcast(b"\xfe\xff\xff\xff\xff" + FRAME_END)
+
+    async def half_close(self):
+        """Shut down the write side of every connection while leaving the read side open"""
+        for client in list(self.clients):
+            if client["writer"].can_write_eof() and not client["half_closed"]:
+                client["half_closed"] = True
+                client["writer"].write_eof()
+
+    async def restart(self):
+        """Drop every connection and answer the handshakes that follow with renew_conn instead of new_conn"""
+        self.renewing = True
+        await self.drop_clients()
+
+    async def drop_clients(self):
+        for client in list(self.clients):
+            client["writer"].close()
+
+    async def new_version(self, newest="V:fake-2", current="V:fake"):
+        await self.broadcast({"msg_type": "new_version", "new_version": newest, "old_version": current})
@@ -0,0 +1,373 @@
+import gzip
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+_states = ["downloading", "stalledDL", "uploading", "stalledUP", "pausedUP", "pausedDL", "queuedDL", "metaDL",
+           "checkingUP", "missingFiles", "error"]
+_categories = ["", "movies", "tv", "music", "linux-isos", "books"]
+_tags = ["", "better_rss", "manual", "better_rss,manual", "archive"]
+_trackers = ["http://tracker.example.org/announce", "udp://open.example.net:1337/announce",
+             "https://private.example.com/announce/abc", ""]
+
+
+def make_torrent(rng: random.Random, index: int) -> dict:
+    """Build a synthetic torrent with the same keys torrents/info returns"""
+    size = rng.randint(50 * 1024 ** 2, 80 * 1024 ** 3)
+    progress = rng.choice([1.0, 1.0, 1.0, rng.random()])
+    downloaded = int(size * progress)
+    state = rng.choice(_states)
+    downloading = state in ("downloading", "metaDL")
+    torrent = {
+        "hash": uuid.UUID(int=rng.getrandbits(128)).hex + f"{index:08x}",
+        "name": f"Synthetic.Torrent.{index:06d}.{rng.choice(['1080p', '2160p', 'FLAC', 'ISO', 'EPUB'])}",
+        "content_path": f"/mnt/qnap/Shared/Downloads/Synthetic.Torrent.{index:06d}",
+        "save_path": "/mnt/qnap/Shared/Downloads/",
+        "state": state,
+        "category": rng.choice(_categories),
+        "tags": rng.choice(_tags),
+        "tracker": rng.choice(_trackers),
+        "size": size,
+        "total_size": size,
+        "progress": progress,
+        "downloaded": downloaded,
+        "uploaded": int(downloaded * rng.random() * 3),
+        "amount_left": size - downloaded,
+        "dlspeed": rng.randint(0, 20 * 1024 ** 2) if downloading else 0,
+        "upspeed": rng.randint(0, 5 * 1024 ** 2) if rng.random() < 0.3 else 0,
+        "num_complete": rng.randint(0, 500),
+        "num_incomplete": rng.randint(0, 200),
+        "num_seeds": rng.randint(0, 50),
+        "num_leechs": rng.randint(0, 50),
+        "eta": rng.randint(0, 86400) if downloading else 8640000,
+        "ratio": rng.random() * 5,
+        "added_on": 1600000000 + index * 60,
+        "completion_on": 1600000000 + index * 60 + 3600,
+        "last_activity": 1700000000,
+        "priority": 0,
+        "seq_dl": False,
+        "f_l_piece_prio": False,
+        "force_start": False,
+        "super_seeding": False,
+        "auto_tmm": False,
+        "dl_limit": -1,
+        "up_limit": -1,
+        "max_ratio": -1,
+        "max_seeding_time": -1,
+        "ratio_limit": -2,
+        "seeding_time_limit": -2,
+        "seen_complete": 1700000000,
+        "time_active": rng.randint(0, 10 ** 7),
+        "seeding_time": rng.randint(0, 10 ** 7),
+        "availability": -1,
+        "magnet_uri": f"magnet:?xt=urn:btih:{index:040x}",
+        "downloaded_session": 0,
+        "uploaded_session": 0,
+        "completed": downloaded,
+        "trackers_count": 1,
+    }
+    return torrent
+
+
+class FakeQBittorrentState:
+    """The torrent library served by the fake WebUI, mutated a little on every sync/maindata call"""
+
+    def __init__(self, torrent_count: int, churn: float = 0.05, seed: int = 1, username="admin",
+                 password="adminadmin", delay: float = 0.0, files_per_torrent: int = 20,
+                 peers_per_torrent: int = 50, compress: bool = False):
+        self.rng = random.Random(seed)
+        self.files_per_torrent = files_per_torrent
+        self.peers_per_torrent = peers_per_torrent
+        self.peer_tables = {}  # hash -> (rid, {"ip:port": peer}) for sync/torrentPeers
+        self.actions = []  # (endpoint, number of hashes) for every torrent action request
+        self.action_states = {}  # hash -> state an action put it in, reported from the next sync on
+        self.fail_actions = False  # Answer torrent actions with a 500
+        self.ignore_actions = False  # Accept torrent actions without changing anything
+        self.delay = delay  # Seconds added to every data request, to play a slow or distant server
+        self.compress = compress  # gzip JSON bodies for clients accepting it, like qBittorrent does
+        self.username = username
+        self.password = password
+        self.churn = churn
+        self.limits = {"dl_rate_limit": 0, "up_rate_limit": 0, "use_alt_speed_limits": False}
+        self.torrents = {}
+        for i in range(torrent_count):
+            torrent = make_torrent(self.rng, i)
+            self.torrents[torrent["hash"]] = torrent
+        self.hashes = list(self.torrents.keys())
+        self.rid = 0
+        self.sessions = set()
+        self.lock = threading.RLock()
+        self.request_counts = {}
+        self.bytes_sent = 0
+
+    def server_state(self) -> dict:
+        return {
+            "dl_info_speed": sum(t["dlspeed"] for t in self.torrents.values()),
+            "up_info_speed": sum(t["upspeed"] for t in self.torrents.values()),
+            "free_space_on_disk": 4 * 1024 ** 4,
+            "total_peer_connections": 312,
+            "connection_status": "connected",
+            **self.limits,
+        }
+
+    def transfer(self, endpoint: str, params: dict):
+        """transfer/setDownloadLimit, setUploadLimit and toggleSpeedLimitsMode"""
+        if endpoint == "transfer/toggleSpeedLimitsMode":
+            self.limits["use_alt_speed_limits"] = not self.limits["use_alt_speed_limits"]
+        else:
+            field = "dl_rate_limit" if endpoint == "transfer/setDownloadLimit" else "up_rate_limit"
+            self.limits[field] = max(0, int(params.get("limit", 0)))
+
+    def tick(self) -> dict:
+        """Mutate a fraction of the library, returns the changed fields per hash"""
+        changed = {}
+        if not self.hashes:
+            return changed
+        for _ in range(max(1, int(len(self.hashes) * self.churn))):
+            torrent = self.torrents[self.rng.choice(self.hashes)]
+            fields = {}
+            if torrent["progress"] < 1.0:
+                step = min(torrent["amount_left"], self.rng.randint(0, 40 * 1024 ** 2))
+                torrent["downloaded"] += step
+                torrent["amount_left"] -= step
+                torrent["progress"] = torrent["downloaded"] / torrent["size"]
+                fields.update(downloaded=torrent["downloaded"], amount_left=torrent["amount_left"],
+                              progress=torrent["progress"])
+            torrent["dlspeed"] = self.rng.randint(0, 20 * 1024 ** 2) if torrent["progress"] < 1.0 else 0
+            torrent["upspeed"] = self.rng.randint(0, 5 * 1024 ** 2)
+            torrent["num_leechs"] = self.rng.randint(0, 50)
+            fields.update(dlspeed=torrent["dlspeed"], upspeed=torrent["upspeed"], num_leechs=torrent["num_leechs"])
+            changed.setdefault(torrent["hash"], {}).update(fields)
+        return changed
+
+    def torrent_action(self, endpoint: str, hashes: list):
+        """torrents/pause, resume, recheck or reannounce, the new states show up in the next sync"""
+        self.actions.append((endpoint, len(hashes)))
+        if self.ignore_actions:
+            return
+        for torrent_hash in hashes:
+            torrent = self.torrents.get(torrent_hash)
+            if torrent is None:
+                continue
+            complete = torrent["progress"] >= 1.0
+            if endpoint == "torrents/pause":
+                self.action_states[torrent_hash] = "pausedUP" if complete else "pausedDL"
+            elif endpoint == "torrents/resume":
+                self.action_states[torrent_hash] = "stalledUP" if complete else "downloading"
+            elif endpoint == "torrents/recheck":
+                self.action_states[torrent_hash] = "checkingUP" if complete else "checkingDL"
+
+    def _apply_actions(self, changed: dict):
+        for torrent_hash, state in self.action_states.items():
+            if self.torrents[torrent_hash]["state"] != state:
+                self.torrents[torrent_hash]["state"] = state
+                changed.setdefault(torrent_hash, {})["state"] = state
+        self.action_states = {}
+
+    def torrents_info(self, params: dict) -> list:
+        torrents = list(self.torrents.values())
+        torrent_filter = params.get("filter", "all")
+        if torrent_filter == "active":
+            torrents = [t for t in torrents if t["dlspeed"] > 0 or t["upspeed"] > 0]
+        elif torrent_filter not in ("all", ""):
+            torrents = [t for t in torrents if t["state"] == torrent_filter]
+        if "category" in params:
+            torrents = [t for t in torrents if t["category"] == params["category"]]
+        if "hashes" in params:
+            wanted = set(params["hashes"].split("|"))
+            torrents = [t for t in torrents if t["hash"] in wanted]
+        if "sort" in params:
+            torrents.sort(key=lambda t: t[params["sort"]], reverse=params.get("reverse", "false").lower() == "true")
+        offset = int(params.get("offset", 0))
+        if offset < 0:
+            offset = max(0, len(torrents) + offset)
+        limit = int(params.get("limit", 0))
+        return torrents[offset:offset + limit] if limit > 0 else torrents[offset:]
+
+    def sync_maindata(self, params: dict) -> dict:
+        client_rid = int(params.get("rid", 0))
+        if client_rid == 0 or client_rid != self.rid:
+            self._apply_actions(self.tick())
+            self.rid += 1
+            torrents = {h: {k: v for k, v in t.items() if k != "hash"} for h, t in self.torrents.items()}
+            return {"rid": self.rid, "full_update": True, "torrents": torrents, "server_state": self.server_state(),
+                    "categories": {c: {"name": c, "savePath": ""} for c in _categories if c},
+                    "tags": [t for t in _tags if t and "," not in t]}
+        changed = self.tick()
+        self._apply_actions(changed)
+        self.rid += 1
+        return {"rid": self.rid, "torrents": changed, "server_state": self.server_state()}
+
+
+    def torrent_files(self, torrent_hash: str) -> list:
+        torrent = self.torrents[torrent_hash]
+        count = self.files_per_torrent
+        return [{"index": i, "name": f"{torrent['name']}/file.{i:05d}.bin", "size": torrent["size"] // count,
+                 "progress": torrent["progress"], "priority": 1, "is_seed": torrent["progress"] >= 1}
+                for i in range(count)]
+
+    def torrent_trackers(self, torrent_hash: str) -> list:
+        pseudo = [{"url": f"** [{name}] **", "status": 2, "num_peers": 0, "num_seeds": 0} for name in
+                  ("DHT", "PeX", "LSD")]
+        return pseudo + [{"url": url, "status": 2, "num_peers": 10, "num_seeds": 20, "msg": ""}
+                         for url in _trackers if url]
+
+    def sync_peers(self, torrent_hash: str, params: dict) -> dict:
+        """Peers as sync/torrentPeers deltas, a tenth of them change speed between calls"""
+        client_rid = int(params.get("rid", 0))
+        rid, peers = self.peer_tables.get(torrent_hash, (0, None))
+        if peers is None:
+            peers = {f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}:6881": {
+                "client": "qBittorrent/4.5.2", "progress": self.rng.random(), "dl_speed": self.rng.randint(0, 10 ** 6),
+                "up_speed": self.rng.randint(0, 10 ** 5), "country_code": "nl"} for i in range(self.peers_per_torrent)}
+        if client_rid == 0 or client_rid != rid:
+            rid += 1
+            self.peer_tables[torrent_hash] = (rid, peers)
+            return {"rid": rid, "full_update": True, "peers": peers, "show_flags": True}
+        changed = {}
+        for peer_id in self.rng.sample(list(peers), max(1, len(peers) // 10)):
+            peers[peer_id]["dl_speed"] = self.rng.randint(0, 10 ** 6)
+            changed[peer_id] = {"dl_speed": peers[peer_id]["dl_speed"]}
+        rid += 1
+        self.peer_tables[torrent_hash] = (rid, peers)
+        return {"rid": rid, "peers": changed}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> FakeQBittorrentState:
+        return self.server.state
+
+    def _reply(self, status: int, body, content_type="application/json", headers=None):
+        if not isinstance(body, (bytes, str)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        headers = dict(headers or {})
+        if self.state.compress and "gzip" in self.headers.get("Accept-Encoding", "") and \
+                content_type == "application/json":
+            body = gzip.compress(body, 6)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.state.lock:
+            self.state.bytes_sent += len(body)
+
+    def _authenticated(self) -> bool:
+        cookie = self.headers.get("Cookie", "")
+        for part in cookie.split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "SID" and value in self.state.sessions:
+                return True
+        return False
+
+    def _params(self, path: str) -> dict:
+        params = {k: v[-1] for k, v in parse_qs(urlparse(path).query).items()}
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        if length:
+            body = self.rfile.read(length).decode("utf-8")
+            params.update({k: v[-1] for k, v in parse_qs(body).items()})
+        return params
+
+    def _route(self):
+        path = urlparse(self.path).path
+        params = self._params(self.path)
+        endpoint = path[len("/api/v2/"):] if path.startswith("/api/v2/") else path
+        with self.state.lock:
+            self.state.request_counts[endpoint] = self.state.request_counts.get(endpoint, 0) + 1
+
+        if endpoint == "auth/login":
+            if params.get("username") == self.state.username and params.get("password") == self.state.password:
+                sid = uuid.uuid4().hex
+                with self.state.lock:
+                    self.state.sessions.add(sid)
+                return self._reply(200, "Ok.", "text/plain", {"Set-Cookie": f"SID={sid}; HttpOnly; path=/"})
+            return self._reply(200, "Fails.", "text/plain")
+        if not self._authenticated():
+            return self._reply(403, "Forbidden", "text/plain")
+        if self.state.delay:
+            time.sleep(self.state.delay)
+
+        with self.state.lock:
+            if endpoint == "app/preferences":
+                return self._reply(200, {"save_path": "/mnt/qnap/Shared/Downloads/"})
+            if endpoint == "app/version":
+                return self._reply(200, "v4.5.2", "text/plain")
+            if endpoint == "app/webapiVersion":
+                return self._reply(200, "2.6.1", "text/plain")
+            if endpoint == "torrents/info":
+                return self._reply(200, self.state.torrents_info(params))
+            if endpoint == "sync/maindata":
+                return self._reply(200, self.state.sync_maindata(params))
+            if endpoint in ("torrents/pause", "torrents/resume", "torrents/recheck", "torrents/reannounce"):
+                if self.state.fail_actions:
+                    return self._reply(500, "Internal Server Error", "text/plain")
+                self.state.torrent_action(endpoint, [h for h in params.get("hashes", "").split("|") if h])
+                return self._reply(200, "", "text/plain")
+            if endpoint in ("transfer/setDownloadLimit", "transfer/setUploadLimit", "transfer/toggleSpeedLimitsMode"):
+                self.state.transfer(endpoint, params)
+                return self._reply(200, "", "text/plain")
+            if endpoint in ("sync/torrentPeers", "torrents/files", "torrents/trackers"):
+                torrent_hash = params.get("hash", "")
+                if torrent_hash not in self.state.torrents:
+                    return self._reply(404, "Torrent hash was not found", "text/plain")
+                if endpoint == "sync/torrentPeers":
+                    return self._reply(200, self.state.sync_peers(torrent_hash, params))
+                if endpoint == "torrents/files":
+                    return self._reply(200, self.state.torrent_files(torrent_hash))
+                return self._reply(200, self.state.torrent_trackers(torrent_hash))
+        return self._reply(404, "Not Found", "text/plain")
+
+    def do_GET(self):
+        self._route()
+
+    def do_POST(self):
+        self._route()
+
+
+class FakeQBittorrentServer:
+    """A local stand-in for the qBittorrent WebUI, runs on a background thread"""
+
+    def __init__(self, torrent_count: int = 100, host="127.0.0.1", port=0, **kwargs):
+        self.state = FakeQBittorrentState(torrent_count, **kwargs)
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="FakeQBittorrent", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
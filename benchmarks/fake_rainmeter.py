@@ -0,0 +1,48 @@
+import threading
+
+
+class FakeRainmeter:
+    """Stand-in for the rm object Rainmeter's Python plugin hands to the script, records everything it is sent"""
+
+    LOG_ERROR = 1
+    LOG_WARNING = 2
+    LOG_NOTICE = 3
+    LOG_DEBUG = 4
+
+    def __init__(self, options=None, echo_logs=False):
+        self.options = options if options is not None else {}
+        self.echo_logs = echo_logs
+        self.executed = []
+        self.logs = []
+        self.execute_calls = 0
+        self.execute_bytes = 0
+        self.lock = threading.Lock()
+
+    def RmExecute(self, bang: str) -> None:
+        with self.lock:
+            self.execute_calls += 1
+            self.execute_bytes += len(bang.encode('utf-8'))
+            self.executed.append(bang)
+
+    def RmLog(self, level: int, message: str) -> None:
+        with self.lock:
+            self.logs.append((level, message))
+        if self.echo_logs:
+            print(f"[RmLog {level}] {message}")
+
+    def RmReadString(self, option: str, default: str = "", replace_measures: bool = True) -> str:
+        return str(self.options.get(option, default))
+
+    def RmReadInt(self, option: str, default: int = 0) -> int:
+        return int(self.options.get(option, default))
+
+    def RmReadDouble(self, option: str, default: float = 0.0) -> float:
+        return float(self.options.get(option, default))
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self.lock:
+            self.executed = []
+            self.logs = []
+            self.execute_calls = 0
+            self.execute_bytes = 0
@@ -0,0 +1,356 @@
+"""Play a traffic capture (traffic_recorder.py) back into RainMeterInterface and InhibitorPlugin through local stand-ins
+
+    python benchmarks/replay.py Logs/traffic.jsonl.gz --speed 10 --profile replay.prof
+    python benchmarks/replay.py --synthesize 20 --torrents 5000 --speed 0
+
+Every recorded sync/maindata response is handed to a stand-in WebUI and the interface refreshes once to pick it
+up, so the local copy goes through exactly the deltas the real server sent. Other endpoints answer with their
+recorded responses in order. Recorded bangs are executed at their time and inhibitor frames are pushed to the
+plugin the way the inhibitor pushed them. --speed 1 keeps the capture's timing, 10 plays it ten times as fast
+and 0 as fast as the interface keeps up. --synthesize first records a capture of its own against
+fake_qbittorrent and fake_inhibitor, for trying this out without a production capture.
+"""
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+import bench_common
+from bench_common import summarize, print_table
+from fake_inhibitor import FakeInhibitorServer, FRAME_END
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import rm_interface
+import traffic_recorder
+
+
+class ReplayState:
+    """The recorded responses of one server, sync/maindata ones are released by the driver one refresh at a time"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.released = []  # sync/maindata responses the next polls get, oldest first
+        self.rid = 0
+        self.responses = {}  # endpoint -> recorded (status, body) in order
+        self.served = {}  # endpoint -> how many of its responses were served
+
+    def add(self, record: dict):
+        self.responses.setdefault(record["endpoint"], []).append((record["status"], record["body"]))
+
+    def respond(self, endpoint: str):
+        with self.lock:
+            if endpoint == "sync/maindata":
+                if self.released:
+                    status, body = self.released.pop(0)
+                    try:
+                        self.rid = json.loads(body).get("rid", self.rid)
+                    except ValueError:
+                        pass
+                    return status, body
+                # Asked more often than it was during the capture, nothing changed in between
+                return 200, json.dumps({"rid": self.rid})
+            responses = self.responses.get(endpoint)
+            if not responses:
+                return 404, "Not Found"
+            index = self.served.get(endpoint, 0)
+            self.served[endpoint] = index + 1
+            return responses[min(index, len(responses) - 1)]  # Asked more often than recorded, repeat the last
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: str, headers=None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        if length:
+            self.rfile.read(length)
+        path = urlparse(self.path).path
+        endpoint = path[len("/api/v2/"):] if path.startswith("/api/v2/") else path
+        state = self.server.state
+        if endpoint == "auth/login":
+            return self._reply(200, "Ok.", {"Set-Cookie": f"SID={uuid.uuid4().hex}; HttpOnly; path=/"})
+        if endpoint == "app/preferences":
+            return self._reply(200, "{}")
+        status, body = state.respond(endpoint)
+        self._reply(status, body)
+
+    def do_GET(self):
+        self._route()
+
+    def do_POST(self):
+        self._route()
+
+
+class ReplayWebUI:
+    """Serves one recorded server on a background thread"""
+
+    def __init__(self, state: ReplayState):
+        self.state = state
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = state
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f"Replay {state.name}", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+class ReplayInhibitor:
+    """Answers handshakes with the recorded answers and pushes the recorded frames when the driver says so"""
+
+    def __init__(self, handshakes: list):
+        self.handshakes = list(handshakes)  # Recorded new_conn/renew_conn frames, the last one answers any extra
+        self.server = None
+        self.writers = []
+        self.port = None
+
+    async def start(self, port: int):
+        self.port = port
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        return self
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                frame = await reader.readuntil(FRAME_END)
+                if json.loads(frame[:-len(FRAME_END)]).get("msg_type") == "handshake":
+                    if not self.handshakes:
+                        writer.write(b'{"msg_type": "new_conn", "token": "replay"}' + FRAME_END)
+                    else:
+                        writer.write((self.handshakes.pop(0) if len(self.handshakes) > 1 else
+                                      self.handshakes[0]).encode("utf-8"))
+                    self.writers.append(writer)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            if writer in self.writers:
+                self.writers.remove(writer)
+            writer.close()
+
+    def push(self, frame: str):
+        for writer in list(self.writers):
+            if not writer.is_closing():
+                writer.write(frame.encode("utf-8"))
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for writer in list(self.writers):
+            writer.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def synthesize(path: str, seconds: float, torrents: int):
+    """Record a capture against the fake WebUI and inhibitor, with a few bangs clicked along the way"""
+    server = FakeQBittorrentServer(torrents).start()
+    port = free_port()
+    bangs = ["page_right", "page_right", "details_0", "details_tab", "page_left", "sort_dl_speed", "details_close",
+             "action_pause_1", "filter_downloading", "page_right", "sort_added_date", "filter_all"]
+    with tempfile.TemporaryDirectory() as config_dir:
+        with open(os.path.join(config_dir, "secrets.json"), "w") as f:
+            json.dump({"Servers": [{"Username": server.state.username, "Password": server.state.password,
+                                    "Host": server.url, "Name": "nas"}]}, f)
+        with open(os.path.join(config_dir, "settings.json"), "w") as f:
+            json.dump({"filter": "filter_all", "sort_by": "added_on", "reverse": True, "check_updates": False,
+                       "inhibitor_host": "127.0.0.1", "inhibitor_ports": [port, port],
+                       "capture_traffic": os.path.abspath(path)}, f)
+        event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(event_loop)
+        inhibitor = FakeInhibitorServer(main_port=port, alt_port=port)
+        event_loop.run_until_complete(inhibitor.start(alt=False))
+        interface = rm_interface.RainMeterInterface(FakeRainmeter(), event_loop, bench_common.make_logger(),
+                                                    debug=True, config_dir=config_dir)
+
+        async def clicks():
+            for i, bang in enumerate(bangs):
+                await asyncio.sleep(seconds / (len(bangs) + 1))
+                await interface.execute_bang(bang)
+                if i % 3 == 0:
+                    await inhibitor.send_change()
+
+        try:
+            event_loop.run_until_complete(clicks())
+            event_loop.run_until_complete(asyncio.sleep(seconds / (len(bangs) + 1)))
+        finally:
+            event_loop.run_until_complete(interface.tear_down())
+            event_loop.run_until_complete(inhibitor.stop())
+            event_loop.run_until_complete(asyncio.sleep(0.1))  # Let the cancelled tasks finish
+            event_loop.close()
+            server.stop()
+
+
+def replay(records: list, speed: float, settings: dict, profiler: cProfile.Profile = None) -> dict:
+    states = {}
+    handshakes = []
+    for record in records:
+        if record["src"] == "webui":
+            state = states.setdefault(record["server"], ReplayState(record["server"]))
+            if record["endpoint"] != "sync/maindata":
+                state.add(record)
+        elif record["src"] == "inhibitor" and json.loads(record["frame"]).get("msg_type") in ("new_conn",
+                                                                                               "renew_conn"):
+            handshakes.append(record["frame"])
+    webuis = {name: ReplayWebUI(state).start() for name, state in states.items()}
+    port = free_port()
+    refreshes, bang_times = [], []
+    rainmeter = FakeRainmeter()
+    with tempfile.TemporaryDirectory() as config_dir:
+        with open(os.path.join(config_dir, "secrets.json"), "w") as f:
+            json.dump({"Servers": [{"Username": "replay", "Password": "replay", "Host": webui.url, "Name": name}
+                                   for name, webui in webuis.items()]}, f)
+        with open(os.path.join(config_dir, "settings.json"), "w") as f:
+            json.dump(dict(settings, check_updates=False, inhibitor_host="127.0.0.1", inhibitor_ports=[port, port]), f)
+        event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(event_loop)
+        inhibitor = event_loop.run_until_complete(ReplayInhibitor(handshakes).start(port))
+        interface = rm_interface.RainMeterInterface(rainmeter, event_loop, bench_common.make_logger(),
+                                                    debug=True, config_dir=config_dir, autostart=False)
+        interface.supervisor.supervise("inhibitor", lambda: interface.inhibitor_plugin.run(event_loop))
+
+        async def refresh():
+            start = time.perf_counter()
+            await interface.refresh_once()
+            refreshes.append(time.perf_counter() - start)
+
+        async def drive():
+            start = event_loop.time()
+            batch = set()  # Servers with a released response no refresh has picked up yet
+            for record in records:
+                if speed > 0:
+                    delay = start + record["t"] / speed - event_loop.time()
+                    if delay > 0:
+                        if batch:
+                            await refresh()
+                            batch.clear()
+                        await asyncio.sleep(max(0.0, start + record["t"] / speed - event_loop.time()))
+                if record["src"] == "webui" and record["endpoint"] == "sync/maindata":
+                    if record["server"] in batch:
+                        await refresh()
+                        batch.clear()
+                    with states[record["server"]].lock:
+                        states[record["server"]].released.append((record["status"], record["body"]))
+                    batch.add(record["server"])
+                    continue
+                if batch:
+                    await refresh()
+                    batch.clear()
+                if record["src"] == "bang":
+                    bang_start = time.perf_counter()
+                    await interface.execute_bang(record["args"])
+                    bang_times.append(time.perf_counter() - bang_start)
+                elif record["src"] == "inhibitor" and record["frame"] not in handshakes:
+                    inhibitor.push(record["frame"])
+            if batch:
+                await refresh()
+
+        wall = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            event_loop.run_until_complete(drive())
+            if profiler is not None:
+                profiler.disable()
+            wall = time.perf_counter() - wall
+        finally:
+            event_loop.run_until_complete(interface.tear_down())
+            event_loop.run_until_complete(inhibitor.stop())
+            event_loop.close()
+            for webui in webuis.values():
+                webui.stop()
+    return {"refreshes": refreshes, "bangs": bang_times, "wall": wall, "rainmeter": rainmeter,
+            "torrents": sum(len(server.index.torrents) for server in interface.servers)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", nargs="?", help="A traffic capture, Logs/traffic.jsonl.gz by default")
+    parser.add_argument("--session", type=int, default=-1, help="Which capture in the file, the last by default")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 for the recorded timing, 0 for no waiting")
+    parser.add_argument("--settings", default=None, help="settings.json to replay with, sort and filter matter")
+    parser.add_argument("--profile", default=None, help="Write a cProfile of the replay here")
+    parser.add_argument("--synthesize", type=float, default=None, metavar="SECONDS",
+                        help="Record a capture of this long against the fake servers first")
+    parser.add_argument("--torrents", type=int, default=5000, help="Torrents on the fake server for --synthesize")
+    args = parser.parse_args()
+
+    path = args.capture or os.path.join(bench_common.SCRIPTS_DIR, traffic_recorder.default_path)
+    if args.synthesize is not None:
+        path = args.capture or os.path.join(tempfile.gettempdir(), "qbt_synthesized_traffic.jsonl.gz")
+        if os.path.exists(path):
+            os.remove(path)
+        synthesize(path, args.synthesize, args.torrents)
+    captures = traffic_recorder.sessions(path)
+    if not captures:
+        raise SystemExit(f"No captures in {path}")
+    records = captures[args.session]
+    settings = {"filter": "filter_all", "sort_by": "added_on", "reverse": True}
+    if args.settings is not None:
+        with open(args.settings) as f:
+            settings = json.load(f)
+
+    profiler = cProfile.Profile() if args.profile else None
+    result = replay(records, args.speed, settings, profiler)
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+
+    counts = {}
+    for record in records:
+        counts[record["src"]] = counts.get(record["src"], 0) + 1
+    refresh, bang = summarize(result["refreshes"]), summarize(result["bangs"])
+    print_table(f"Replay of {path} (capture {args.session % len(captures) + 1}/{len(captures)}, "
+                f"{records[-1]['t']:.1f}s recorded, speed {args.speed:g})",
+                ["", "count", "p50 ms", "p90 ms", "p99 ms", "max ms"],
+                [["refresh", len(result["refreshes"])] + [f"{refresh[key] * 1000:.1f}"
+                                                         for key in ("p50", "p90", "p99", "max")],
+                 ["bang", len(result["bangs"])] + [f"{bang[key] * 1000:.1f}" for key in ("p50", "p90", "p99", "max")]])
+    print(f"\n{counts.get('webui', 0)} WebUI responses, {counts.get('inhibitor', 0)} inhibitor frames, "
+          f"{counts.get('bang', 0)} bangs replayed in {result['wall']:.2f}s, {result['torrents']} torrents at the end, "
+          f"{result['rainmeter'].execute_calls} RmExecute calls ({result['rainmeter'].execute_bytes} bytes)")
+    if profiler is not None:
+        print(f"\nProfile written to {args.profile}, the top of it:")
+        pstats.Stats(args.profile).sort_stats("cumulative").print_stats(15)
+
+
+if __name__ == "__main__":
+    main()
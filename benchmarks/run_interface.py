@@ -0,0 +1,66 @@
+"""Run the interface headless for a while, its RmLog messages printed instead of going to Rainmeter
+
+    python benchmarks/run_interface.py --seconds 10 --torrents 200
+    python benchmarks/run_interface.py --seconds 60 --config-dir "@Resources/Scripts"
+
+The interface polls the qBittorrent WebUI stand-in, or with --config-dir the servers of the secrets.json there,
+and is updated once a second like the Info measure until it is torn down at the end.
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+
+import bench_common
+from bench_refresh import write_config
+from fake_qbittorrent import FakeQBittorrentServer
+from fake_rainmeter import FakeRainmeter
+
+import rm_interface
+
+
+async def run(interface: rm_interface.RainMeterInterface, seconds: float):
+    for _ in range(int(seconds)):
+        await asyncio.sleep(1.0)
+        interface.update()
+
+
+def start(args, config_dir: str):
+    rm = FakeRainmeter(echo_logs=True)
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
+    interface = rm_interface.RainMeterInterface(rm, event_loop, bench_common.make_logger(logging.INFO), debug=True,
+                                                config_dir=config_dir, rows=args.rows)
+    try:
+        event_loop.run_until_complete(run(interface, args.seconds))
+    finally:
+        event_loop.run_until_complete(interface.tear_down())
+        event_loop.run_until_complete(asyncio.sleep(1.1))  # Let the cancelled tasks finish, wait_for_change naps 1s
+        event_loop.close()
+    print(f"{rm.execute_calls} RmExecute calls, {rm.execute_bytes} bytes")
+
+
+def main(args):
+    if args.config_dir is not None:
+        start(args, args.config_dir)
+        return
+    server = FakeQBittorrentServer(args.torrents).start()
+    try:
+        with tempfile.TemporaryDirectory() as config_dir:
+            write_config(config_dir, [server])
+            start(args, config_dir)
+    finally:
+        server.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--torrents", type=int, default=200, help="Torrents the stand-in serves")
+    parser.add_argument("--rows", type=int, default=4)
+    parser.add_argument("--config-dir", default=None, help="Folder holding secrets.json and settings.json")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
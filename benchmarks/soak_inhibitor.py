@@ -0,0 +1,184 @@
+"""Soak and fuzz InhibitorPlugin against the local inhibitor stand-in
+
+    python benchmarks/soak_inhibitor.py --duration 14400 --rate 5 --fault-every 30
+"""
+import argparse
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+
+import bench_common
+from bench_common import summarize, print_table
+from fake_inhibitor import FakeInhibitorServer
+
+from inhibitor_plugin import InhibitorPlugin
+
+
+class UIConsumer:
+    """Does what RainMeterInterface.wait_for_change does, but records how long each change took to get here"""
+
+    def __init__(self, plugin: InhibitorPlugin, server: FakeInhibitorServer):
+        self.plugin = plugin
+        self.server = server
+        self.latencies = []
+        self.seen = 0
+
+    async def run(self):
+        while True:
+            await self.plugin.get_state_change().wait()
+            self.plugin.get_state_change().clear()
+            message = self.plugin.state.message
+            sent = self.server.sent_at.pop(message, None)
+            if sent is not None:
+                self.latencies.append(time.perf_counter() - sent)
+                self.seen += 1
+
+
+class ConnectionMonitor:
+    """Watches the plugin's connection flag and records how long each outage lasted"""
+
+    def __init__(self, plugin: InhibitorPlugin):
+        self.plugin = plugin
+        self.outages = []
+
+    async def run(self):
+        down_since = None
+        while True:
+            connected = self.plugin.state.connected_to_inhibitor
+            if not connected and down_since is None:
+                down_since = time.perf_counter()
+            elif connected and down_since is not None:
+                self.outages.append(time.perf_counter() - down_since)
+                down_since = None
+            await asyncio.sleep(0.01)
+
+
+async def wait_connected(plugin: InhibitorPlugin, timeout: float):
+    start = time.perf_counter()
+    while not plugin.state.connected_to_inhibitor:
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("Plugin did not connect")
+        await asyncio.sleep(0.01)
+
+
+async def soak(args):
+    rng = random.Random(args.seed)
+    server = await FakeInhibitorServer(main_port=args.main_port, alt_port=args.alt_port).start()
+    updates = []
+
+    async def on_update_available(newest=None, current=None):
+        updates.append((newest, current))
+
+    plugin = InhibitorPlugin(url="127.0.0.1", main_port=args.main_port, alt_port=args.alt_port,
+                             logging=bench_common.make_logger(), on_update_available=on_update_available)
+    loop = asyncio.get_running_loop()
+    plugin_task = loop.create_task(plugin.run(loop))
+    await wait_connected(plugin, 10)
+    consumer = UIConsumer(plugin, server)
+    monitor = ConnectionMonitor(plugin)
+    helper_tasks = [loop.create_task(consumer.run()), loop.create_task(monitor.run())]
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    memory_samples = []
+    faults = {}
+    start = time.perf_counter()
+    next_fault = start + args.fault_every
+    next_sample = start
+
+    async def reopen_main_port():
+        await asyncio.sleep(args.fault_every / 2)
+        await server.open_port(args.main_port)
+
+    try:
+        while time.perf_counter() - start < args.duration:
+            now = time.perf_counter()
+            if now >= next_sample:
+                gc.collect()
+                memory_samples.append((now - start, tracemalloc.get_traced_memory()[0] - baseline))
+                next_sample = now + args.sample_every
+            if args.fault_every and now >= next_fault:
+                fault = rng.choice(["burst", "split", "garbage", "half_close", "drop", "failover", "new_version",
+                                    "restart", "corrupt"])
+                faults[fault] = faults.get(fault, 0) + 1
+                if fault == "burst":
+                    await server.burst(args.burst_size)
+                elif fault == "split":
+                    await server.split_frame()
+                elif fault == "garbage":
+                    await server.garbage()
+                elif fault == "corrupt":
+                    await server.corrupt()
+                elif fault == "new_version":
+                    await server.new_version()
+                elif fault == "half_close":
+                    await server.half_close()
+                elif fault == "drop":
+                    await server.drop_clients()
+                elif fault == "restart":
+                    await server.restart()
+                elif fault == "failover" and args.main_port in server.servers:
+                    await server.close_port(args.main_port)
+                    helper_tasks.append(loop.create_task(reopen_main_port()))
+                next_fault = now + args.fault_every
+            elif plugin.state.connected_to_inhibitor:
+                await server.send_change()
+            await asyncio.sleep(1 / args.rate)
+        # Give the listener time to drain whatever is still queued
+        await asyncio.sleep(2)
+    finally:
+        elapsed = time.perf_counter() - start
+        tracemalloc.stop()
+        plugin.terminate = True
+        for task in [plugin_task] + helper_tasks:
+            task.cancel()
+        if plugin.writer is not None:
+            plugin.writer.close()
+        await server.stop()
+        await asyncio.sleep(0.6)  # The listener only re-checks terminate between messages
+
+    sent = server.seq
+    print_table("Inhibitor soak", ["metric", "value"], [
+        ["duration s", f"{elapsed:.0f}"],
+        ["changes sent", sent],
+        ["changes seen by UI", consumer.seen],
+        ["UI throughput msg/s", f"{consumer.seen / elapsed:.2f}"],
+        ["frames sent", server.frames_sent],
+        ["bytes sent", server.bytes_sent],
+        ["frames received", server.frames_received],
+        ["handshakes", server.handshakes],
+        ["renew_conn handshakes", server.renewals],
+        ["plugin holds the last token", plugin.token == server.last_token],
+        ["new_version callbacks", len(updates)],
+        ["faults", ", ".join(f"{k}={v}" for k, v in sorted(faults.items())) or "none"],
+    ])
+    if consumer.latencies:
+        lat = summarize(consumer.latencies)
+        print_table("State change to UI latency (ms)", ["p50", "p90", "p99", "max"],
+                    [[f"{lat[k] * 1000:.1f}" for k in ("p50", "p90", "p99", "max")]])
+    if monitor.outages:
+        rec = summarize(monitor.outages)
+        print_table("Reconnect time (s)", ["count", "p50", "p90", "max"],
+                    [[len(monitor.outages), f"{rec['p50']:.2f}", f"{rec['p90']:.2f}", f"{rec['max']:.2f}"]])
+    print_table("Traced memory growth since connect", ["t s", "KiB"],
+                [[f"{t:.0f}", f"{m / 1024:.1f}"] for t, m in memory_samples[::max(1, len(memory_samples) // 10)]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of simulated traffic")
+    parser.add_argument("--rate", type=float, default=5, help="State changes per second")
+    parser.add_argument("--fault-every", type=float, default=10, help="Seconds between injected faults, 0 for none")
+    parser.add_argument("--burst-size", type=int, default=50)
+    parser.add_argument("--sample-every", type=float, default=5, help="Seconds between memory samples")
+    parser.add_argument("--main-port", type=int, default=47675)
+    parser.add_argument("--alt-port", type=int, default=47676)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(soak(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()